@@ -0,0 +1,100 @@
+'''
+Benchmark suite for Open Beep Detect. Results are written as JSON so that runs from different commits can be compared.
+
+Usage:
+
+```shell
+python -m beep_detect.bench -o results.json
+python -m beep_detect.bench --quick --compare results.json
+```
+'''
+import argparse
+import json
+import logging as log
+import platform
+import subprocess
+import sys
+import time
+import warnings
+
+import numpy as np
+import scipy
+
+from beep_detect.bench.recordings import run_recordings_suite
+from beep_detect.bench.throughput import run_throughput_suite
+
+def git_commit() -> str | None:
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+  '''
+  Describe every benchmark whose throughput in audio-seconds per second dropped by more than `threshold` (relative) compared to the baseline
+  '''
+  baseline_by_name = { r['name']: r for r in baseline['results'] }
+  regressions = []
+  for result in results['results']:
+    previous = baseline_by_name.get(result['name'])
+    if previous is None:
+      continue
+    ratio = result['audio_s_per_s'] / previous['audio_s_per_s']
+    if ratio < 1 - threshold:
+      regressions.append(f'{result["name"]}: {previous["audio_s_per_s"]:.1f} -> {result["audio_s_per_s"]:.1f} audio-s/s ({ratio - 1:+.0%})')
+
+  return regressions
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description='Benchmark beep detection throughput and latency')
+  parser.add_argument('-o', '--output', default='-', help='File to write JSON results to (default stdout)')
+  parser.add_argument('--quick', action='store_true', help='Run a reduced set of configurations')
+  parser.add_argument('--suite', choices=['throughput', 'recordings'], action='append', help='Suites to run (default all)')
+  parser.add_argument('--compare', help='JSON results from a previous run to compare against')
+  parser.add_argument('--threshold', type=float, default=0.1, help='Relative drop in throughput reported as a regression')
+  args = parser.parse_args(argv)
+
+  log.basicConfig(level=log.WARNING, stream=sys.stderr)
+  warnings.simplefilter('ignore', RuntimeWarning) # log10 of silent bins
+  suites = args.suite or ['throughput', 'recordings']
+  repeats = 1 if args.quick else 3
+
+  results = []
+  if 'throughput' in suites:
+    if args.quick:
+      results += run_throughput_suite(chunk_lengths=(2048,), fingerprint_counts=(1, 100), repeats=repeats)
+    else:
+      results += run_throughput_suite(repeats=repeats)
+  if 'recordings' in suites:
+    results += run_recordings_suite(repeats=repeats)
+
+  output = {
+    'commit': git_commit(),
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'platform': platform.platform(),
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'scipy': scipy.__version__,
+    'results': results
+  }
+
+  if args.output == '-':
+    json.dump(output, sys.stdout, indent=2)
+    print()
+  else:
+    with open(args.output, 'w') as f:
+      json.dump(output, f, indent=2)
+
+  for result in results:
+    print(f'{result["name"]}: {result["audio_s_per_s"]:.1f} audio-s/s', file=sys.stderr)
+
+  if args.compare is not None:
+    with open(args.compare, 'r') as f:
+      regressions = compare(output, json.load(f), args.threshold)
+    for regression in regressions:
+      print(f'REGRESSION {regression}', file=sys.stderr)
+    if len(regressions) > 0:
+      sys.exit(1)
+
+if __name__ == '__main__':
+  main()
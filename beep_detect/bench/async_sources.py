@@ -0,0 +1,118 @@
+'''
+Drive many sources from one event loop with `AsyncDetector`: every bundled recording several times over, half read from the file and half streamed through a local TCP socket. Checks that each source finds the same matches as `FileInputRunner`, and reports throughput and the worst delay seen by another task on the loop.
+
+Usage:
+
+```shell
+python -m beep_detect.bench.async_sources
+python -m beep_detect.bench.async_sources --copies 8 --speed 4
+```
+'''
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import warnings
+from timeit import default_timer as timer
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.async_detector import AsyncDetector, AsyncStreamSource, AsyncWavSource
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.wav_source import WavSource
+
+
+async def serve_file(file_name: str, writer: asyncio.StreamWriter) -> None:
+  '''
+  Send the samples of a .wav file over a socket in uneven pieces, waiting whenever the reader pushes back
+  '''
+  with WavSource(file_name) as source:
+    data = source.samples.tobytes()
+  for start in range(0, len(data), 3001):
+    writer.write(data[start:start + 3001])
+    await writer.drain()
+  writer.close()
+  await writer.wait_closed()
+
+async def measure_loop_lag(stopping: asyncio.Event, interval_s: float = 0.005) -> float:
+  '''
+  Worst lateness in seconds of a task waking up every `interval_s`
+  '''
+  loop = asyncio.get_running_loop()
+  worst_s = 0.
+  while not stopping.is_set():
+    expected = loop.time() + interval_s
+    await asyncio.sleep(interval_s)
+    worst_s = max(worst_s, loop.time() - expected)
+  return worst_s
+
+async def run(file_names: list[str], copies: int, speed: float, matcher: str) -> bool:
+  detector = AsyncDetector(EXAMPLE_FINGERPRINTS, matcher=matcher)
+
+  # Every stream source connects to one server, which sends it the file named in its first line
+  async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    file_name = (await reader.readline()).decode().strip()
+    await serve_file(file_name, writer)
+  server = await asyncio.start_server(handle_connection, '127.0.0.1', 0)
+  port = server.sockets[0].getsockname()[1]
+
+  # Writers are kept until the end, as the connection is closed once its writer is garbage collected
+  writers: list[asyncio.StreamWriter] = []
+  async def stream_source(file_name: str) -> AsyncStreamSource:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(file_name.encode() + b'\n')
+    writers.append(writer)
+    with WavSource(file_name) as source:
+      return AsyncStreamSource(reader, source.sample_rate)
+
+  async def collect(file_name: str, use_socket: bool) -> tuple[str, str, list]:
+    source = await stream_source(file_name) if use_socket else AsyncWavSource(file_name, speed)
+    return file_name, 'socket' if use_socket else 'file', [match async for match in detector.matches(source)]
+
+  stopping = asyncio.Event()
+  lag_task = asyncio.create_task(measure_loop_lag(stopping))
+  start_time = timer()
+  results = await asyncio.gather(*[collect(file_name, i_copy % 2 == 1) for file_name in file_names for i_copy in range(copies)])
+  duration_s = timer() - start_time
+  stopping.set()
+  worst_lag_s = await lag_task
+  for writer in writers:
+    writer.close()
+  server.close()
+
+  all_agree = True
+  audio_duration_s = 0.
+  for file_name in file_names:
+    runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, matcher=matcher)
+    reference = list(runner.iter_matches())
+    audio_duration_s += copies * runner.source.n_frames / runner.input_sample_rate
+    runner.source.close()
+    for result_file_name, kind, events in results:
+      if result_file_name == file_name:
+        agree = events == reference
+        all_agree &= agree
+        if not agree:
+          print(f'  {os.path.basename(file_name)} from {kind}: DIFFERENT matches {events} vs {reference}')
+
+  print(
+    f'{len(results)} sources on one loop: {audio_duration_s:.1f}s of audio in {duration_s:.3f}s '
+    f'({audio_duration_s / duration_s:.1f} audio-seconds per second), worst loop lag {worst_lag_s * 1e3:.1f}ms, '
+    f'{"same matches as FileInputRunner" if all_agree else "DIFFERENT matches"}'
+  )
+  return all_agree
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Drive many sources from one event loop')
+  parser.add_argument('--copies', type=int, default=4, help='Sources per recording')
+  parser.add_argument('--speed', type=float, default=float('inf'), help='Pace of file sources relative to real time')
+  parser.add_argument('--matcher', choices=['dict', 'compiled'], default='compiled')
+  args = parser.parse_args()
+
+  warnings.simplefilter('ignore', RuntimeWarning) # log10 of silent bins
+
+  file_names = sorted(glob.glob(os.path.join(DATA_DIR, '*.wav')))
+  sys.exit(0 if asyncio.run(run(file_names, args.copies, args.speed, args.matcher)) else 1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,55 @@
+'''
+Compare the spectrum backends of `ChunkProcessor` on the bundled recordings.
+
+Usage:
+
+```shell
+python -m beep_detect.bench.backends
+```
+'''
+import glob
+import os
+import warnings
+from timeit import default_timer as timer
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.wav_source import WavSource
+
+
+def time_backend(file_name: str, spectrum_backend: str, batch: bool, chunk_length: int = 2048, repeats: int = 5) -> tuple[float, list]:
+  '''
+  Best time per chunk over several runs, in microseconds, and the matches found
+  '''
+  with WavSource(file_name) as source:
+    _, chunks = next(source.iter_blocks(chunk_length, block_chunks=source.n_chunks(chunk_length)))
+    sample_rate = source.sample_rate
+
+  best_s = float('inf')
+  for _ in range(repeats):
+    processor = ChunkProcessor(EXAMPLE_FINGERPRINTS, sample_rate, chunk_length, matcher='compiled', spectrum_backend=spectrum_backend)
+    start_time = timer()
+    if batch:
+      results = processor.analyse_chunks_for_matches(chunks)
+    else:
+      results = [processor.analyse_chunk_for_match(chunk) for chunk in chunks]
+    best_s = min(best_s, timer() - start_time)
+
+  matches = [(i_chunk, sorted(r)) for i_chunk, r in enumerate(results) if len(r) > 0]
+  return best_s / len(chunks) * 1e6, matches
+
+def main() -> None:
+  warnings.simplefilter('ignore', RuntimeWarning) # log10 of silent bins
+
+  for file_name in sorted(glob.glob(os.path.join(DATA_DIR, '*.wav'))):
+    print(os.path.basename(file_name))
+    for batch in (False, True):
+      fft_us, fft_matches = time_backend(file_name, 'fft', batch)
+      targeted_us, targeted_matches = time_backend(file_name, 'targeted', batch)
+      mode = 'batch' if batch else 'per-chunk'
+      agree = 'same matches' if fft_matches == targeted_matches else f'DIFFERENT matches: {fft_matches} vs {targeted_matches}'
+      print(f'  {mode:>9}: fft {fft_us:7.1f}us/chunk, targeted {targeted_us:7.1f}us/chunk ({fft_us / targeted_us:.1f}x), {agree}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,45 @@
+import random
+from beep_detect.core.types import FingerprintInMs
+
+EXAMPLE_FINGERPRINTS: dict[str, FingerprintInMs] = {
+  'washing': {
+    'repetitions': 5,
+    'max_period_ms': 1400,
+    'pattern': [
+      { 'type': 'sine', 'frequency': 3300, 'start_ms': 0, 'end_ms': 400 },
+      { 'type': 'any', 'start_ms': 401, 'end_ms': 800 }
+    ]
+  },
+  'microwave': {
+    'repetitions': 5,
+    'max_period_ms': 1000,
+    'pattern': [
+      { 'type': 'sine', 'frequency': 2030, 'start_ms': 0, 'end_ms': 150 },
+      { 'type': 'any', 'start_ms': 151, 'end_ms': 400 }
+    ]
+  },
+}
+
+def random_fingerprints(n: int, seed: int = 0) -> dict[str, FingerprintInMs]:
+  '''
+  Generate `n` plausible appliance fingerprints: one to three beeps between 500Hz and 8kHz, each followed by a gap
+  '''
+  rng = random.Random(seed)
+  fingerprints: dict[str, FingerprintInMs] = {}
+  for i in range(n):
+    pattern = []
+    t_ms = 0
+    for _ in range(rng.randint(1, 3)):
+      beep_ms = rng.randint(100, 500)
+      gap_ms = rng.randint(100, 400)
+      pattern.append({ 'type': 'sine', 'frequency': rng.randint(500, 8000), 'start_ms': t_ms, 'end_ms': t_ms + beep_ms })
+      pattern.append({ 'type': 'any', 'start_ms': t_ms + beep_ms + 1, 'end_ms': t_ms + beep_ms + gap_ms })
+      t_ms += beep_ms + gap_ms + 1
+
+    fingerprints[f'random-{i}'] = {
+      'repetitions': rng.randint(2, 5),
+      'max_period_ms': rng.randint(500, 1500),
+      'pattern': pattern
+    }
+
+  return fingerprints
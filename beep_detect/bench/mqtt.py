@@ -0,0 +1,76 @@
+'''
+Exercise `MqttPublisher` against a stand-in broker, or a real one: publish a burst of match events through a slow broker, an outage and a reconnect, and report how long `publish_match` held up the caller and whether events arrived in order.
+
+Usage:
+
+```shell
+python -m beep_detect.bench.mqtt
+python -m beep_detect.bench.mqtt --host localhost
+```
+'''
+import argparse
+import json
+import logging as log
+import time
+from timeit import default_timer as timer
+
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.mqtt_publisher import InProcessBroker, MqttPublisher
+
+
+def publish_events(publisher: MqttPublisher, n_events: int, interval_s: float) -> float:
+  '''
+  Publish `n_events` events spaced by `interval_s`, returning the longest `publish_match` call in microseconds
+  '''
+  worst_us = 0.
+  for i in range(n_events):
+    start_time = timer()
+    publisher.publish_match(f'event_{i}', source_id='bench')
+    worst_us = max(worst_us, (timer() - start_time) * 1e6)
+    time.sleep(interval_s)
+  return worst_us
+
+def run_stand_in(n_events: int, max_queue: int) -> None:
+  broker = InProcessBroker(ack_delay_s=0.005)
+  publisher = MqttPublisher(client_factory=broker.connect, max_queue=max_queue, min_backoff_s=0.05, max_backoff_s=0.4, metrics=Metrics('mqtt-bench'))
+  publisher.start()
+
+  worst_us = publish_events(publisher, n_events, 0.001)
+  print(f'Connected:    worst publish_match {worst_us:.0f}us, {publisher.stats}')
+
+  broker.set_online(False)
+  worst_us = publish_events(publisher, n_events, 0.001)
+  print(f'Broker down:  worst publish_match {worst_us:.0f}us, {publisher.stats}')
+
+  broker.set_online(True)
+  publisher.stop(flush_timeout_s=5)
+  print(f'Reconnected:  {publisher.stats}')
+
+  ids = [json.loads(payload)['fingerprint_id'] for _, payload, _, _ in broker.messages]
+  indices = [int(id.split('_')[1]) for id in ids]
+  in_order = all(a < b for a, b in zip(indices[n_events:], indices[n_events + 1:]))
+  print(f'Broker received {len(ids)} events in {broker.connects} connections, second burst in order: {in_order}')
+
+def run_broker(host: str, port: int, n_events: int, max_queue: int) -> None:
+  publisher = MqttPublisher(host, port, max_queue=max_queue, metrics=Metrics('mqtt-bench'))
+  publisher.start()
+  worst_us = publish_events(publisher, n_events, 0.001)
+  publisher.stop(flush_timeout_s=10)
+  print(f'Worst publish_match {worst_us:.0f}us, {publisher.stats}')
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Exercise the MQTT publisher')
+  parser.add_argument('--host', help='Publish to this broker rather than an in-process stand-in')
+  parser.add_argument('--port', type=int, default=1883)
+  parser.add_argument('-n', '--events', type=int, default=500, help='Events per burst')
+  parser.add_argument('--max-queue', type=int, default=256)
+  args = parser.parse_args()
+
+  log.basicConfig(level=log.WARNING)
+  if args.host is None:
+    run_stand_in(args.events, args.max_queue)
+  else:
+    run_broker(args.host, args.port, args.events, args.max_queue)
+
+if __name__ == '__main__':
+  main()
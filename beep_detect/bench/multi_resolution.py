@@ -0,0 +1,123 @@
+'''
+Compare `MultiResolutionProcessor` with a single `ChunkProcessor`: matches and speed on the bundled recordings, FFT work per second of audio, and detection of synthetic fingerprints which a single chunk length suits badly, such as short, high beeps and long, low tones. Both use a Hann window by default, with which they find the same matches in the bundled recordings (see `MultiResolutionProcessor`).
+
+Usage:
+
+```shell
+python -m beep_detect.bench.multi_resolution
+python -m beep_detect.bench.multi_resolution --window none
+```
+'''
+import argparse
+import glob
+import os
+import warnings
+from math import log2
+from timeit import default_timer as timer
+
+import numpy as np
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.bench.synthetic import render_fingerprint
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.multi_resolution import MultiResolutionProcessor
+from beep_detect.core.time_conversion import chunks_to_s
+from beep_detect.core.types import FingerprintInMs
+from beep_detect.core.wav_source import WavSource
+
+SYNTHETIC_FINGERPRINTS: dict[str, FingerprintInMs] = {
+  'short': {
+    'repetitions': 6,
+    'max_period_ms': 300,
+    'pattern': [
+      { 'type': 'sine', 'frequency': 3000, 'start_ms': 0, 'end_ms': 60 },
+      { 'type': 'any', 'start_ms': 61, 'end_ms': 140 }
+    ]
+  },
+  'low': {
+    'repetitions': 3,
+    'max_period_ms': 1000,
+    'pattern': [
+      { 'type': 'sine', 'frequency': 400, 'start_ms': 0, 'end_ms': 300 },
+      { 'type': 'any', 'start_ms': 301, 'end_ms': 600 }
+    ]
+  }
+}
+
+def fft_work(processor: ChunkProcessor | MultiResolutionProcessor) -> float:
+  '''
+  Approximate FFT operations per second of audio, N log2 N per chunk of N samples
+  '''
+  if isinstance(processor, ChunkProcessor):
+    return processor.sample_rate / processor.hop_length * processor.chunk_length * log2(processor.chunk_length)
+  return sum(fft_work(group.chunk_processor) for group in processor.groups)
+
+def analyse(processor: ChunkProcessor | MultiResolutionProcessor, samples: np.ndarray, chunk_length: int) -> tuple[list[tuple[str, float]], float]:
+  '''
+  Matches with their times, and seconds taken, analysing in blocks of 64 chunks
+  '''
+  chunks = samples[:len(samples) // chunk_length * chunk_length].reshape(-1, chunk_length)
+  start_time = timer()
+  results = [r for i in range(0, len(chunks), 64) for r in processor.analyse_chunks_for_matches(chunks[i:i + 64])]
+  duration_s = timer() - start_time
+  matches = [(id, round(chunks_to_s(i_chunk + 1, processor.sample_rate, chunk_length), 3)) for i_chunk, r in enumerate(results) for id in sorted(r)]
+  return matches, duration_s
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Compare multi-resolution analysis with a single chunk length')
+  parser.add_argument('--chunk-length', type=int, default=2048)
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--window', default='hann', help='Analysis window, or "none"')
+  args = parser.parse_args()
+  # A window of None would default to Hann in the decimated groups
+  window = 'boxcar' if args.window == 'none' else args.window
+
+  warnings.simplefilter('ignore', RuntimeWarning) # log10 of silent bins
+
+  print('Bundled recordings')
+  for file_name in sorted(glob.glob(os.path.join(DATA_DIR, '*.wav'))):
+    with WavSource(file_name) as source:
+      samples = np.array(source.samples)
+      sample_rate = source.sample_rate
+    for name, create in (
+      ('single', lambda: ChunkProcessor(EXAMPLE_FINGERPRINTS, sample_rate, args.chunk_length, matcher='compiled', window=window)),
+      ('multi', lambda: MultiResolutionProcessor(EXAMPLE_FINGERPRINTS, sample_rate, args.chunk_length, matcher='compiled', window=window))
+    ):
+      best_s = float('inf')
+      for _ in range(args.repeats):
+        processor = create()
+        matches, duration_s = analyse(processor, samples, args.chunk_length)
+        best_s = min(best_s, duration_s)
+      print(f'  {os.path.basename(file_name):>40} {name:>6}: {len(samples) / sample_rate / best_s:7.1f} audio-s/s, {fft_work(processor) / 1e6:5.2f}M FFT ops per audio-s, matches {matches}')
+
+  # Each synthetic fingerprint is rendered and detected on its own. It should match once, when the pattern of the
+  # last repetition ends. Any other match is counted as false: a fingerprint of a single tone is also matched by peaks
+  # in the white noise now and then.
+  print('Synthetic fingerprints, rendered at 48kHz with 5ms jitter')
+  sample_rate = 48000
+  for k, fingerprint in SYNTHETIC_FINGERPRINTS.items():
+    fingerprints = { k: fingerprint }
+    counts = { 'single': 0, 'multi': 0 }
+    false_matches = { 'single': 0, 'multi': 0 }
+    errors: dict[str, list[float]] = { 'single': [], 'multi': [] }
+    for seed in range(5):
+      pattern_ms = max(section['end_ms'] for section in fingerprint['pattern'])
+      period_ms = pattern_ms + fingerprint['max_period_ms'] / 2
+      samples = render_fingerprint(fingerprint, sample_rate, jitter_ms=5, seed=seed)
+      expected_s = 1 + 1e-3 * (period_ms * (fingerprint['repetitions'] - 1) + pattern_ms)
+      for name, processor in (
+        ('single', ChunkProcessor(fingerprints, sample_rate, args.chunk_length, matcher='compiled', window=window)),
+        ('multi', MultiResolutionProcessor(fingerprints, sample_rate, args.chunk_length, matcher='compiled', window=window))
+      ):
+        matches = [t for _, t in analyse(processor, samples, args.chunk_length)[0]]
+        hits = [t for t in matches if abs(t - expected_s) < 0.1]
+        if len(hits) > 0:
+          counts[name] += 1
+          errors[name].append(hits[0] - expected_s)
+        false_matches[name] += len(matches) - len(hits)
+    summary = lambda name: f'{name} {counts[name]}/5 detected' + (f' {1e3 * np.mean(np.abs(errors[name])):4.1f}ms from the end of the pattern' if len(errors[name]) > 0 else '') + f' with {false_matches[name]} false matches'
+    print(f'  {k:>6}: {summary("single")}, {summary("multi")}')
+
+if __name__ == '__main__':
+  main()
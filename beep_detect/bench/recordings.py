@@ -0,0 +1,52 @@
+import glob
+import os
+from timeit import default_timer as timer
+from typing import TypedDict
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.time_conversion import chunks_to_s
+from beep_detect.core.types import MatchEvent
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'data'))
+
+class RecordingResult(TypedDict):
+  name: str
+  file: str
+  matcher: str
+  spectrum_backend: str
+  audio_s_per_s: float
+  events: list[MatchEvent]
+
+def run_recordings_suite(
+    matchers: tuple[str, ...] = ('dict', 'compiled'),
+    spectrum_backends: tuple[str, ...] = ('fft', 'targeted'),
+    chunk_length: int = 2048,
+    repeats: int = 3
+  ) -> list[RecordingResult]:
+  '''
+  Run the example fingerprints end to end over every .wav file in `data/` with `FileInputRunner`, keeping the fastest of several runs
+  '''
+  results = []
+  for file_name in sorted(glob.glob(os.path.join(DATA_DIR, '*.wav'))):
+    for matcher in matchers:
+      for spectrum_backend in spectrum_backends:
+        best_s = float('inf')
+        for _ in range(repeats):
+          runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, chunk_length, matcher=matcher, spectrum_backend=spectrum_backend)
+          start_time = timer()
+          events = list(runner.iter_matches())
+          best_s = min(best_s, timer() - start_time)
+          audio_duration_s = chunks_to_s(runner.source.n_chunks(chunk_length), runner.input_sample_rate, chunk_length)
+          runner.source.close()
+
+        results.append({
+          'name': f'recording/{matcher}/{spectrum_backend}/{os.path.basename(file_name)}',
+          'file': os.path.basename(file_name),
+          'matcher': matcher,
+          'spectrum_backend': spectrum_backend,
+          'audio_s_per_s': audio_duration_s / best_s,
+          'events': events
+        })
+
+  return results
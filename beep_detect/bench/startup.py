@@ -0,0 +1,107 @@
+'''
+Time cold start: interpreter start, importing the detection modules, loading fingerprints and constructing a `ChunkProcessor`, and analysing the first chunk. Each measurement is taken in a fresh interpreter, with SciPy and with `BEEP_DETECT_NUMPY_ONLY`, and with the fingerprint file parsed or loaded from its compiled form. Also checks that the NumPy-only path finds the same matches in the bundled recordings.
+
+Usage:
+
+```shell
+python -m beep_detect.bench.startup
+python -m beep_detect.bench.startup --runs 10
+```
+'''
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from timeit import default_timer as timer
+
+import beep_detect.core
+
+# The fingerprints used by main.py
+FINGERPRINTS_FILE = os.path.join(os.path.dirname(beep_detect.core.__file__), 'fingerprints.toml')
+
+# Run in a fresh interpreter, with the fingerprint file and whether to use its compiled form as arguments
+STARTUP_SCRIPT = '''
+import sys, json
+from timeit import default_timer as timer
+start_time = timer()
+import numpy as np
+numpy_time = timer()
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.fingerprint_config import load_fingerprints, load_plan
+import_time = timer()
+if sys.argv[2] == 'compiled':
+  plan = load_plan(sys.argv[1], 48000, 2048)
+  processor = ChunkProcessor(plan.fingerprints, 48000, 2048, plan=plan)
+else:
+  processor = ChunkProcessor(load_fingerprints(sys.argv[1]), 48000, 2048)
+init_time = timer()
+processor.analyse_chunk_for_match(np.random.default_rng(0).integers(-100, 100, 2048, dtype=np.int16))
+first_chunk_time = timer()
+print(json.dumps({
+  'import_numpy': numpy_time - start_time,
+  'import_detection': import_time - numpy_time,
+  'init': init_time - import_time,
+  'first_chunk': first_chunk_time - init_time,
+  'scipy_loaded': any(m.startswith('scipy') for m in sys.modules)
+}))
+'''
+
+# Run in a fresh interpreter, printing the matches in every bundled recording
+MATCHES_SCRIPT = '''
+import glob, json, os, warnings
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.file_input_runner import FileInputRunner
+warnings.simplefilter('ignore', RuntimeWarning)
+matches = {}
+for file_name in sorted(glob.glob(os.path.join(DATA_DIR, '*.wav'))):
+  for settings in ({}, { 'spectrum_backend': 'targeted' }, { 'hop_length': 1024, 'window': 'hann' }, { 'multi_resolution': True }):
+    runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, **settings)
+    matches[f'{os.path.basename(file_name)} {settings}'] = list(runner.iter_matches())
+    runner.source.close()
+print(json.dumps(matches))
+'''
+
+def run_script(script: str, args: list[str], numpy_only: bool) -> tuple[str, float]:
+  '''
+  Output of a script run in a fresh interpreter, and the seconds it took including interpreter start
+  '''
+  env = dict(os.environ, BEEP_DETECT_NUMPY_ONLY='1' if numpy_only else '0')
+  start_time = timer()
+  output = subprocess.run([sys.executable, '-c', script, *args], env=env, capture_output=True, text=True, check=True).stdout
+  return output, timer() - start_time
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Time cold start of detection')
+  parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per configuration, of which the median is reported')
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as directory:
+    # A copy, so that its compiled form is cached in the temporary directory
+    file_name = os.path.join(directory, os.path.basename(FINGERPRINTS_FILE))
+    shutil.copy(FINGERPRINTS_FILE, file_name)
+
+    print(f'Median of {args.runs} runs, in ms')
+    print(f'{"":>33} {"total":>7} {"numpy":>7} {"import":>7} {"init":>7} {"chunk 1":>7}')
+    for numpy_only in (False, True):
+      for load in ('parsed', 'compiled'):
+        runs = []
+        for _ in range(args.runs):
+          output, total_s = run_script(STARTUP_SCRIPT, [file_name, load], numpy_only)
+          runs.append({ **json.loads(output), 'total': total_s })
+        name = f'{"numpy only" if numpy_only else "scipy"}, {load} fingerprints'
+        timings = [1e3 * median(run[k] for run in runs) for k in ('total', 'import_numpy', 'import_detection', 'init', 'first_chunk')]
+        print(f'{name:>33} ' + ' '.join(f'{t:7.1f}' for t in timings) + ('' if runs[0]['scipy_loaded'] else '  (SciPy never imported)'))
+
+  scipy_matches = json.loads(run_script(MATCHES_SCRIPT, [], False)[0])
+  numpy_matches = json.loads(run_script(MATCHES_SCRIPT, [], True)[0])
+  different = [k for k in scipy_matches if scipy_matches[k] != numpy_matches[k]]
+  print('NumPy-only matches in bundled recordings: ' + ('same as with SciPy' if len(different) == 0 else f'DIFFERENT for {different}'))
+  sys.exit(0 if len(different) == 0 else 1)
+
+if __name__ == '__main__':
+  main()
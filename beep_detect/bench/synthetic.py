@@ -0,0 +1,66 @@
+import wave
+import numpy as np
+from beep_detect.core.types import FingerprintInMs
+
+def render_fingerprint(
+    fingerprint: FingerprintInMs,
+    sample_rate: int,
+    level_db: float = -20,
+    noise_db: float | None = -50,
+    jitter_ms: float = 0,
+    lead_in_s: float = 1,
+    lead_out_s: float = 1,
+    period_ms: float | None = None,
+    seed: int = 0
+  ) -> np.ndarray:
+  '''
+  Render a fingerprint as 16-bit mono audio: every repetition of the pattern, with a sine tone for each sine section and silence (or noise) for each `any` section
+
+  ## Args:
+
+  - fingerprint (FingerprintInMs): Fingerprint to render
+  - sample_rate (int): Sample rate in Hz
+  - level_db (float, default -20): Level of the tones in dB relative to full scale
+  - noise_db (float, default -50): Level of white noise added throughout, in dB relative to full scale. `None` for no noise.
+  - jitter_ms (float, default 0): Each repetition starts up to this many ms early or late
+  - lead_in_s (float, default 1): Audio before the first repetition
+  - lead_out_s (float, default 1): Audio after the last repetition
+  - period_ms (float, default None): Time from the start of one repetition to the start of the next. Defaults to halfway between back-to-back repetitions and the longest period the fingerprint allows.
+  - seed (int, default 0): Seed for noise and jitter
+
+  ## Returns:
+
+  - (np.ndarray): int16 samples
+  '''
+  rng = np.random.default_rng(seed)
+  pattern_ms = max(section['end_ms'] for section in fingerprint['pattern'])
+  if period_ms is None:
+    period_ms = pattern_ms + fingerprint['max_period_ms'] / 2
+
+  n_samples = int(sample_rate * (lead_in_s + lead_out_s + 1e-3 * (period_ms * (fingerprint['repetitions'] - 1) + pattern_ms + jitter_ms)))
+  signal = np.zeros(n_samples)
+  if noise_db is not None:
+    signal += rng.normal(scale=10 ** (noise_db / 20), size=n_samples)
+
+  amplitude = 10 ** (level_db / 20)
+  for i_repetition in range(fingerprint['repetitions']):
+    start_ms = 1e3 * lead_in_s + i_repetition * period_ms + rng.uniform(-jitter_ms, jitter_ms)
+    for section in fingerprint['pattern']:
+      if section['type'] != 'sine':
+        continue
+      i_start = int(1e-3 * sample_rate * (start_ms + section['start_ms']))
+      i_end = int(1e-3 * sample_rate * (start_ms + section['end_ms']))
+      t = np.arange(i_end - i_start) / sample_rate
+      signal[i_start:i_end] += amplitude * np.sin(2 * np.pi * section['frequency'] * t)
+
+  return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+def write_wav(file_name: str, samples: np.ndarray, sample_rate: int) -> None:
+  '''
+  Write int16 samples to a mono .wav file
+  '''
+  with wave.open(file_name, 'wb') as wf:
+    wf.setnchannels(1)
+    wf.setsampwidth(2)
+    wf.setframerate(sample_rate)
+    wf.writeframes(samples.astype('<i2').tobytes())
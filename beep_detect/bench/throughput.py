@@ -0,0 +1,102 @@
+import numpy as np
+from timeit import default_timer as timer
+from typing import TypedDict
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS, random_fingerprints
+from beep_detect.bench.synthetic import render_fingerprint
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.types import FingerprintInMs
+from beep_detect.core.wav_source import SAMPLE_DTYPE
+
+class ThroughputResult(TypedDict):
+  name: str
+  chunk_length: int
+  n_fingerprints: int
+  matcher: str
+  spectrum_backend: str
+  batch: bool
+  chunks_per_s: float
+  audio_s_per_s: float
+  latency_p50_us: float | None
+  latency_p90_us: float | None
+  latency_p99_us: float | None
+  matches: int
+
+def bench_chunk_processor(
+    fingerprints: dict[str, FingerprintInMs],
+    samples: np.ndarray,
+    sample_rate: int,
+    chunk_length: int,
+    batch: bool,
+    repeats: int = 3,
+    matcher: str = 'dict',
+    spectrum_backend: str = 'fft'
+  ) -> ThroughputResult:
+  '''
+  Measure how fast a fresh `ChunkProcessor` analyses `samples`, keeping the fastest of several runs. Per-chunk latency percentiles are only measured when analysing one chunk at a time.
+  '''
+  n_chunks = len(samples) // chunk_length
+  chunks = samples[:n_chunks * chunk_length].view(SAMPLE_DTYPE).reshape(n_chunks, chunk_length)
+
+  best_s = float('inf')
+  best_latencies_s = None
+  matches = 0
+  for _ in range(repeats):
+    processor = ChunkProcessor(fingerprints, sample_rate, chunk_length, matcher=matcher, spectrum_backend=spectrum_backend)
+    if batch:
+      start_time = timer()
+      results = processor.analyse_chunks_for_matches(chunks)
+      duration_s = timer() - start_time
+      latencies_s = None
+    else:
+      latencies_s = np.zeros(n_chunks)
+      results = []
+      for i_chunk, chunk in enumerate(chunks):
+        start_time = timer()
+        results.append(processor.analyse_chunk_for_match(chunk))
+        latencies_s[i_chunk] = timer() - start_time
+      duration_s = latencies_s.sum()
+
+    matches = sum(len(r) for r in results)
+    if duration_s < best_s:
+      best_s = duration_s
+      best_latencies_s = latencies_s
+
+  percentile = lambda q: None if best_latencies_s is None else float(np.percentile(best_latencies_s, q) * 1e6)
+  return {
+    'name': f'throughput/{matcher}/{spectrum_backend}/{"batch" if batch else "per-chunk"}/chunk{chunk_length}/fp{len(fingerprints)}',
+    'chunk_length': chunk_length,
+    'n_fingerprints': len(fingerprints),
+    'matcher': matcher,
+    'spectrum_backend': spectrum_backend,
+    'batch': batch,
+    'chunks_per_s': n_chunks / best_s,
+    'audio_s_per_s': n_chunks * chunk_length / sample_rate / best_s,
+    'latency_p50_us': percentile(50),
+    'latency_p90_us': percentile(90),
+    'latency_p99_us': percentile(99),
+    'matches': matches
+  }
+
+def run_throughput_suite(
+    chunk_lengths: tuple[int, ...] = (512, 1024, 2048, 4096),
+    fingerprint_counts: tuple[int, ...] = (1, 10, 100, 500),
+    matchers: tuple[str, ...] = ('dict', 'compiled'),
+    spectrum_backends: tuple[str, ...] = ('fft', 'targeted'),
+    sample_rate: int = 48000,
+    repeats: int = 3
+  ) -> list[ThroughputResult]:
+  '''
+  Benchmark `ChunkProcessor` on a synthetic recording of the washing machine fingerprint, for every combination of chunk length, fingerprint count, matcher and spectrum backend, both per chunk and in batch. Beyond the first, fingerprints are randomly generated.
+  '''
+  samples = render_fingerprint(EXAMPLE_FINGERPRINTS['washing'], sample_rate, noise_db=-40, jitter_ms=20)
+  results = []
+  for n_fingerprints in fingerprint_counts:
+    fingerprints = { 'washing': EXAMPLE_FINGERPRINTS['washing'], **random_fingerprints(n_fingerprints - 1) }
+    for chunk_length in chunk_lengths:
+      for matcher in matchers:
+        for spectrum_backend in spectrum_backends:
+          for batch in (False, True):
+            results.append(bench_chunk_processor(fingerprints, samples, sample_rate, chunk_length, batch, repeats, matcher, spectrum_backend))
+
+  return results
@@ -0,0 +1,231 @@
+import asyncio
+import numpy as np
+import logging as log
+import time
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import aclosing
+from typing import AsyncIterator, Protocol
+
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.rechunker import Rechunker
+from beep_detect.core.time_conversion import chunks_to_s
+from beep_detect.core.types import FingerprintInMs, MatchEvent
+from beep_detect.core.wav_source import SAMPLE_DTYPE, WavSource
+
+class AsyncChunkSource(Protocol):
+    '''
+    Source of audio for `AsyncDetector`
+    '''
+    sample_rate: int
+
+    def chunks(self, chunk_length: int, max_chunks: int) -> AsyncIterator[np.ndarray]:
+        '''
+        Yield batches of consecutive chunks as 2-D arrays of shape `(n_chunks, chunk_length)`, with at most `max_chunks` rows. A source should only read more audio when the next batch is asked for, so that a slow consumer holds up the source rather than queueing audio without bound.
+        '''
+        ...
+
+class AsyncDetector:
+    '''
+    Asyncio front end for detection. Each call to `matches` analyses one source with its own `ChunkProcessor`, so a source owns its match state and no lock is taken per chunk, while sources at the same sample rate share compiled fingerprints through the plan cache. Batches of chunks are analysed on an executor so that the event loop stays responsive, and a source is only read once the previous batch has been analysed and its matches consumed, which applies backpressure all the way from the consumer to the source.
+
+    One event loop can drive any number of sources, for example:
+
+    ```python
+    detector = AsyncDetector(fingerprints)
+    async for match in detector.matches(AsyncWavSource('recording.wav')):
+        print(match)
+    ```
+    '''
+
+    def __init__(
+            self,
+            fingerprints: dict[str, FingerprintInMs],
+            chunk_length: int = 2048,
+            executor: Executor | None = None,
+            max_batch_chunks: int = 16,
+            **chunk_processor_kwargs
+        ) -> None:
+        '''
+        Initialise an `AsyncDetector`
+
+        ## Args:
+
+        - fingerprints (dict): Mapping of fingerprint name to fingerprint definition, shared by all sources
+        - chunk_length (int, default 2048): Number of samples per chunk
+        - executor (Executor, default None): Where batches are analysed. Defaults to the event loop's default executor. It must be a thread pool, since each source's processor lives in this process. The FFT releases the GIL, so several sources can be analysed in parallel.
+        - max_batch_chunks (int, default 16): Maximum number of chunks taken from a source and analysed in one batch
+        - chunk_processor_kwargs: Passed to each source's `ChunkProcessor`
+        '''
+        self.fingerprints = fingerprints
+        self.chunk_length = chunk_length
+        self.executor = executor
+        self.max_batch_chunks = max_batch_chunks
+        self.chunk_processor_kwargs = chunk_processor_kwargs
+
+    def create_processor(self, sample_rate: int) -> ChunkProcessor:
+        return ChunkProcessor(self.fingerprints, sample_rate, self.chunk_length, **self.chunk_processor_kwargs)
+
+    async def matches(self, source: AsyncChunkSource, chunk_processor: ChunkProcessor | None = None) -> AsyncIterator[MatchEvent]:
+        '''
+        Analyse a source, yielding match events as they are found
+
+        ## Args:
+
+        - source (AsyncChunkSource): Audio to analyse
+        - chunk_processor (ChunkProcessor, default None): Processor to analyse the source with, for example to keep its match state across reconnections. It must not be used for anything else meanwhile. A new one is created if not provided.
+
+        If the task iterating over the matches is cancelled, the source's chunk iterator is closed before the cancellation propagates, so a file or device is released straight away rather than when the iterator is garbage collected.
+
+        ## Yields:
+
+        - (MatchEvent): fingerprint ID and the time in the source at the end of the chunk which completed the match
+        '''
+        if chunk_processor is None:
+            chunk_processor = self.create_processor(source.sample_rate)
+        loop = asyncio.get_running_loop()
+
+        i_chunk = 0
+        async with aclosing(source.chunks(chunk_processor.hop_length, self.max_batch_chunks)) as batches:
+            async for chunks in batches:
+                if len(chunks) == 1:
+                    results = [await loop.run_in_executor(self.executor, chunk_processor.analyse_chunk_for_match, chunks[0], False)]
+                else:
+                    results = await loop.run_in_executor(self.executor, chunk_processor.analyse_chunks_for_matches, chunks, False)
+
+                for i, matched_ids in enumerate(results, start=i_chunk):
+                    for id in sorted(matched_ids):
+                        yield { 'fingerprint_id': id, 't': chunks_to_s(i + 1, chunk_processor.sample_rate, chunk_processor.chunk_length, chunk_processor.hop_length) }
+                i_chunk += len(results)
+
+class AsyncWavSource:
+    '''
+    Chunks read from a .wav file, as fast as they are analysed or at the pace of real time
+    '''
+
+    def __init__(self, file_name: str, speed: float = float('inf')) -> None:
+        '''
+        ## Args:
+
+        - file_name (str): .wav file to read
+        - speed (float, default inf): Pace relative to real time. By default chunks are read as soon as they are asked for.
+        '''
+        self.source = WavSource(file_name)
+        self.sample_rate = self.source.sample_rate
+        self.speed = speed
+
+    async def chunks(self, chunk_length: int, max_chunks: int) -> AsyncIterator[np.ndarray]:
+        chunk_duration_s = chunk_length / self.sample_rate / self.speed
+        block_chunks = max_chunks if self.speed == float('inf') else 1
+        next_time = time.monotonic()
+        try:
+            for _, block in self.source.iter_blocks(chunk_length, block_chunks=block_chunks):
+                # Each chunk is delivered when it would have finished being captured. Sleeping even when no time
+                # needs to pass gives other sources on the loop a turn.
+                next_time += len(block) * chunk_duration_s
+                await asyncio.sleep(max(next_time - time.monotonic(), 0))
+                yield block
+        finally:
+            self.source.close()
+
+class AsyncStreamSource:
+    '''
+    Chunks of raw mono PCM read from an `asyncio.StreamReader`, such as a socket opened with `asyncio.open_connection` or accepted by `asyncio.start_server`. Nothing is read until the next batch is asked for, so a consumer which falls behind fills the transport's buffer and pauses reading from the socket, pushing back on the sender.
+    '''
+
+    def __init__(self, reader: asyncio.StreamReader, sample_rate: int, dtype: np.dtype | str = SAMPLE_DTYPE) -> None:
+        '''
+        ## Args:
+
+        - reader (asyncio.StreamReader): Stream of samples, read until end of file
+        - sample_rate (int): Sample rate of the stream
+        - dtype (np.dtype | str, default SAMPLE_DTYPE): Type of the samples, such as `'<i2'` for signed 16-bit little-endian
+        '''
+        self.reader = reader
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+
+    async def chunks(self, chunk_length: int, max_chunks: int) -> AsyncIterator[np.ndarray]:
+        rechunker = Rechunker(chunk_length, self.dtype)
+        while True:
+            data = await self.reader.read(max_chunks * rechunker.chunk_bytes - rechunker.pending_bytes)
+            if len(data) == 0:
+                return
+
+            chunks = rechunker.feed(data)
+            if len(chunks) > 0:
+                yield chunks
+
+class AsyncDeviceSource:
+    '''
+    Chunks captured from an input device with PyAudio. The audio callback only hands each buffer over to the event loop, which queues it. A device cannot be held up, so when the consumer falls behind by more than `max_pending_chunks` the oldest chunks are dropped and counted in `dropped_chunks`.
+    '''
+
+    def __init__(self, device_index: int | None = None, max_pending_chunks: int = 64) -> None:
+        '''
+        ## Args:
+
+        - device_index (int, default None): PyAudio index of the input device. Defaults to the default input device.
+        - max_pending_chunks (int, default 64): Number of chunks which may be queued before the oldest are dropped
+        '''
+        # Imported here so that the rest of the module works without PyAudio
+        import pyaudio
+        self.pyaudio = pyaudio
+        self.pa = pyaudio.PyAudio()
+
+        device = self.pa.get_device_info_by_index(device_index) if device_index is not None else self.pa.get_default_input_device_info()
+        if device is None:
+            raise IOError('No default input device was found')
+        self.device_index = int(device['index'])
+        self.sample_rate = int(device['defaultSampleRate'])
+        log.info(f'Using device "{device["name"]}", index {self.device_index}, sample rate {self.sample_rate}Hz')
+
+        self.max_pending_chunks = max_pending_chunks
+        self.dropped_chunks = 0
+        self.input_overflows = 0
+
+    async def chunks(self, chunk_length: int, max_chunks: int) -> AsyncIterator[np.ndarray]:
+        loop = asyncio.get_running_loop()
+        pending: deque[bytes] = deque()
+        data_available = asyncio.Event()
+        chunk_bytes = chunk_length * SAMPLE_DTYPE.itemsize
+
+        def put(in_data: bytes) -> None:
+            # Runs on the event loop
+            if len(pending) >= self.max_pending_chunks:
+                pending.popleft()
+                self.dropped_chunks += 1
+            pending.append(in_data)
+            data_available.set()
+
+        def handle_input_buffer(in_data: bytes | None, frame_count, time_info, status):
+            if status & self.pyaudio.paInputOverflow:
+                self.input_overflows += 1
+            if in_data is not None and len(in_data) == chunk_bytes:
+                loop.call_soon_threadsafe(put, in_data)
+            return (None, self.pyaudio.paContinue)
+
+        stream = self.pa.open(
+            format=self.pyaudio.paInt16,
+            input_device_index=self.device_index,
+            channels=1,
+            rate=self.sample_rate,
+            input=True,
+            frames_per_buffer=chunk_length,
+            stream_callback=handle_input_buffer
+        )
+        stream.start_stream()
+        try:
+            while True:
+                await data_available.wait()
+                data_available.clear()
+                while len(pending) > 0:
+                    n_chunks = min(len(pending), max_chunks)
+                    data = b''.join(pending.popleft() for _ in range(n_chunks))
+                    yield np.frombuffer(data, dtype=SAMPLE_DTYPE).reshape(n_chunks, chunk_length)
+        finally:
+            stream.stop_stream()
+            stream.close()
+
+    def close(self) -> None:
+        self.pa.terminate()
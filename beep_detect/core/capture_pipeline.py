@@ -0,0 +1,307 @@
+import numpy as np
+import logging as log
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+from typing import Callable, TypedDict
+
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.recorder import ChunkRecorder
+from beep_detect.core.wav_source import SAMPLE_DTYPE, WavSource
+
+class PipelineStats(TypedDict):
+    chunks_captured: int
+    chunks_processed: int
+    overruns: int
+    dropped_chunks: int
+    input_overflows: int
+    queue_depth: int
+    max_queue_depth: int
+    matches: int
+    last_latency_ms: float
+    max_latency_ms: float
+    mean_latency_ms: float
+
+class ChunkRingBuffer:
+    '''
+    Preallocated ring buffer of chunks for a single producer (the audio callback) and a single consumer (the analysis worker). The producer only copies samples into a free slot and advances the write index; the consumer advances the read index once it has finished with a slot. Each index is only ever written by one side, so no lock is needed.
+    '''
+
+    def __init__(self, capacity: int, chunk_length: int, dtype=SAMPLE_DTYPE) -> None:
+        self.capacity = capacity
+        self.chunk_length = chunk_length
+        self.chunks = np.zeros((capacity, chunk_length), dtype=dtype)
+        self.capture_times = np.zeros(capacity)
+        self.write_index = 0
+        self.read_index = 0
+
+    def __len__(self) -> int:
+        return self.write_index - self.read_index
+
+    def put(self, samples: np.ndarray, capture_time: float) -> bool:
+        '''
+        Copy a chunk into the next free slot. Returns False without copying if the buffer is full.
+        '''
+        if self.write_index - self.read_index >= self.capacity:
+            return False
+
+        slot = self.write_index % self.capacity
+        self.chunks[slot] = samples
+        self.capture_times[slot] = capture_time
+        self.write_index += 1
+        return True
+
+    def readable(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Views of the contiguous run of filled slots starting at the read index, and their capture times. The slots stay reserved until `release` is called.
+        '''
+        start = self.read_index % self.capacity
+        n_chunks = min(self.write_index - self.read_index, self.capacity - start)
+        return self.chunks[start:start + n_chunks], self.capture_times[start:start + n_chunks]
+
+    def release(self, n_chunks: int) -> None:
+        self.read_index += n_chunks
+
+class CapturePipeline:
+    '''
+    Decouples audio capture from analysis. Audio callbacks call `push`, which only copies the samples into a `ChunkRingBuffer` and returns. A worker thread drains the buffer into the `ChunkProcessor`, analysing any backlog in one batch, and match callbacks are dispatched on a separate executor so that slow callbacks cannot hold up analysis.
+    '''
+
+    def __init__(
+            self,
+            chunk_processor: ChunkProcessor,
+            match_callback: Callable[[str], None],
+            capacity: int = 64,
+            max_batch_chunks: int = 16,
+            callback_workers: int = 1,
+            recorder: ChunkRecorder | None = None
+        ) -> None:
+        '''
+        Initialise a `CapturePipeline`
+
+        ## Args:
+
+        - chunk_processor (ChunkProcessor): Processor to analyse chunks. It is only called from the worker thread.
+        - match_callback (Callable): Called with the fingerprint ID of each match, on the callback executor
+        - capacity (int, default 64): Number of chunks that can be buffered before incoming chunks are dropped
+        - max_batch_chunks (int, default 16): Maximum number of buffered chunks analysed in one batch when the worker has fallen behind
+        - callback_workers (int, default 1): Number of threads for match callbacks. With more than one, callbacks may run out of order.
+        - recorder (ChunkRecorder, default None): Records every analysed chunk and the matches found in it, on the worker thread, so that missed beeps can be investigated later. The recorder is closed when the pipeline stops.
+        '''
+        self.chunk_processor = chunk_processor
+        self.match_callback = match_callback
+        self.metrics = chunk_processor.metrics
+        self.max_batch_chunks = max_batch_chunks
+        self.recorder = recorder
+        self.buffer = ChunkRingBuffer(capacity, chunk_processor.hop_length)
+        # Chunks of the wrong size are rejected from their raw length, before anything is decoded
+        self.chunk_bytes = chunk_processor.hop_length * SAMPLE_DTYPE.itemsize
+        # The callback executor is created by `start` and shut down by `stop`, so that a stopped pipeline can be started again
+        self.callback_workers = callback_workers
+        self.callback_executor: ThreadPoolExecutor | None = None
+
+        self._data_available = threading.Event()
+        self._stopping = threading.Event()
+        # Set to stop without draining. Only the worker may advance the read index, so it discards the buffered chunks.
+        self._discard = threading.Event()
+        self._worker = None
+
+        # Counters. Capture-side counters are only written by the producer, analysis-side counters only by the worker.
+        self.chunks_captured = 0
+        self.overruns = 0
+        self.dropped_chunks = 0
+        self.input_overflows = 0
+        self.chunks_processed = 0
+        self.max_queue_depth = 0
+        self.matches = 0
+        self.last_latency_ms = 0.
+        self.max_latency_ms = 0.
+        self.total_latency_ms = 0.
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._discard.clear()
+        self.callback_executor = ThreadPoolExecutor(max_workers=self.callback_workers, thread_name_prefix='match-callback')
+        self._worker = threading.Thread(target=self._run_worker, args=(self.callback_executor,), name='chunk-analysis', daemon=True)
+        self._worker.start()
+
+    def stop(self, drain: bool = True) -> None:
+        '''
+        Stop the worker thread, by default after analysing any chunks still in the buffer, then wait for outstanding match callbacks. Without `drain`, the worker finishes the batch it is analysing and discards the rest.
+
+        The pipeline can be started again afterwards, without the recorder, which is closed here.
+        '''
+        if self._worker is not None:
+            if not drain:
+                self._discard.set()
+            self._stopping.set()
+            self._data_available.set()
+            self._worker.join()
+            self._worker = None
+        if self.callback_executor is not None:
+            self.callback_executor.shutdown(wait=True)
+            self.callback_executor = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def push(self, in_data: bytes, input_overflow: bool = False, capture_time: float | None = None) -> bool:
+        '''
+        Queue raw signed 16-bit samples for analysis. Safe to call from an audio callback: it never blocks.
+
+        ## Args:
+
+        - in_data (bytes): Exactly one hop of new samples, which is one whole chunk unless the processor uses overlapping chunks
+        - input_overflow (bool, default False): Whether the audio device reported lost input before this chunk
+        - capture_time (float, default None): `time.monotonic()` at which the chunk was captured. Defaults to now.
+
+        ## Returns:
+
+        - (bool): False if the chunk was dropped
+        '''
+        if capture_time is None:
+            capture_time = time.monotonic()
+        if input_overflow:
+            self.input_overflows += 1
+            if self.metrics is not None:
+                self.metrics.input_overflows += 1
+
+        self.chunks_captured += 1
+        if len(in_data) != self.chunk_bytes:
+            self._record_dropped_chunk()
+            return False
+        if not self.buffer.put(np.frombuffer(in_data, dtype=SAMPLE_DTYPE), capture_time):
+            self.overruns += 1
+            self._record_dropped_chunk()
+            return False
+
+        self._data_available.set()
+        return True
+
+    @property
+    def stats(self) -> PipelineStats:
+        return {
+            'chunks_captured': self.chunks_captured,
+            'chunks_processed': self.chunks_processed,
+            'overruns': self.overruns,
+            'dropped_chunks': self.dropped_chunks,
+            'input_overflows': self.input_overflows,
+            'queue_depth': len(self.buffer),
+            'max_queue_depth': self.max_queue_depth,
+            'matches': self.matches,
+            'last_latency_ms': self.last_latency_ms,
+            'max_latency_ms': self.max_latency_ms,
+            'mean_latency_ms': self.total_latency_ms / self.matches if self.matches > 0 else 0.
+        }
+
+    def _run_worker(self, callback_executor: ThreadPoolExecutor) -> None:
+        while True:
+            self._data_available.wait()
+            self._data_available.clear()
+
+            while len(self.buffer) > 0:
+                if self._discard.is_set():
+                    self.buffer.release(len(self.buffer))
+                    break
+
+                self.max_queue_depth = max(self.max_queue_depth, len(self.buffer))
+                chunks, capture_times = self.buffer.readable()
+                chunks = chunks[:self.max_batch_chunks]
+                if self.recorder is not None:
+                    # Batches never straddle two segments of a recording, so each segment starts from a known state
+                    chunks = chunks[:self.recorder.chunks_left_in_segment]
+                    first_sequence = self.recorder.record(chunks, capture_times, self.chunk_processor)
+
+                if len(chunks) == 1:
+                    results = [self.chunk_processor.analyse_chunk_for_match(chunks[0])]
+                else:
+                    results = self.chunk_processor.analyse_chunks_for_matches(chunks)
+
+                analysed_time = time.monotonic()
+                if self.recorder is not None:
+                    self.recorder.record_matches(first_sequence, results)
+                for matched_ids, capture_time in zip(results, capture_times):
+                    for id in matched_ids:
+                        self._record_latency(1e3 * (analysed_time - float(capture_time)))
+                        callback_executor.submit(self._dispatch_match, id)
+
+                self.chunks_processed += len(chunks)
+                self.buffer.release(len(chunks))
+
+            if self._stopping.is_set():
+                return
+
+    def _record_dropped_chunk(self) -> None:
+        self.dropped_chunks += 1
+        if self.metrics is not None:
+            self.metrics.dropped_chunks += 1
+
+    def _record_latency(self, latency_ms: float) -> None:
+        self.matches += 1
+        self.last_latency_ms = latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self.total_latency_ms += latency_ms
+
+    def _dispatch_match(self, id: str) -> None:
+        start_time = timer()
+        try:
+            self.match_callback(id)
+        except Exception:
+            log.exception(f'Match callback failed for {id}')
+        if self.metrics is not None:
+            self.metrics.observe_stage('callback', timer() - start_time)
+
+class WavReplayStream:
+    '''
+    Stand-in for a PyAudio input stream which replays a .wav file through a stream callback, for testing capture pipelines without an audio device. Chunks are delivered at real-time pace, or faster or slower according to `speed`.
+    '''
+
+    def __init__(self, file_name: str, frames_per_buffer: int, stream_callback: Callable, speed: float = 1.) -> None:
+        '''
+        ## Args:
+
+        - file_name (str): .wav file to replay
+        - frames_per_buffer (int): Number of samples per callback
+        - stream_callback (Callable): Called as `stream_callback(in_data, frame_count, time_info, status)`, like a PyAudio stream callback
+        - speed (float, default 1): Replay speed relative to real time. Use `float('inf')` to replay as fast as possible.
+        '''
+        self.source = WavSource(file_name)
+        self.sample_rate = self.source.sample_rate
+        self.frames_per_buffer = frames_per_buffer
+        self.stream_callback = stream_callback
+        self.speed = speed
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start_stream(self) -> None:
+        self._thread = threading.Thread(target=self._replay, name='wav-replay', daemon=True)
+        self._thread.start()
+
+    def stop_stream(self) -> None:
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def is_active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def close(self) -> None:
+        self.stop_stream()
+        self.source.close()
+
+    def _replay(self) -> None:
+        chunk_duration_s = self.frames_per_buffer / self.sample_rate / self.speed
+        next_time = time.monotonic()
+        for _, block in self.source.iter_blocks(self.frames_per_buffer, block_chunks=16):
+            for chunk in block:
+                if self._stopping.is_set():
+                    return
+
+                # Deliver each chunk when it would have finished being captured
+                next_time += chunk_duration_s
+                delay_s = next_time - time.monotonic()
+                if delay_s > 0:
+                    time.sleep(delay_s)
+
+                self.stream_callback(chunk.tobytes(), self.frames_per_buffer, {}, 0)
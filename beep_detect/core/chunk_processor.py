@@ -1,12 +1,15 @@
 import array
 import numpy as np
-from scipy.fft import rfftfreq, rfft
-from scipy.signal import find_peaks
+from beep_detect.core.spectral import find_peaks, rfft
+from numpy.lib.stride_tricks import sliding_window_view
 import logging as log
 from timeit import default_timer as timer
 from threading import Lock
+from typing import Callable, Literal
 from math import log2
-from beep_detect.core.fingerprint_to_chunkmap import fingerprint_to_chunkmap
+from beep_detect.core.compiled_matcher import CompiledMatcher
+from beep_detect.core.fingerprint_plan import FingerprintPlan, get_plan
+from beep_detect.core.metrics import Metrics
 from beep_detect.core.time_conversion import ms_to_chunks
 from beep_detect.core.types import ChunkMap, FingerprintInMs
 
@@ -23,7 +26,15 @@ class ChunkProcessor:
           peak_prominence: float = 8,
           peak_distance: float = 8,
           tolerance_f: float = 0.03,
-          tolerance_t_ms: float = 50
+          tolerance_t_ms: float = 50,
+          matcher: Literal['dict', 'compiled'] = 'dict',
+          spectrum_backend: Literal['fft', 'targeted'] = 'fft',
+          plan: FingerprintPlan | None = None,
+          hop_length: int | None = None,
+          window: str | None = None,
+          fft_workers: int = 1,
+          metrics: Metrics | None = None,
+          spectrum_listener: Callable[[np.ndarray | None, np.ndarray], None] | None = None
         ) -> None:
         '''
         Initialise a `ChunkProcessor`
@@ -36,6 +47,14 @@ class ChunkProcessor:
         - peak_distance (int, default 12): Distance to use for decting frequency peaks. Used as the `distance` argument when calling numpy's `find_peaks` method. Increasing this will decrease sensitivity.
         - tolerance_f (int, default 0.03): Frequencies detected within this relative tolerance will match frequencies specified in the chunkmap. Increasing this will decrease sensitivity.
         - tolerance_t_ms (int, default 60): Maximum number of consecutive non-matching ms that will be ignored while matching a fingerprint. Increasing this will decrease sensitivity.
+        - matcher (str, default 'dict'): Implementation of the match state machine. `'dict'` evaluates each fingerprint in turn; `'compiled'` uses a `CompiledMatcher` which advances all fingerprints with vectorised array operations and scales better to large numbers of fingerprints.
+        - spectrum_backend (str, default 'fft'): How frequency peaks are found. `'fft'` computes the full spectrum and searches all of it for peaks. `'targeted'` uses a `TargetedSpectrum` to evaluate only the bins near frequencies in the fingerprints, and searches only those for peaks. The full rFFT is still computed unless the fingerprints need very few bins, so the saving is mostly in the peak search, which is largest when chunks are analysed in batches.
+        - plan (FingerprintPlan, default None): Precompiled plan for these fingerprints, sample rate and chunk length, to share between processors. Taken from the plan cache (see `get_plan`) if not provided.
+        - hop_length (int, default None): Number of new samples between successive analysed chunks. Defaults to `chunk_length`, i.e. no overlap. With a smaller hop, each call is passed only `hop_length` new samples and the processor keeps the rest of the chunk from previous calls. For example, half of `chunk_length` gives 50% overlap and twice the time resolution for twice the FFT work. Times in fingerprints are converted to chunks using the hop.
+        - window (str, default None): Analysis window applied to each chunk before the FFT, as a name understood by `get_window` in `beep_detect.core.spectral` such as `'hann'`. `None` applies no window. A window is recommended when chunks overlap.
+        - fft_workers (int, default 1): Number of threads used by `scipy.fft` for batched FFTs
+        - metrics (Metrics, default None): Where to record stage latencies, counters and the real-time factor. Nothing is recorded if not provided.
+        - spectrum_listener (Callable, default None): Called from the analysis thread with the spectrum in dB and the peak indices of every chunk, for example to display them. The spectrum is `None` with the targeted backend, and its buffer is reused for the next chunk, so copy anything kept. It must return quickly as it holds up analysis.
         '''
 
         # Set
@@ -45,15 +64,34 @@ class ChunkProcessor:
         self.peak_prominence = peak_prominence
         self.peak_distance = peak_distance
         self.tolerance_f = tolerance_f
+        self.tolerance_t_ms = tolerance_t_ms
+        self.matcher = matcher
+        self.spectrum_backend = spectrum_backend
+        self.hop_length = hop_length or chunk_length
+        self.window = window
+        self.fft_workers = fft_workers
+        self.metrics = metrics
+        self.spectrum_listener = spectrum_listener
 
         # Validate
         self._warn_if_chunk_length_not_power_of_2()
 
         # Derive
-        self.tolerance_t = ms_to_chunks(tolerance_t_ms, self.sample_rate, self.chunk_length)
-        self.frequency_bands = rfftfreq(self.chunk_length, d=1/self.sample_rate)
-        self.chunkmaps = { k: fingerprint_to_chunkmap(f, self.sample_rate, self.chunk_length) for k, f in fingerprints.items() }
-        log.info(f'Chunk processor initialised with chunkmaps {self.chunkmaps}')
+        self.tolerance_t = ms_to_chunks(tolerance_t_ms, self.sample_rate, self.chunk_length, self.hop_length)
+        if plan is None:
+           plan = get_plan(fingerprints, sample_rate, chunk_length, tolerance_f, peak_prominence, peak_distance, self.hop_length, window)
+        elif (plan.sample_rate, plan.chunk_length, plan.tolerance_f, plan.peak_prominence, plan.peak_distance, plan.hop_length, plan.window) != (sample_rate, chunk_length, tolerance_f, peak_prominence, peak_distance, self.hop_length, window):
+           raise ValueError(f'Plan for {plan.sample_rate}Hz and {plan.chunk_length} samples per chunk was compiled with different settings to this processor')
+        self.plan = plan
+        self.frequency_bands = plan.frequency_bands
+        self.window_values = plan.window_values
+        self.chunkmaps = plan.chunkmaps
+        self._allocate_buffers()
+
+        if self.matcher not in ('dict', 'compiled'):
+           raise ValueError(f'Unrecognised matcher "{self.matcher}"')
+        if self.spectrum_backend not in ('fft', 'targeted'):
+           raise ValueError(f'Unrecognised spectrum backend "{self.spectrum_backend}"')
 
         # Initialise
         self.analysis_lock = Lock()
@@ -65,6 +103,12 @@ class ChunkProcessor:
               'accumulated_errors': 0
            } for k in self.fingerprints.keys()
         }
+        self.compiled_matcher = None
+        if self.matcher == 'compiled':
+           self.compiled_matcher = CompiledMatcher(plan.compiled_fingerprints, self.tolerance_t, metrics)
+        self.targeted_spectrum = None
+        if self.spectrum_backend == 'targeted':
+           self.targeted_spectrum = plan.targeted_spectrum
 
     def analyse_chunk_for_match(self, chunk, with_lock=True) -> set[str]:
         '''
@@ -87,37 +131,266 @@ class ChunkProcessor:
 
         return self._analyse_chunk_for_match(chunk)
     
+    def analyse_chunks_for_matches(self, chunks: np.ndarray, with_lock=True) -> list[set[str]]:
+        '''
+        Analyse many consecutive chunks of audio in one batch. This is equivalent to calling `analyse_chunk_for_match` for each chunk in turn, but the spectral analysis for all chunks is vectorised, which greatly reduces per-chunk overhead for offline analysis.
+
+        ## Args:
+
+        - chunks (np.ndarray): 2-D array of shape `(n_chunks, chunk_length)`, with one chunk of samples per row in chronological order.
+        - with_lock (bool, default True): Use a lock to prevent this method from being called concurrently
+
+        ## Returns:
+
+        - (list[set[str]]): for each chunk, the fingerprint IDs which had a match completed by that chunk
+        '''
+        if with_lock:
+            with self.analysis_lock:
+                return self._analyse_chunks_for_matches(chunks)
+
+        return self._analyse_chunks_for_matches(chunks)
+
+    def get_match_state(self) -> dict[str, dict[str, int]]:
+        '''
+        Snapshot of the current match state of every fingerprint, which can later be restored with `set_match_state`
+        '''
+        if self.compiled_matcher is not None:
+           return self.compiled_matcher.match_state
+
+        return { k: dict(state) for k, state in self.match_state.items() }
+
+    def set_match_state(self, match_state: dict[str, dict[str, int]]) -> None:
+        '''
+        Restore a match state snapshot obtained from `get_match_state`
+        '''
+        if self.compiled_matcher is not None:
+           self.compiled_matcher.load_match_state(match_state)
+        else:
+           self.match_state = { k: dict(match_state[k]) for k in self.fingerprints.keys() }
+
+    def get_state(self) -> dict:
+        '''
+        Snapshot of everything carried over from one chunk to the next: the match state and the samples kept for overlapping the next chunk. Restoring it with `set_state` on a processor with the same settings and feeding it the same chunks gives the same matches. The snapshot only holds plain lists and numbers, so it can be stored as JSON.
+        '''
+        return {
+           'match_state': self.get_match_state(),
+           'history': self._history.tolist()
+        }
+
+    def set_state(self, state: dict) -> None:
+        '''
+        Restore a snapshot obtained from `get_state`
+        '''
+        if len(state['history']) != len(self._history):
+           raise ValueError(f'Snapshot overlaps chunks by {len(state["history"])} samples but this processor overlaps them by {len(self._history)}')
+        self.set_match_state(state['match_state'])
+        self._history[:] = state['history']
+
+    def match_span_chunks(self) -> int:
+        '''
+        Upper bound on the number of chunks spanned by a complete match of any fingerprint. State older than this cannot influence whether a match completes.
+        '''
+        return max([
+           chunkmap['repetitions'] * (len(chunkmap['frequencies_to_match_by_chunk']) + chunkmap['max_period_chunks'] + 1)
+           for chunkmap in self.chunkmaps.values()
+        ], default=0)
+
     def _analyse_chunk_for_match(self, chunk: list[int]) -> set[str]:
+        metrics = self.metrics
         start_time = timer()
 
         # Ensure chunk length is as expected
         chunk_length = len(chunk)
-        if chunk_length != self.chunk_length:
-           log.warning(f'Chunk length has changed from {self.chunk_length} to {chunk_length}. Frequency bands will be recalculated.')
-           self.chunk_length = chunk_length
-           self.frequency_bands = rfftfreq(self.chunk_length, d=1/self.sample_rate)
-           self._warn_if_chunk_length_not_power_of_2()
-        
-        # Compute real FFT and normalise to decibels (dB)
-        freq_vals = np.absolute(rfft(chunk)[1:]) # type: ignore
-        freq_db = 10*np.log10(freq_vals) # type: ignore
-
-        # Compute frequency peaks and normalise to Hertz (Hz)
-        freq_peaks_i = find_peaks(freq_db, prominence=self.peak_prominence, distance=self.peak_distance)[0]
-        freq_peaks = [self.frequency_bands[peak] for peak in freq_peaks_i]
+        if chunk_length != self.hop_length:
+           self._update_chunk_length(chunk_length)
+
+        # Assemble the frame to analyse from the overlap with previous chunks, reusing preallocated buffers
+        overlap = self.chunk_length - self.hop_length
+        if overlap > 0:
+           self._frame[:overlap] = self._history
+           self._frame[overlap:] = chunk
+           self._history[:] = self._frame[self.hop_length:]
+        else:
+           self._frame[:] = chunk
+
+        # Compute frequency peaks
+        if self.targeted_spectrum is not None:
+           freq_peaks_i = self.targeted_spectrum.find_peaks(self._frame[np.newaxis], metrics)[0]
+           if self.spectrum_listener is not None:
+              self.spectrum_listener(None, freq_peaks_i)
+        else:
+           frame = self._frame
+           if self.window_values is not None:
+              frame = np.multiply(self._frame, self.window_values, out=self._windowed_frame)
+           if metrics is not None:
+              fft_start_time = timer()
+           np.absolute(rfft(frame)[1:], out=self._magnitude) # type: ignore
+           if metrics is not None:
+              fft_time = timer()
+              metrics.observe_stage('fft', fft_time - fft_start_time)
+           freq_db = np.log10(self._magnitude, out=self._freq_db)
+           freq_db *= 10
+           if metrics is not None:
+              db_time = timer()
+              metrics.observe_stage('db', db_time - fft_time)
+           freq_peaks_i = self._find_peaks_in_spectrum(freq_db)
+           if metrics is not None:
+              metrics.observe_stage('peaks', timer() - db_time)
+           if self.spectrum_listener is not None:
+              self.spectrum_listener(freq_db, freq_peaks_i)
 
         # Compute matches and update state
-        matched_fingerprint_keys = self._analyse_peaks_for_match(freq_peaks)
+        matched_fingerprint_keys = self._match_peaks(freq_peaks_i)
 
         end_time = timer()
-        processing_duration_ms = (end_time - start_time) * 1e3
-        chunk_durations_ms = self.chunk_length / self.sample_rate * 1e3
-        log.debug(f'Chunk of duration {chunk_durations_ms:.3f}ms analysed in {processing_duration_ms:.3f}ms')
+        if metrics is not None:
+           metrics.record_chunks(1, self.hop_length / self.sample_rate, end_time - start_time)
+        log.debug('Chunk of duration %.3fms analysed in %.3fms', self.hop_length / self.sample_rate * 1e3, (end_time - start_time) * 1e3)
 
         return matched_fingerprint_keys
 
-    def _analyse_peaks_for_match(self, freq_peaks: list) -> set[str]:
-        
+    def _analyse_chunks_for_matches(self, chunks: np.ndarray) -> list[set[str]]:
+        metrics = self.metrics
+        start_time = timer()
+
+        frames = self._frame_chunks(chunks)
+        n_chunks = len(frames)
+
+        # Spectra for all chunks at once (one row per chunk), then peaks row by row
+        freq_db = None
+        if self.targeted_spectrum is not None:
+           freq_peaks_by_chunk = self.targeted_spectrum.find_peaks(frames, metrics)
+        else:
+           freq_db = self._compute_spectrum_db(self._prepare_frames(frames))
+           if metrics is not None:
+              peaks_start_time = timer()
+           freq_peaks_by_chunk = [self._find_peaks_in_spectrum(row) for row in freq_db]
+           if metrics is not None:
+              metrics.observe_stage('peaks', timer() - peaks_start_time, n_chunks)
+
+        if self.spectrum_listener is not None:
+           for i_chunk, freq_peaks_i in enumerate(freq_peaks_by_chunk):
+              self.spectrum_listener(None if freq_db is None else freq_db[i_chunk], freq_peaks_i)
+
+        # The state machine is inherently sequential, so feed it the precomputed peaks in order
+        matches = [self._match_peaks(freq_peaks_i) for freq_peaks_i in freq_peaks_by_chunk]
+
+        end_time = timer()
+        if metrics is not None:
+           metrics.record_chunks(n_chunks, n_chunks * self.hop_length / self.sample_rate, end_time - start_time)
+        log.debug('Batch of %d chunks of total duration %.3fms analysed in %.3fms', n_chunks, n_chunks * self.hop_length / self.sample_rate * 1e3, (end_time - start_time) * 1e3)
+
+        return matches
+
+    def compute_spectrum_db(self, chunks: np.ndarray) -> np.ndarray:
+        '''
+        Spectra in dB of consecutive chunks, framed and windowed exactly as they are for matching, without advancing the match state. Overlap is carried over between calls as it is by `analyse_chunks_for_matches`, so the two should not be mixed on one processor.
+
+        ## Returns:
+
+        - (np.ndarray): 2-D array with one row per chunk. Column i is the level at `frequency_bands[i]`, following the same peak index convention as matching.
+        '''
+        return self._compute_spectrum_db(self._prepare_frames(self._frame_chunks(chunks)))
+
+    def _frame_chunks(self, chunks: np.ndarray) -> np.ndarray:
+        chunks = np.atleast_2d(chunks)
+        if chunks.shape[1] != self.hop_length:
+           self._update_chunk_length(chunks.shape[1])
+
+        # Frame the chunks, including the overlap carried over from previous chunks
+        overlap = self.chunk_length - self.hop_length
+        if overlap == 0:
+           return chunks
+
+        samples = np.concatenate([self._history, chunks.ravel()])
+        frames = sliding_window_view(samples, self.chunk_length)[::self.hop_length]
+        self._history[:] = samples[len(samples) - overlap:]
+        return frames
+
+    def _prepare_frames(self, frames: np.ndarray) -> np.ndarray:
+        # One float32 copy of the batch, which is then windowed in place
+        frames = np.array(frames, dtype=np.float32)
+        if self.window_values is not None:
+           frames *= self.window_values
+        return frames
+
+    def _compute_spectrum_db(self, chunks: np.ndarray) -> np.ndarray:
+        # Compute real FFT (along the last axis) and normalise to decibels (dB) in place. Single precision input
+        # gives a single precision spectrum.
+        if self.metrics is not None:
+           start_time = timer()
+        freq_db = np.absolute(rfft(chunks, axis=-1, workers=self.fft_workers)[..., 1:]) # type: ignore
+        if self.metrics is None:
+           np.log10(freq_db, out=freq_db)
+           freq_db *= 10
+           return freq_db
+
+        fft_time = timer()
+        np.log10(freq_db, out=freq_db)
+        freq_db *= 10
+        self.metrics.observe_stage('fft', fft_time - start_time, len(chunks))
+        self.metrics.observe_stage('db', timer() - fft_time, len(chunks))
+        return freq_db
+
+    def _find_peaks_in_spectrum(self, freq_db: np.ndarray) -> np.ndarray:
+        return find_peaks(freq_db, prominence=self.peak_prominence, distance=self.peak_distance)[0]
+
+    def _match_peaks(self, freq_peaks_i: np.ndarray) -> set[str]:
+        metrics = self.metrics
+        if metrics is not None:
+           start_time = timer()
+
+        if self.compiled_matcher is not None:
+           matched_fingerprint_keys = self.compiled_matcher.advance(freq_peaks_i)
+           if log.root.isEnabledFor(log.DEBUG):
+              log.debug('State after this chunk is %s', self.compiled_matcher.match_state)
+        else:
+           matched_fingerprint_keys = self._analyse_peaks_for_match(freq_peaks_i)
+
+        if metrics is not None:
+           metrics.observe_stage('matching', timer() - start_time)
+           for k in matched_fingerprint_keys:
+              metrics.record_match(k)
+
+        return matched_fingerprint_keys
+
+    def _allocate_buffers(self) -> None:
+        # Samples are converted to single precision as they are copied into the frame, and the whole spectral path
+        # stays in single precision
+        self._history = np.zeros(self.chunk_length - self.hop_length, dtype=np.float32)
+        self._frame = np.zeros(self.chunk_length, dtype=np.float32)
+        self._windowed_frame = np.zeros(self.chunk_length, dtype=np.float32)
+        self._magnitude = np.zeros(self.chunk_length // 2, dtype=np.float32)
+        self._freq_db = np.zeros(self.chunk_length // 2, dtype=np.float32)
+
+    def _update_chunk_length(self, chunk_length: int) -> None:
+        if self.hop_length != self.chunk_length:
+           raise ValueError(f'Expected {self.hop_length} new samples per chunk but received {chunk_length}. The chunk length cannot change when chunks overlap.')
+
+        log.warning(f'Chunk length has changed from {self.chunk_length} to {chunk_length}. Fingerprints will be recompiled and match state reset.')
+        self.chunk_length = chunk_length
+        self.hop_length = chunk_length
+        self._warn_if_chunk_length_not_power_of_2()
+
+        # Chunkmaps count chunks, so they are only valid for the chunk length they were compiled for
+        self.plan = get_plan(self.fingerprints, self.sample_rate, chunk_length, self.tolerance_f, self.peak_prominence, self.peak_distance, chunk_length, self.window)
+        self.frequency_bands = self.plan.frequency_bands
+        self.window_values = self.plan.window_values
+        self.chunkmaps = self.plan.chunkmaps
+        self.tolerance_t = ms_to_chunks(self.tolerance_t_ms, self.sample_rate, self.chunk_length, self.hop_length)
+        self._allocate_buffers()
+
+        self.set_match_state({ k: dict.fromkeys(('repetition', 'chunk', 'chunks_since_last_repetition', 'accumulated_errors'), 0) for k in self.fingerprints.keys() })
+        if self.compiled_matcher is not None:
+           self.compiled_matcher = CompiledMatcher(self.plan.compiled_fingerprints, self.tolerance_t, self.metrics)
+        if self.targeted_spectrum is not None:
+           self.targeted_spectrum = self.plan.targeted_spectrum
+
+    def _analyse_peaks_for_match(self, freq_peaks_i: np.ndarray) -> set[str]:
+
+        # Normalise frequency peaks to Hertz (Hz)
+        freq_peaks = [self.frequency_bands[peak] for peak in freq_peaks_i]
+
         # Assess each chunkmap to see if match status has changed
         fingerprint_matches = set()
         for k, state in self.match_state.items():
@@ -138,7 +411,8 @@ class ChunkProcessor:
             state['accumulated_errors']  += 1
           if matched:
             # Reset errors
-            log.debug(f'{k}: Peaks {freq_peaks} exact match for chunk {chunkmap["frequencies_to_match_by_chunk"][state["chunk"]]}')
+            if log.root.isEnabledFor(log.DEBUG):
+              log.debug('%s: Peaks %s exact match for chunk %s', k, freq_peaks, chunkmap['frequencies_to_match_by_chunk'][state['chunk']])
             state['accumulated_errors'] = 0
 
           # Now assess the outcome:
@@ -161,6 +435,8 @@ class ChunkProcessor:
             state['accumulated_errors']  = 0
           else:
             # No match and no more phases -> reset state for this fingerprint
+            if self.metrics is not None and (state['chunk'] > 0 or state['repetition'] > 0):
+              self.metrics.partial_match_resets += 1
             state['chunk'] = 0
             state['accumulated_errors']  = 0
             state['chunks_since_last_repetition'] = 0
@@ -178,7 +454,7 @@ class ChunkProcessor:
             state['chunks_since_last_repetition'] = 0
             state['accumulated_errors']  = 0
 
-        log.debug(f'State after this chunk is {self.match_state}')
+        log.debug('State after this chunk is %s', self.match_state)
 
         return fingerprint_matches
 
@@ -197,7 +473,7 @@ class ChunkProcessor:
               return True
             
       return False
-    
+
     def _warn_if_chunk_length_not_power_of_2(self) -> None:
        if log2(self.chunk_length) % 1 != 0:
           log.warning(f'Log level of {self.chunk_length} is not a power of 2. Use a power of 2 for best performance.')
@@ -0,0 +1,170 @@
+import numpy as np
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.types import ChunkMap
+
+class CompiledFingerprints:
+    '''
+    Array-backed representation of a set of chunkmaps, for matching many fingerprints at once. Expected frequencies are converted to ranges of FFT bins so that peaks can be matched by index comparison rather than by comparing frequencies.
+    '''
+
+    def __init__(self, chunkmaps: dict[str, ChunkMap], frequency_bands: np.ndarray, tolerance_f: float) -> None:
+        '''
+        Compile chunkmaps into padded arrays
+
+        ## Args:
+
+        - chunkmaps (dict): Mapping of fingerprint name to chunkmap, as produced by `fingerprint_to_chunkmap`.
+        - frequency_bands (np.ndarray): Frequency of each peak index, usually the output of `scipy.rfftfreq(chunk_length, d=1/sample_rate)`.
+        - tolerance_f (float): Relative frequency tolerance. A peak matches an expected frequency under the same rule as `np.isclose(peak, expected, rtol=tolerance_f)`.
+        '''
+        self.fingerprint_ids = list(chunkmaps.keys())
+        self.frequency_bands = frequency_bands
+        self.tolerance_f = tolerance_f
+
+        freqs_by_chunk = [chunkmaps[k]['frequencies_to_match_by_chunk'] for k in self.fingerprint_ids]
+        n_fingerprints = len(self.fingerprint_ids)
+        max_chunks = max([len(freqs) for freqs in freqs_by_chunk], default=0)
+        max_freqs = max([len(f) for freqs in freqs_by_chunk for f in freqs], default=0)
+
+        self.lengths = np.array([len(freqs) for freqs in freqs_by_chunk], dtype=np.intp)
+        self.max_period_chunks = np.array([chunkmaps[k]['max_period_chunks'] for k in self.fingerprint_ids], dtype=np.intp)
+        self.repetitions = np.array([chunkmaps[k]['repetitions'] for k in self.fingerprint_ids], dtype=np.intp)
+
+        # Number of frequencies expected at each chunk index (padding expects nothing)
+        self.n_expected = np.zeros((n_fingerprints, max(max_chunks, 1)), dtype=np.intp)
+
+        # Inclusive range of matching bins for each expected frequency. Padding uses an empty range.
+        self.bin_lo = np.ones((n_fingerprints, max(max_chunks, 1), max(max_freqs, 1)), dtype=np.intp)
+        self.bin_hi = np.zeros_like(self.bin_lo)
+
+        for i_fingerprint, freqs in enumerate(freqs_by_chunk):
+            for i_chunk, expected_freqs in enumerate(freqs):
+                self.n_expected[i_fingerprint, i_chunk] = len(expected_freqs)
+                for i_freq, expected_freq in enumerate(expected_freqs):
+                    bins = np.flatnonzero(np.isclose(frequency_bands, expected_freq, rtol=tolerance_f))
+                    if len(bins) > 0:
+                        self.bin_lo[i_fingerprint, i_chunk, i_freq] = bins[0]
+                        self.bin_hi[i_fingerprint, i_chunk, i_freq] = bins[-1]
+
+        # Index from each bin to the (fingerprint, chunk index) pairs expecting a frequency in that bin, in CSR
+        # form: the entries for bin b are at positions index_ptr[b] to index_ptr[b+1]. A pair appears once for each
+        # of its expected frequencies whose range contains the bin.
+        i_fingerprints, i_chunks, i_freqs = np.nonzero(self.bin_hi >= self.bin_lo)
+        lo = self.bin_lo[i_fingerprints, i_chunks, i_freqs]
+        widths = self.bin_hi[i_fingerprints, i_chunks, i_freqs] - lo + 1
+        entry_bins = np.repeat(lo - np.cumsum(widths) + widths, widths) + np.arange(widths.sum())
+        order = np.argsort(entry_bins, kind='stable')
+        self.index_fingerprint = np.repeat(i_fingerprints, widths)[order]
+        self.index_chunk = np.repeat(i_chunks, widths)[order]
+        self.index_ptr = np.zeros(len(frequency_bands) + 1, dtype=np.intp)
+        np.cumsum(np.bincount(entry_bins, minlength=len(frequency_bands)), out=self.index_ptr[1:])
+
+    def lookup(self, peak_bins: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Find every (fingerprint, chunk index) pair expecting a frequency at one of the given peaks, in O(peaks + pairs found)
+
+        ## Returns:
+
+        - (tuple[np.ndarray, np.ndarray]): fingerprint indices and chunk indices of the pairs, with one entry per matching (peak, expected frequency)
+        '''
+        peaks = np.asarray(peak_bins, dtype=np.intp)
+        starts = self.index_ptr[peaks]
+        counts = self.index_ptr[peaks + 1] - starts
+        entries = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return self.index_fingerprint[entries], self.index_chunk[entries]
+
+class CompiledMatcher:
+    '''
+    Vectorised equivalent of the dict-based state machine in `ChunkProcessor`. Match state for every fingerprint is held in integer arrays so that one chunk advances all fingerprints with a handful of array operations.
+    '''
+
+    def __init__(self, compiled: CompiledFingerprints, tolerance_t: int, metrics: Metrics | None = None) -> None:
+        self.compiled = compiled
+        self.tolerance_t = tolerance_t
+        self.metrics = metrics
+
+        n_fingerprints = len(compiled.fingerprint_ids)
+        self._indices = np.arange(n_fingerprints)
+        self.repetition = np.zeros(n_fingerprints, dtype=np.intp)
+        self.chunk = np.zeros(n_fingerprints, dtype=np.intp)
+        self.chunks_since_last_repetition = np.zeros(n_fingerprints, dtype=np.intp)
+        self.accumulated_errors = np.zeros(n_fingerprints, dtype=np.intp)
+
+    def advance(self, peak_bins: np.ndarray) -> set[str]:
+        '''
+        Advance the match state of every fingerprint by one chunk
+
+        ## Args:
+
+        - peak_bins (np.ndarray): Indices of the frequency peaks found in the chunk
+
+        ## Returns:
+
+        - (set[str]): fingerprint IDs which had a match completed by this chunk
+        '''
+        c = self.compiled
+        chunk = self.chunk
+
+        # Count (peak, expected frequency) pairs which match at each fingerprint's current chunk index
+        i_fingerprints, i_chunks = c.lookup(peak_bins)
+        hits = np.bincount(i_fingerprints[i_chunks == chunk[i_fingerprints]], minlength=len(chunk))
+        expected = c.n_expected[self._indices, chunk]
+        matched = (expected == 0) | (hits >= expected)
+
+        # Misses within tolerance are treated as matches
+        missed_within_tolerance = ~matched & (chunk > 0) & (self.accumulated_errors < self.tolerance_t)
+        advanced = matched | missed_within_tolerance
+        phase_completed = advanced & (chunk >= c.lengths - 1)
+        phase_continued = advanced & ~phase_completed
+        waiting = ~advanced & (self.repetition > 0) & (self.chunks_since_last_repetition <= c.max_period_chunks)
+        reset = ~advanced & ~waiting
+        if self.metrics is not None:
+            self.metrics.partial_match_resets += int(np.count_nonzero(reset & ((chunk > 0) | (self.repetition > 0))))
+
+        self.accumulated_errors += missed_within_tolerance
+        self.accumulated_errors[matched | phase_completed | waiting | reset] = 0
+
+        self.chunk[phase_continued] += 1
+        self.chunk[phase_completed | waiting | reset] = 0
+
+        self.repetition[phase_completed] += 1
+        self.repetition[reset] = 0
+
+        self.chunks_since_last_repetition[phase_continued | waiting] += 1
+        self.chunks_since_last_repetition[phase_completed | reset] = 0
+
+        # Complete fingerprint matches, then reset their state
+        completed = self.repetition == c.repetitions
+        if not completed.any():
+            return set()
+
+        self.chunk[completed] = 0
+        self.repetition[completed] = 0
+        self.chunks_since_last_repetition[completed] = 0
+        self.accumulated_errors[completed] = 0
+
+        return { c.fingerprint_ids[i] for i in np.flatnonzero(completed) }
+
+    @property
+    def match_state(self) -> dict[str, dict[str, int]]:
+        '''
+        Current match state in the same shape as the dict-based `ChunkProcessor.match_state`
+        '''
+        return {
+            k: {
+                'repetition': int(self.repetition[i]),
+                'chunk': int(self.chunk[i]),
+                'chunks_since_last_repetition': int(self.chunks_since_last_repetition[i]),
+                'accumulated_errors': int(self.accumulated_errors[i])
+            } for i, k in enumerate(self.compiled.fingerprint_ids)
+        }
+
+    def load_match_state(self, match_state: dict[str, dict[str, int]]) -> None:
+        '''
+        Restore match state previously obtained from `match_state`
+        '''
+        for i, k in enumerate(self.compiled.fingerprint_ids):
+            self.repetition[i] = match_state[k]['repetition']
+            self.chunk[i] = match_state[k]['chunk']
+            self.chunks_since_last_repetition[i] = match_state[k]['chunks_since_last_repetition']
+            self.accumulated_errors[i] = match_state[k]['accumulated_errors']
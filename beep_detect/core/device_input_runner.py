@@ -1,11 +1,12 @@
 import pyaudio
 import logging as log
 from math import log2
-import numpy as np
-import array
 from typing import Callable
 
+from beep_detect.core.capture_pipeline import CapturePipeline
 from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.recorder import ChunkRecorder
 from beep_detect.core.types import FingerprintInMs
 
 class DeviceInputRunner():
@@ -13,7 +14,13 @@ class DeviceInputRunner():
             self,
             fingerprints: dict[str, FingerprintInMs],
             match_callback: Callable[[str], None],
-            target_chunk_duration_ms: float = 30
+            target_chunk_duration_ms: float = 30,
+            buffer_chunks: int = 64,
+            overlap: float = 0,
+            window: str | None = None,
+            metrics: Metrics | None = None,
+            recording_dir: str | None = None,
+            recording_s: float = 600
         ) -> None:
         self.pa = pyaudio.PyAudio()
 
@@ -34,26 +41,42 @@ class DeviceInputRunner():
 
         log.info(f'Minimum {samples_per_minimum_chunk} samples per {target_chunk_duration_ms}ms chunk rounded to nearest power of 2: {self.samples_per_chunk} per {chunk_duration_ms:.2f}ms')
 
+        # With overlapping chunks, the device delivers one hop of new samples per buffer
+        self.samples_per_hop = max(round(self.samples_per_chunk * (1 - overlap)), 1)
+        if overlap > 0:
+            log.info(f'Chunks overlap by {overlap:.0%}: {self.samples_per_hop} new samples per {1e3 * self.samples_per_hop / self.device_framerate:.2f}ms')
+
         # Set up chunk processor
 
         self.chunk_processor = ChunkProcessor(
             fingerprints,
             self.device_framerate,
-            self.samples_per_chunk
+            self.samples_per_chunk,
+            hop_length=self.samples_per_hop,
+            window=window,
+            metrics=metrics
         )
 
+        # Analysis happens on the pipeline's worker thread, not in the PortAudio callback
         self.match_callback = match_callback
+        # Optionally keep the last `recording_s` of analysed audio on disk, see `beep_detect.core.recorder`
+        recorder = None
+        if recording_dir is not None:
+            recorder = ChunkRecorder(recording_dir, self.chunk_processor, recording_s)
+            log.info(f'Recording the last {recording_s:.0f}s of audio to {recording_dir}')
+        self.pipeline = CapturePipeline(self.chunk_processor, match_callback, capacity=buffer_chunks, recorder=recorder)
         self.stream = None
 
     def __enter__(self):
         log.debug('Starting device stream')
+        self.pipeline.start()
         self.stream = self.pa.open(
             format=pyaudio.paInt16,
             input_device_index=self.device_index,
             channels=1,
             rate=self.device_framerate,
             input=True,
-            frames_per_buffer=self.samples_per_chunk,
+            frames_per_buffer=self.samples_per_hop,
             stream_callback=self.handle_input_buffer
         )
 
@@ -61,16 +84,11 @@ class DeviceInputRunner():
         return self
 
     def handle_input_buffer(self, in_data: bytes | None, frame_count, time_info, status):
-        log.debug('Handling input buffer')
         if in_data is None:
             raise IOError('Input stream contained no data')
 
-        datapoints = array.array('H', in_data)
-        
-        matched_ids = self.chunk_processor.analyse_chunk_for_match(datapoints)
-
-        for id in matched_ids:
-            self.match_callback(id)
+        # Only copy the chunk into the ring buffer here. Anything slow would cause input overflows.
+        self.pipeline.push(in_data, input_overflow=bool(status & pyaudio.paInputOverflow))
 
         return (in_data, pyaudio.paContinue)
 
@@ -85,5 +103,9 @@ class DeviceInputRunner():
         if self.stream is not None:
             self.stream.stop_stream()
             self.stream.close()
+            self.stream = None
+
+        self.pipeline.stop(drain=False)
+        log.info(f'Capture pipeline stats: {self.pipeline.stats}')
 
         self.pa.terminate()
\ No newline at end of file
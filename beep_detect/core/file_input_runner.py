@@ -1,40 +1,97 @@
-from beep_detect.core.types import FingerprintInMs
-from chunk_processor import ChunkProcessor
-import wave
-import array
+from beep_detect.core.types import FingerprintInMs, MatchEvent, RunSummary
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.multi_resolution import MultiResolutionProcessor
+from beep_detect.core.wav_source import WavSource
 import logging as log
+from typing import Iterator
+from timeit import default_timer as timer
 from beep_detect.core.time_conversion import chunks_to_s
 
 class FileInputRunner():
-    def __init__(self, fingerprints: dict[str, FingerprintInMs], file_name: str) -> None:
-        wf = wave.open(file_name, 'rb')
-        data = wf.readframes(wf.getnframes())
-        self.input_sample_rate = wf.getframerate()
-        self.datapoints = array.array('H', data)
-        self.chunk_length = 2048
-
-        self.chunk_processor = ChunkProcessor(
+    def __init__(self, fingerprints: dict[str, FingerprintInMs], file_name: str, chunk_length: int = 2048, multi_resolution: bool = False, **chunk_processor_kwargs) -> None:
+        # Only the header is read here. Audio is streamed from the file during analysis.
+        self.source = WavSource(file_name)
+        self.input_sample_rate = self.source.sample_rate
+        self.chunk_length = chunk_length
+
+        # With `multi_resolution`, fingerprints are analysed in groups at their own sample rate and chunk length
+        processor_class = MultiResolutionProcessor if multi_resolution else ChunkProcessor
+        self.chunk_processor = processor_class(
             fingerprints,
             self.input_sample_rate,
-            self.chunk_length
+            self.chunk_length,
+            **chunk_processor_kwargs
         )
+        # Chunks are read from the file in hops. Without overlap this is the chunk length.
+        self.hop_length = self.chunk_processor.hop_length
+
+    def run(self, batch: bool = False) -> RunSummary:
+        '''
+        Analyse the file for matches, skipping the first 10 seconds
+
+        ## Args:
+
+        - batch (bool, default False): Analyse each block of chunks read from the file in one vectorised batch instead of one chunk at a time. Produces the same events but is much faster for long recordings.
+
+        ## Returns:
+
+        - (RunSummary): Detected match events, plus the audio duration analysed and throughput in audio-seconds per wall-second
+        '''
+        start_time = timer()
+        events = list(self.iter_matches(batch=batch, start_s=10))
+        processing_duration_s = timer() - start_time
+
+        i_chunk_start = 10*self.input_sample_rate // self.hop_length
+        n_chunks = max(self.source.n_chunks(self.hop_length) - i_chunk_start, 0)
+        audio_duration_s = chunks_to_s(n_chunks, self.input_sample_rate, self.chunk_length, self.hop_length)
+        throughput = audio_duration_s / processing_duration_s if processing_duration_s > 0 else float('inf')
+
+        log.info(f'{len(events)} events detected: {events}')
+        log.info(f'Analysed {audio_duration_s:.1f}s of audio in {processing_duration_s:.3f}s ({throughput:.1f} audio-seconds per second)')
+
+        return {
+            'events': events,
+            'audio_duration_s': audio_duration_s,
+            'processing_duration_s': processing_duration_s,
+            'throughput': throughput
+        }
+
+    def iter_matches(self, batch: bool = True, start_s: float = 0, end_s: float | None = None, block_chunks: int = 64) -> Iterator[MatchEvent]:
+        '''
+        Stream the file through the chunk processor, yielding match events as they are found. At most `block_chunks` chunks of audio are held in memory at once, so the first match is available before the whole file has been read.
+
+        ## Args:
+
+        - batch (bool, default True): Analyse each block of chunks in one vectorised batch rather than one chunk at a time
+        - start_s (float, default 0): Time in the file at which to start analysis
+        - end_s (float, default None): Time in the file at which to stop analysis. Defaults to the end of the file.
+        - block_chunks (int, default 64): Number of chunks read from the file at once
+
+        ## Yields:
 
-    def run(self):
-        events = []
-        for i_chunk in range(10*self.input_sample_rate // self.chunk_length, len(self.datapoints) // self.chunk_length):
-          i_sample_start = i_chunk*self.chunk_length
-          i_sample_end = i_sample_start + self.chunk_length
+        - (MatchEvent): fingerprint ID and the time at the end of the chunk which completed the match
+        '''
+        i_chunk_start = int(start_s*self.input_sample_rate) // self.hop_length
+        i_chunk_end = None if end_s is None else int(end_s*self.input_sample_rate) // self.hop_length
 
-          t = chunks_to_s(i_chunk+1, self.input_sample_rate, self.chunk_length)
-          
-          log.debug(f't={t:2f}s;i={i_chunk}')
+        return self.iter_matches_in_chunks(i_chunk_start, i_chunk_end, batch, block_chunks)
 
-          results = self.chunk_processor.analyse_chunk_for_match(self.datapoints[i_sample_start:i_sample_end])
+    def iter_matches_in_chunks(self, i_chunk_start: int, i_chunk_end: int | None = None, batch: bool = True, block_chunks: int = 64, log_matches: bool = True) -> Iterator[MatchEvent]:
+        '''
+        Equivalent to `iter_matches` with the analysed range given as chunk indices `[i_chunk_start, i_chunk_end)` rather than times. With `log_matches` false, matches are yielded without being logged, for callers which may discard them.
+        '''
+        for i_block_start, block in self.source.iter_blocks(self.hop_length, i_chunk_start, i_chunk_end, block_chunks):
+          if batch:
+              results_by_chunk = self.chunk_processor.analyse_chunks_for_matches(block)
+          else:
+              results_by_chunk = (self.chunk_processor.analyse_chunk_for_match(chunk) for chunk in block)
 
-          for match in results:
-              events.append({'t': t})
-              log.info(f't={t:2f}s;Match for {match}!')
+          for i_chunk, results in enumerate(results_by_chunk, start=i_block_start):
+            t = chunks_to_s(i_chunk+1, self.input_sample_rate, self.chunk_length, self.hop_length)
 
-          i_chunk += 1
+            log.debug(f't={t:2f}s;i={i_chunk}')
 
-        log.info(f'{len(events)} events detected: {events}')
\ No newline at end of file
+            for match in results:
+                if log_matches:
+                    log.info(f't={t:2f}s;Match for {match}!')
+                yield {'fingerprint_id': match, 't': t}
@@ -0,0 +1,201 @@
+'''
+Fingerprint configuration files, in JSON or TOML, and their compiled form.
+
+A configuration file is a mapping of fingerprint name to fingerprint definition, in the same shape as `FingerprintInMs`. In TOML each fingerprint is a table:
+
+```toml
+[washing]
+repetitions = 5
+max_period_ms = 1400
+pattern = [
+  { type = "sine", frequency = 3300, start_ms = 0, end_ms = 400 },
+  { type = "any", start_ms = 401, end_ms = 800 },
+]
+```
+
+Compiling validates the fingerprints and converts them to chunkmaps for one sample rate, chunk length and hop. The result is cached next to the configuration file, or in `cache_dir`, and is used for as long as the configuration file is unchanged, so that a restart loads it without validating or compiling anything:
+
+```shell
+python -m beep_detect.core.fingerprint_config fingerprints.toml --sample-rate 48000 --chunk-length 2048
+```
+'''
+import argparse
+import hashlib
+import json
+import logging as log
+import os
+from typing import TypedDict
+
+try:
+  import tomllib
+except ImportError: # Python 3.10
+  tomllib = None
+
+from beep_detect.core.fingerprint_plan import FingerprintPlan, get_plan
+from beep_detect.core.fingerprint_to_chunkmap import fingerprint_to_chunkmap
+from beep_detect.core.types import ChunkMap, FingerprintInMs
+
+# Version of the compiled format. Compiled files of any other version are compiled again.
+COMPILED_VERSION = 1
+
+class CompiledFingerprintFile(TypedDict):
+  version: int
+  source_sha256: str
+  sample_rate: int
+  chunk_length: int
+  hop_length: int
+  fingerprints: dict[str, FingerprintInMs]
+  chunkmaps: dict[str, ChunkMap]
+
+def load_fingerprints(file_name: str) -> dict[str, FingerprintInMs]:
+  '''
+  Load and validate fingerprints from a JSON file, or a TOML file if the name ends in `.toml`
+  '''
+  with open(file_name, 'rb') as f:
+    return parse_fingerprints(f.read(), file_name)
+
+def parse_fingerprints(data: bytes, file_name: str) -> dict[str, FingerprintInMs]:
+  '''
+  Parse and validate the contents of a fingerprint file, in TOML if `file_name` ends in `.toml` and JSON otherwise
+  '''
+  if file_name.endswith('.toml'):
+    if tomllib is None:
+      raise ValueError(f'Reading TOML fingerprint file "{file_name}" needs Python 3.11 or later')
+    fingerprints = tomllib.loads(data.decode())
+  else:
+    fingerprints = json.loads(data)
+
+  validate_fingerprints(fingerprints)
+  return fingerprints
+
+def validate_fingerprints(fingerprints: dict[str, FingerprintInMs]) -> None:
+  '''
+  Raise `ValueError` if any fingerprint is missing required fields or has an unrecognised section type
+  '''
+  if not isinstance(fingerprints, dict) or len(fingerprints) == 0:
+    raise ValueError('Fingerprints must be a non-empty mapping of fingerprint name to definition')
+
+  for k, fingerprint in fingerprints.items():
+    for field in ('repetitions', 'max_period_ms', 'pattern'):
+      if field not in fingerprint:
+        raise ValueError(f'Fingerprint "{k}" is missing "{field}"')
+
+    if len(fingerprint['pattern']) == 0:
+      raise ValueError(f'Fingerprint "{k}" has an empty pattern')
+
+    for i, section in enumerate(fingerprint['pattern']):
+      if section.get('type') not in ('sine', 'any'):
+        raise ValueError(f'Fingerprint "{k}" section {i} has unrecognised type "{section.get("type")}"')
+      for field in ('start_ms', 'end_ms'):
+        if field not in section:
+          raise ValueError(f'Fingerprint "{k}" section {i} is missing "{field}"')
+      if section['type'] == 'sine' and 'frequency' not in section:
+        raise ValueError(f'Fingerprint "{k}" section {i} is a sine section without "frequency"')
+      if section['start_ms'] > section['end_ms']:
+        raise ValueError(f'Fingerprint "{k}" section {i} ends before it starts')
+
+def compiled_file_name(file_name: str, sample_rate: int, chunk_length: int, hop_length: int | None = None, cache_dir: str | None = None) -> str:
+  '''
+  Where the compiled form of a fingerprint file is cached, for example `fingerprints.48000Hz-2048-2048.compiled.json`
+  '''
+  directory, base_name = os.path.split(file_name)
+  stem = os.path.splitext(base_name)[0]
+  return os.path.join(cache_dir if cache_dir is not None else directory, f'{stem}.{sample_rate}Hz-{chunk_length}-{hop_length or chunk_length}.compiled.json')
+
+def compile_fingerprints(
+    file_name: str,
+    sample_rate: int,
+    chunk_length: int,
+    hop_length: int | None = None,
+    cache_dir: str | None = None
+  ) -> CompiledFingerprintFile:
+  '''
+  Compiled fingerprints from a fingerprint file, loaded from the cache if the file has not changed since it was last compiled for these settings, and otherwise validated, compiled and cached
+
+  ## Args:
+
+  - file_name (str): JSON or TOML fingerprint file
+  - sample_rate (int): Sample rate of the audio to be analysed
+  - chunk_length (int): Number of samples per chunk
+  - hop_length (int, default None): Number of new samples between successive chunks. Defaults to `chunk_length`.
+  - cache_dir (str, default None): Directory for the compiled file. Defaults to the directory of `file_name`.
+
+  ## Returns:
+
+  - (CompiledFingerprintFile): validated fingerprints and their chunkmaps
+  '''
+  hop_length = hop_length or chunk_length
+  with open(file_name, 'rb') as f:
+    data = f.read()
+  source_sha256 = hashlib.sha256(data).hexdigest()
+
+  cache_file_name = compiled_file_name(file_name, sample_rate, chunk_length, hop_length, cache_dir)
+  try:
+    with open(cache_file_name, 'r') as f:
+      compiled: CompiledFingerprintFile = json.load(f)
+    if (compiled['version'], compiled['source_sha256'], compiled['sample_rate'], compiled['chunk_length'], compiled['hop_length']) == (COMPILED_VERSION, source_sha256, sample_rate, chunk_length, hop_length):
+      return compiled
+    log.info(f'Compiled fingerprints in {cache_file_name} are out of date')
+  except (OSError, ValueError, KeyError):
+    pass
+
+  fingerprints = parse_fingerprints(data, file_name)
+  compiled = {
+    'version': COMPILED_VERSION,
+    'source_sha256': source_sha256,
+    'sample_rate': sample_rate,
+    'chunk_length': chunk_length,
+    'hop_length': hop_length,
+    'fingerprints': fingerprints,
+    'chunkmaps': { k: fingerprint_to_chunkmap(f, sample_rate, chunk_length, hop_length) for k, f in fingerprints.items() }
+  }
+
+  # Written to a temporary file first so that a reader never sees a partial file. Failing to cache is not an error.
+  try:
+    with open(cache_file_name + '.tmp', 'w') as f:
+      json.dump(compiled, f)
+    os.replace(cache_file_name + '.tmp', cache_file_name)
+    log.info(f'Compiled fingerprints from {file_name} to {cache_file_name}')
+  except OSError as e:
+    log.warning(f'Could not cache compiled fingerprints in {cache_file_name}: {e}')
+
+  return compiled
+
+def load_plan(
+    file_name: str,
+    sample_rate: int,
+    chunk_length: int,
+    hop_length: int | None = None,
+    cache_dir: str | None = None,
+    **plan_settings
+  ) -> FingerprintPlan:
+  '''
+  `FingerprintPlan` for the fingerprints in a fingerprint file, built from its compiled form (see `compile_fingerprints`) and added to the plan cache. Pass it as the `plan` of a `ChunkProcessor` with `plan.fingerprints`, or construct processors with the same fingerprints and settings to share it from the plan cache.
+
+  ## Args:
+
+  - file_name (str): JSON or TOML fingerprint file
+  - sample_rate (int): Sample rate of the audio to be analysed
+  - chunk_length (int): Number of samples per chunk
+  - hop_length (int, default None): Number of new samples between successive chunks. Defaults to `chunk_length`.
+  - cache_dir (str, default None): Directory for the compiled file. Defaults to the directory of `file_name`.
+  - plan_settings: `tolerance_f`, `peak_prominence`, `peak_distance` and `window`, passed to `get_plan`
+  '''
+  compiled = compile_fingerprints(file_name, sample_rate, chunk_length, hop_length, cache_dir)
+  return get_plan(compiled['fingerprints'], sample_rate, chunk_length, hop_length=hop_length, chunkmaps=compiled['chunkmaps'], **plan_settings)
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Validate a fingerprint file and cache its compiled form')
+  parser.add_argument('file_name', help='JSON or TOML fingerprint file')
+  parser.add_argument('--sample-rate', type=int, required=True)
+  parser.add_argument('--chunk-length', type=int, default=2048)
+  parser.add_argument('--hop-length', type=int, help='Defaults to the chunk length')
+  parser.add_argument('--cache-dir', help='Directory for the compiled file (default the directory of the fingerprint file)')
+  args = parser.parse_args()
+
+  log.basicConfig(level=log.INFO)
+  compiled = compile_fingerprints(args.file_name, args.sample_rate, args.chunk_length, args.hop_length, args.cache_dir)
+  print(f'{len(compiled["fingerprints"])} fingerprints compiled to {compiled_file_name(args.file_name, args.sample_rate, args.chunk_length, args.hop_length, args.cache_dir)}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,111 @@
+import json
+import logging as log
+import numpy as np
+from collections import OrderedDict
+from functools import cached_property
+from threading import Lock
+from beep_detect.core.spectral import get_window, rfftfreq
+from beep_detect.core.compiled_matcher import CompiledFingerprints
+from beep_detect.core.fingerprint_to_chunkmap import fingerprint_to_chunkmap
+from beep_detect.core.targeted_spectrum import TargetedSpectrum
+from beep_detect.core.types import ChunkMap, FingerprintInMs
+
+class FingerprintPlan:
+  '''
+  Everything derived from a set of fingerprints for one sample rate, chunk length and hop: frequency bands, the analysis window, chunkmaps, and (compiled on first use) the arrays used by the compiled matcher and the targeted spectrum backend. A plan holds no match state, so one plan can be shared by any number of `ChunkProcessor`s analysing different streams.
+  '''
+
+  def __init__(
+      self,
+      fingerprints: dict[str, FingerprintInMs],
+      sample_rate: int,
+      chunk_length: int,
+      tolerance_f: float = 0.03,
+      peak_prominence: float = 8,
+      peak_distance: float = 8,
+      hop_length: int | None = None,
+      window: str | None = None,
+      chunkmaps: dict[str, ChunkMap] | None = None
+    ) -> None:
+    self.fingerprints = fingerprints
+    self.sample_rate = sample_rate
+    self.chunk_length = chunk_length
+    self.tolerance_f = tolerance_f
+    self.peak_prominence = peak_prominence
+    self.peak_distance = peak_distance
+    self.hop_length = hop_length or chunk_length
+    self.window = window
+
+    if self.hop_length <= 0 or self.hop_length > chunk_length:
+      raise ValueError(f'Hop length {self.hop_length} must be between 1 and the chunk length {chunk_length}')
+
+    self.frequency_bands = rfftfreq(chunk_length, d=1/sample_rate)
+    self.window_values = None if window is None else get_window(window, chunk_length).astype(np.float32)
+    # Chunkmaps may have been compiled ahead of time, see `load_plan` in `fingerprint_config`
+    if chunkmaps is None:
+      chunkmaps = { k: fingerprint_to_chunkmap(f, sample_rate, chunk_length, self.hop_length) for k, f in fingerprints.items() }
+    elif chunkmaps.keys() != fingerprints.keys():
+      raise ValueError('Precompiled chunkmaps are for different fingerprints')
+    self.chunkmaps = chunkmaps
+    log.info(f'Fingerprint plan compiled for {sample_rate}Hz, {chunk_length} samples per chunk, hop {self.hop_length} with chunkmaps {self.chunkmaps}')
+
+  @cached_property
+  def compiled_fingerprints(self) -> CompiledFingerprints:
+    return CompiledFingerprints(self.chunkmaps, self.frequency_bands, self.tolerance_f)
+
+  @cached_property
+  def targeted_spectrum(self) -> TargetedSpectrum:
+    return TargetedSpectrum(
+      self.chunkmaps,
+      self.chunk_length,
+      self.frequency_bands,
+      self.tolerance_f,
+      self.peak_prominence,
+      self.peak_distance,
+      window=self.window_values
+    )
+
+_plan_cache: OrderedDict[tuple, FingerprintPlan] = OrderedDict()
+_plan_cache_lock = Lock()
+PLAN_CACHE_SIZE = 16
+
+def get_plan(
+    fingerprints: dict[str, FingerprintInMs],
+    sample_rate: int,
+    chunk_length: int,
+    tolerance_f: float = 0.03,
+    peak_prominence: float = 8,
+    peak_distance: float = 8,
+    hop_length: int | None = None,
+    window: str | None = None,
+    chunkmaps: dict[str, ChunkMap] | None = None
+  ) -> FingerprintPlan:
+  '''
+  Get a `FingerprintPlan`, reusing a previously compiled plan for the same fingerprints and settings if there is one. Plans are keyed by the fingerprint definitions as well as (sample_rate, chunk_length, hop) and the matching settings, and the least recently used plans are evicted once more than `PLAN_CACHE_SIZE` are cached. `chunkmaps` compiled ahead of time for the same fingerprints, sample rate, chunk length and hop are used instead of compiling them again.
+  '''
+  key = (
+    json.dumps(fingerprints, sort_keys=True),
+    sample_rate,
+    chunk_length,
+    hop_length or chunk_length,
+    tolerance_f,
+    peak_prominence,
+    peak_distance,
+    window
+  )
+
+  with _plan_cache_lock:
+    if key in _plan_cache:
+      _plan_cache.move_to_end(key)
+      return _plan_cache[key]
+
+  # Compile outside the lock. If two threads race, both plans are equivalent and the first one cached wins.
+  plan = FingerprintPlan(fingerprints, sample_rate, chunk_length, tolerance_f, peak_prominence, peak_distance, hop_length, window, chunkmaps)
+
+  with _plan_cache_lock:
+    plan = _plan_cache.setdefault(key, plan)
+    _plan_cache.move_to_end(key)
+    while len(_plan_cache) > PLAN_CACHE_SIZE:
+      _plan_cache.popitem(last=False)
+
+  return plan
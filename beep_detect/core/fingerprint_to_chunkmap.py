@@ -1,8 +1,8 @@
 from beep_detect.core.types import FingerprintInMs, ChunkMap
 from beep_detect.core.time_conversion import ms_to_chunks
 
-def fingerprint_to_chunkmap(fingerprint: FingerprintInMs, sample_rate: int, chunk_length: int) -> ChunkMap:
-  mtc = lambda m: ms_to_chunks(m, sample_rate, chunk_length)
+def fingerprint_to_chunkmap(fingerprint: FingerprintInMs, sample_rate: int, chunk_length: int, hop_length: int | None = None) -> ChunkMap:
+  mtc = lambda m: ms_to_chunks(m, sample_rate, chunk_length, hop_length)
   pattern = fingerprint['pattern']
   frequencies_to_match_by_chunk = []
   aggregate_start_chunk = mtc(min([section['start_ms'] for section in pattern]))
@@ -0,0 +1,276 @@
+'''
+Learn a fingerprint from a recording of an appliance beeping.
+
+Usage:
+
+```shell
+python -m beep_detect.core.learn "data/Washing machine finish.wav" --start-s 10 --end-s 21 --name washing -o fingerprints.json
+```
+'''
+import argparse
+import io
+import json
+import logging as log
+import math
+import os
+import sys
+import numpy as np
+from timeit import default_timer as timer
+from typing import TypedDict
+
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.fingerprint_config import validate_fingerprints
+from beep_detect.core.scan import scan_files
+from beep_detect.core.spectral import find_peaks
+from beep_detect.core.time_conversion import chunks_to_ms
+from beep_detect.core.types import FingerprintInMs, MatchEvent, SectionInMs
+from beep_detect.core.wav_source import WavSource
+
+# Longest window which can be learned from. Peaks are kept for every chunk in the window.
+MAX_WINDOW_S = 600
+
+# Number of chunks turned into a dense matrix at a time when scoring tones
+SCORE_BLOCK_CHUNKS = 256
+
+# Runs of the tone shorter than this fraction of a typical long run (the 90th percentile) are taken to be noise
+BEEP_LENGTH_FRACTION = 0.4
+
+class LearnResult(TypedDict):
+    fingerprint: FingerprintInMs
+    frequency: float
+    beeps: int
+    matched_in_window: bool
+    events: list[MatchEvent]
+
+def find_window_peaks(processor: ChunkProcessor, source: WavSource, i_chunk_start: int, i_chunk_end: int) -> tuple[list[np.ndarray], list[np.ndarray]]:
+  '''
+  Streaming spectrogram of a window of a file, reduced to the peak indices of each chunk and their prominences, using the processor's FFT and peak settings
+  '''
+  peaks_by_chunk = []
+  prominences_by_chunk = []
+  for _, block in source.iter_blocks(processor.hop_length, i_chunk_start, i_chunk_end):
+    for freq_db in processor.compute_spectrum_db(block):
+      peaks, properties = find_peaks(freq_db, prominence=processor.peak_prominence, distance=processor.peak_distance)
+      peaks_by_chunk.append(peaks)
+      prominences_by_chunk.append(properties['prominences'])
+
+  return peaks_by_chunk, prominences_by_chunk
+
+def score_tones(peaks_by_chunk: list[np.ndarray], prominences_by_chunk: list[np.ndarray], n_bins: int) -> np.ndarray:
+  '''
+  Score every frequency bin by the total prominence of its sustained peaks: peaks at that bin or a neighbouring bin which are also present in the previous or next chunk. Beeps score highly because they are loud and steady, while noise peaks come and go from chunk to chunk.
+  '''
+  n_chunks = len(peaks_by_chunk)
+  scores = np.zeros(n_bins)
+  for start in range(0, n_chunks, SCORE_BLOCK_CHUNKS):
+    # Include one chunk either side so that sustain can be tested across block edges
+    lo = max(start - 1, 0)
+    hi = min(start + SCORE_BLOCK_CHUNKS + 1, n_chunks)
+    prominence = np.zeros((hi - lo, n_bins))
+    for i_row, i_chunk in enumerate(range(lo, hi)):
+      prominence[i_row, peaks_by_chunk[i_chunk]] = prominences_by_chunk[i_chunk]
+
+    # Merge neighbouring bins, as a tone between two bins may peak in either
+    merged = prominence.copy()
+    np.maximum(merged[:, 1:], prominence[:, :-1], out=merged[:, 1:])
+    np.maximum(merged[:, :-1], prominence[:, 1:], out=merged[:, :-1])
+
+    present = merged > 0
+    sustained = np.zeros_like(present)
+    sustained[1:] |= present[:-1]
+    sustained[:-1] |= present[1:]
+    sustained &= present
+
+    rows = slice(start - lo, start - lo + min(SCORE_BLOCK_CHUNKS, n_chunks - start))
+    scores += (merged * sustained)[rows].sum(axis=0)
+
+  return scores
+
+def find_beeps(present: np.ndarray, max_gap_chunks: int, min_length_chunks: int) -> tuple[np.ndarray, np.ndarray]:
+  '''
+  Find runs of chunks in which a tone is present, bridging gaps of up to `max_gap_chunks`. Runs shorter than `min_length_chunks`, or much shorter than most of the other runs, are ignored.
+
+  ## Returns:
+
+  - (tuple[np.ndarray, np.ndarray]): first chunk and length in chunks of each beep
+  '''
+  edges = np.diff(np.concatenate([[0], present.astype(np.int8), [0]]))
+  starts = np.flatnonzero(edges == 1)
+  ends = np.flatnonzero(edges == -1)
+  if len(starts) == 0:
+    return starts, starts
+
+  # Merge runs separated by short gaps
+  keep = np.concatenate([[True], starts[1:] - ends[:-1] > max_gap_chunks])
+  starts = starts[keep]
+  ends = np.concatenate([ends[np.flatnonzero(keep)[1:] - 1], ends[-1:]])
+
+  lengths = ends - starts
+  is_beep = lengths >= min_length_chunks
+  if is_beep.any():
+    is_beep &= lengths >= BEEP_LENGTH_FRACTION * np.percentile(lengths[is_beep], 90)
+  return starts[is_beep], lengths[is_beep]
+
+def infer_fingerprint(
+    starts: np.ndarray,
+    lengths: np.ndarray,
+    frequency: float,
+    sample_rate: int,
+    chunk_length: int,
+    hop_length: int
+  ) -> FingerprintInMs:
+  '''
+  Build a fingerprint from the beeps of one tone, repeated once per beep. Each repetition is a sine section as long as most beeps, followed by an `any` section which ends between the end of a long beep and the start of the next one, so that the rest of a beep cannot start another repetition. The longest gap between beeps is allowed for, plus half again.
+  '''
+  ctm = lambda c: math.floor(chunks_to_ms(c, sample_rate, chunk_length, hop_length))
+
+  # Beeps are rarely aligned with chunks, so the first and last chunk of each run may only partly contain the tone
+  sine_chunks = max(int(np.percentile(lengths, 25)) - 1, 1)
+  pattern_chunks = int(np.percentile(lengths, 75)) + 1
+  max_wait_chunks = pattern_chunks
+  if len(starts) > 1:
+    intervals = np.diff(starts)
+    pattern_chunks = min((pattern_chunks + int(intervals.min())) // 2, int(intervals.min()) - 2)
+    max_wait_chunks = int(intervals.max()) - pattern_chunks
+  pattern_chunks = max(pattern_chunks, sine_chunks)
+
+  pattern: list[SectionInMs] = [{ 'type': 'sine', 'frequency': round(frequency), 'start_ms': 0, 'end_ms': ctm(sine_chunks) }]
+  if pattern_chunks > sine_chunks:
+    pattern.append({ 'type': 'any', 'start_ms': ctm(sine_chunks) + 1, 'end_ms': ctm(pattern_chunks) })
+
+  return {
+    'repetitions': len(starts),
+    'max_period_ms': 100 * math.ceil(1.5 * chunks_to_ms(max_wait_chunks, sample_rate, chunk_length, hop_length) / 100),
+    'pattern': pattern
+  }
+
+def learn_fingerprint(
+    file_name: str,
+    start_s: float,
+    end_s: float,
+    chunk_length: int = 2048,
+    min_beep_ms: float = 60,
+    validate: bool = True,
+    workers: int | None = None
+  ) -> LearnResult:
+  '''
+  Learn a fingerprint from the beeps in a window of a recording
+
+  The window is analysed with the same FFT and peak settings as `ChunkProcessor`. The loudest sustained tone is taken to be the beep, and each run of chunks containing it is one repetition. The fingerprint is then validated by detecting it in the window, reducing the number of repetitions if the detector misses it, and finally by scanning the whole recording in parallel. Only the peaks within the window are held in memory; the recording is streamed.
+
+  ## Args:
+
+  - file_name (str): .wav file to learn from
+  - start_s (float): Start of a window containing the beeps, in seconds. It should include every repetition and as little else as possible.
+  - end_s (float): End of the window, in seconds
+  - chunk_length (int, default 2048): Number of samples per chunk, which should match the detector that will use the fingerprint
+  - min_beep_ms (float, default 60): Shortest run of the tone which counts as a beep
+  - validate (bool, default True): Scan the whole recording with the learned fingerprint
+  - workers (int, default None): Number of processes for validation. Defaults to the number of CPUs.
+
+  ## Returns:
+
+  - (LearnResult): The fingerprint, the detected tone, the number of beeps found, whether the detector matches the fingerprint in the window, and every match in the recording
+  '''
+  if not 0 <= start_s < end_s:
+    raise ValueError(f'Invalid window from {start_s}s to {end_s}s')
+  if end_s - start_s > MAX_WINDOW_S:
+    raise ValueError(f'Window of {end_s - start_s:.0f}s is longer than the maximum of {MAX_WINDOW_S}s')
+
+  start_time = timer()
+  with WavSource(file_name) as source:
+    processor = ChunkProcessor({}, source.sample_rate, chunk_length)
+    sample_rate, hop_length = source.sample_rate, processor.hop_length
+    i_chunk_start = int(start_s * sample_rate) // hop_length
+    i_chunk_end = min(math.ceil(end_s * sample_rate / hop_length), source.n_chunks(hop_length))
+    peaks_by_chunk, prominences_by_chunk = find_window_peaks(processor, source, i_chunk_start, i_chunk_end)
+
+  if len(peaks_by_chunk) == 0:
+    raise ValueError(f'Window from {start_s}s to {end_s}s contains no audio')
+
+  # Take the loudest sustained tone, refined to the prominence-weighted mean frequency of its neighbouring bins
+  frequency_bands = processor.frequency_bands
+  scores = score_tones(peaks_by_chunk, prominences_by_chunk, len(frequency_bands) - 1)
+  i_tone = int(np.argmax(scores))
+  if scores[i_tone] == 0:
+    raise ValueError(f'No sustained tone found between {start_s}s and {end_s}s')
+  neighbours = slice(max(i_tone - 1, 0), i_tone + 2)
+  frequency = float(np.average(frequency_bands[neighbours], weights=scores[neighbours] + 1e-12))
+
+  # A chunk contains the tone if any of its peaks would match it in the detector
+  present = np.array([np.isclose(frequency_bands[peaks], frequency, rtol=processor.tolerance_f).any() for peaks in peaks_by_chunk])
+  min_length_chunks = max(round(1e-3 * min_beep_ms * sample_rate / hop_length), 1)
+  starts, lengths = find_beeps(present, processor.tolerance_t, min_length_chunks)
+  if len(starts) == 0:
+    raise ValueError(f'Tone at {frequency:.0f}Hz is never sustained for {min_beep_ms}ms')
+
+  fingerprint = infer_fingerprint(starts, lengths, frequency, sample_rate, chunk_length, hop_length)
+  log.info(f'Found {len(starts)} beeps at {frequency:.0f}Hz in {timer() - start_time:.3f}s: {fingerprint}')
+
+  # Replay the window through the detector, with fewer repetitions if it does not match
+  matched_in_window = False
+  while not matched_in_window:
+    validate_fingerprints({ 'learned': fingerprint })
+    runner = FileInputRunner({ 'learned': fingerprint }, file_name, chunk_length, matcher='compiled')
+    matched_in_window = next(runner.iter_matches(start_s=start_s, end_s=end_s), None) is not None
+    runner.source.close()
+    if matched_in_window or fingerprint['repetitions'] == 1:
+      break
+    fingerprint['repetitions'] -= 1
+    log.info(f'Detector did not match the window, retrying with {fingerprint["repetitions"]} repetitions')
+
+  events = []
+  if validate:
+    output = io.StringIO()
+    # A learned fingerprint has a single tone, so the targeted backend only searches a small part of the spectrum for peaks
+    scan_files({ 'learned': fingerprint }, [file_name], output, workers, chunk_length, spectrum_backend='targeted')
+    events = [{ 'fingerprint_id': e['fingerprint_id'], 't': e['t'] } for e in map(json.loads, output.getvalue().splitlines())]
+    log.info(f'Validated against the whole recording in {timer() - start_time:.3f}s total: {len(events)} matches')
+
+  return {
+    'fingerprint': fingerprint,
+    'frequency': frequency,
+    'beeps': len(starts),
+    'matched_in_window': matched_in_window,
+    'events': events
+  }
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description='Learn a fingerprint from a recording of beeps')
+  parser.add_argument('file', help='.wav file to learn from')
+  parser.add_argument('--start-s', type=float, required=True, help='Start of a window containing the beeps')
+  parser.add_argument('--end-s', type=float, required=True, help='End of the window containing the beeps')
+  parser.add_argument('--name', default=None, help='Name of the fingerprint (default file name)')
+  parser.add_argument('-o', '--output', default=None, help='JSON fingerprints file to add the fingerprint to (default print to stdout)')
+  parser.add_argument('--chunk-length', type=int, default=2048, help='Number of samples per chunk')
+  parser.add_argument('--min-beep-ms', type=float, default=60, help='Shortest run of the tone which counts as a beep')
+  parser.add_argument('--no-validate', action='store_true', help='Skip scanning the whole recording')
+  parser.add_argument('-j', '--workers', type=int, default=None, help='Number of processes for validation (default number of CPUs)')
+  args = parser.parse_args(argv)
+
+  log.basicConfig(level=log.INFO, stream=sys.stderr)
+
+  result = learn_fingerprint(args.file, args.start_s, args.end_s, args.chunk_length, args.min_beep_ms, not args.no_validate, args.workers)
+  if not result['matched_in_window']:
+    log.warning('The detector does not match the learned fingerprint in the window. Try a tighter window around the beeps.')
+  for event in result['events']:
+    log.info(f'Match at {event["t"]:.3f}s')
+
+  name = args.name or os.path.splitext(os.path.basename(args.file))[0]
+  if args.output is None:
+    json.dump({ name: result['fingerprint'] }, sys.stdout, indent=2)
+    print()
+    return
+
+  fingerprints = {}
+  if os.path.exists(args.output):
+    with open(args.output, 'r') as f:
+      fingerprints = json.load(f)
+  fingerprints[name] = result['fingerprint']
+  with open(args.output, 'w') as f:
+    json.dump(fingerprints, f, indent=2)
+    f.write('\n')
+
+if __name__ == '__main__':
+  main()
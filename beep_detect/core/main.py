@@ -1,59 +1,28 @@
-from beep_detect.core.time_conversion import ms_to_chunks
-from beep_detect.core.file_input_runner import FileInputRunner
+import os
 import logging
+from beep_detect.core.file_input_runner import FileInputRunner
 from beep_detect.core.device_input_runner import DeviceInputRunner
 import time
 from datetime import datetime
 
-from beep_detect.core.types import FingerprintInMs
-
-logging.getLogger().setLevel(logging.DEBUG)
-
-fingerprints: dict[str, FingerprintInMs] = {
-  "washing": {
-    'repetitions': 5,
-    'max_period_ms': 1400,
-    'pattern':
-      [
-        {
-          'type': 'sine',
-          'frequency': 3300,
-          'start_ms': 0,
-          'end_ms': 400
-        },
-        {
-          'type': 'any',
-          'start_ms': 401,
-          'end_ms': 800
-        }
-      ]
-  },
-  "microwave": {
-    'repetitions': 5,
-    'max_period_ms': 1000,
-    'pattern':
-      [
-        {
-          'type': 'sine',
-          'frequency': 2030,
-          'start_ms': 0,
-          'end_ms': 150
-        },
-        {
-          'type': 'any',
-          'start_ms': 151,
-          'end_ms': 400
-        }
-      ]
-  },
-}
+from beep_detect.core.fingerprint_config import load_fingerprints
 
-# fir = FileInputRunner(fingerprints, '../../data/Washing machine finish.wav')
-# fir.run()
+# Fingerprints are kept in a config file rather than here, see fingerprint_config.py for the format
+FINGERPRINTS_FILE = os.path.join(os.path.dirname(__file__), 'fingerprints.toml')
 
 def match_callback(fingerprint_id):
     logging.info(f'{datetime.now()}: Match found for {fingerprint_id}')
 
-with DeviceInputRunner(fingerprints, match_callback) as d:
-    while d.stream is not None and d.stream.is_active():
-        time.sleep(0.5)
+def main() -> None:
+    logging.getLogger().setLevel(logging.DEBUG)
+    fingerprints = load_fingerprints(FINGERPRINTS_FILE)
+
+    # fir = FileInputRunner(fingerprints, '../../data/Washing machine finish.wav')
+    # fir.run()
+
+    with DeviceInputRunner(fingerprints, match_callback) as d:
+        while d.stream is not None and d.stream.is_active():
+            time.sleep(0.5)
+
+if __name__ == '__main__':
+    main()
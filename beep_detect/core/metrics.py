@@ -0,0 +1,152 @@
+import weakref
+from bisect import bisect_left
+from threading import Lock
+
+# Stages of the analysis of a chunk which are timed
+STAGES = ('decimate', 'fft', 'db', 'peaks', 'matching', 'callback', 'publish')
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_LATENCY_BUCKETS_S = (10e-6, 25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3, 250e-3)
+
+# Seconds of audio over which the real-time factor is smoothed
+RTF_SMOOTHING_S = 10.
+
+_registry: 'weakref.WeakSet[Metrics]' = weakref.WeakSet()
+_registry_lock = Lock()
+
+class Histogram:
+    '''
+    Histogram with fixed bucket bounds, in the cumulative form used by Prometheus
+    '''
+
+    def __init__(self, bounds: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS_S) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # Last bucket is +Inf
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float, count: int = 1) -> None:
+        '''
+        Record `count` observations of `value`. Batched analysis records the mean per-chunk duration once for each chunk in the batch.
+        '''
+        self.counts[bisect_left(self.bounds, value)] += count
+        self.sum += value * count
+        self.count += count
+
+    def cumulative_counts(self) -> list[int]:
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+class Metrics:
+    '''
+    Low-overhead metrics for one detector: latency histograms for each analysis stage, counters and a real-time factor gauge. Components only record metrics when they are given a `Metrics` instance, so there is no cost when metrics are disabled.
+
+    Updates are not locked. Each instance should be written by one analysis thread at a time, though it may be read from any thread. Every live instance is included in `render_metrics`, labelled by `detector`.
+    '''
+
+    def __init__(self, detector: str = 'default', latency_buckets_s: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS_S) -> None:
+        self.detector = detector
+        self.stage_latency_s = { stage: Histogram(latency_buckets_s) for stage in STAGES }
+        self.chunks_processed = 0
+        self.matches: dict[str, int] = {}
+        self.partial_match_resets = 0
+        self.dropped_chunks = 0
+        self.input_overflows = 0
+        self.audio_s = 0.
+        self.processing_s = 0.
+        self.real_time_factor = 0.
+        self.publish_queue_depth = 0
+        self.publish_dropped = 0
+
+        with _registry_lock:
+            _registry.add(self)
+
+    def observe_stage(self, stage: str, duration_s: float, n_chunks: int = 1) -> None:
+        '''
+        Record the duration of one stage of analysis for `n_chunks` chunks
+        '''
+        self.stage_latency_s[stage].observe(duration_s / n_chunks, n_chunks)
+
+    def record_chunks(self, n_chunks: int, audio_s: float, processing_s: float) -> None:
+        '''
+        Record that `n_chunks` chunks covering `audio_s` seconds of audio were analysed in `processing_s` seconds. The real-time factor is the processing time per second of audio, smoothed over about `RTF_SMOOTHING_S` seconds of audio; above 1, analysis is not keeping up.
+        '''
+        self.chunks_processed += n_chunks
+        self.audio_s += audio_s
+        self.processing_s += processing_s
+        if audio_s > 0:
+            weight = min(audio_s / RTF_SMOOTHING_S, 1.)
+            self.real_time_factor += weight * (processing_s / audio_s - self.real_time_factor)
+
+    def record_match(self, fingerprint_id: str) -> None:
+        self.matches[fingerprint_id] = self.matches.get(fingerprint_id, 0) + 1
+
+    def render(self) -> str:
+        return _render([self])
+
+def render_metrics() -> str:
+    '''
+    Every live `Metrics` instance in the Prometheus text exposition format
+    '''
+    with _registry_lock:
+        metrics = sorted(_registry, key=lambda m: m.detector)
+    return _render(metrics)
+
+def _format_labels(**labels) -> str:
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + '}'
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _render(metrics: list[Metrics]) -> str:
+    lines = []
+
+    def family(name: str, type: str, help: str) -> None:
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {type}')
+
+    name = 'beep_detect_stage_latency_seconds'
+    family(name, 'histogram', 'Latency of each analysis stage per chunk')
+    for m in metrics:
+        for stage, histogram in m.stage_latency_s.items():
+            bounds = [repr(b) for b in histogram.bounds] + ['+Inf']
+            for bound, count in zip(bounds, histogram.cumulative_counts()):
+                lines.append(f'{name}_bucket{_format_labels(detector=m.detector, stage=stage, le=bound)} {count}')
+            lines.append(f'{name}_sum{_format_labels(detector=m.detector, stage=stage)} {histogram.sum!r}')
+            lines.append(f'{name}_count{_format_labels(detector=m.detector, stage=stage)} {histogram.count}')
+
+    counters = [
+        ('beep_detect_chunks_processed_total', 'Chunks analysed', 'chunks_processed'),
+        ('beep_detect_partial_match_resets_total', 'Partial fingerprint matches abandoned before completing', 'partial_match_resets'),
+        ('beep_detect_dropped_chunks_total', 'Chunks of audio dropped before analysis', 'dropped_chunks'),
+        ('beep_detect_input_overflows_total', 'Input overflows reported by the audio device', 'input_overflows'),
+        ('beep_detect_audio_seconds_total', 'Seconds of audio analysed', 'audio_s'),
+        ('beep_detect_processing_seconds_total', 'Seconds spent analysing audio', 'processing_s'),
+        ('beep_detect_publish_dropped_total', 'Match events dropped from a full publish queue', 'publish_dropped')
+    ]
+    for name, help, attribute in counters:
+        family(name, 'counter', help)
+        for m in metrics:
+            lines.append(f'{name}{_format_labels(detector=m.detector)} {getattr(m, attribute)!r}')
+
+    name = 'beep_detect_matches_total'
+    family(name, 'counter', 'Completed fingerprint matches')
+    for m in metrics:
+        for fingerprint_id, count in sorted(m.matches.items()):
+            lines.append(f'{name}{_format_labels(detector=m.detector, fingerprint=fingerprint_id)} {count}')
+
+    name = 'beep_detect_real_time_factor'
+    family(name, 'gauge', 'Smoothed processing time per second of audio')
+    for m in metrics:
+        lines.append(f'{name}{_format_labels(detector=m.detector)} {m.real_time_factor!r}')
+
+    name = 'beep_detect_publish_queue_depth'
+    family(name, 'gauge', 'Match events waiting to be published')
+    for m in metrics:
+        lines.append(f'{name}{_format_labels(detector=m.detector)} {m.publish_queue_depth}')
+
+    return '\n'.join(lines) + '\n'
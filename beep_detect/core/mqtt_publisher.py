@@ -0,0 +1,358 @@
+import json
+import logging as log
+import threading
+import time
+from collections import deque
+from typing import Callable, Protocol, TypedDict
+
+from beep_detect.core.metrics import Metrics
+
+class PublisherStats(TypedDict):
+    connected: bool
+    queue_depth: int
+    max_queue_depth: int
+    published: int
+    dropped: int
+    connects: int
+    failed_batches: int
+    last_latency_ms: float
+    max_latency_ms: float
+    mean_latency_ms: float
+
+class MqttConnection(Protocol):
+    '''
+    An open connection to a broker, as returned by the client factory of an `MqttPublisher`
+    '''
+
+    def publish_batch(self, messages: list[tuple[str, bytes]], qos: int, retain: bool, timeout_s: float) -> None:
+        '''
+        Publish messages in order and wait until the broker has them (acknowledged for QoS 1 and 2, written for QoS 0). Raises `ConnectionError` if they could not all be published within the timeout.
+        '''
+        ...
+
+    def close(self) -> None:
+        ...
+
+class MqttPublisher:
+    '''
+    Publishes match events to an MQTT broker without ever blocking the caller. `publish_match` only appends to a bounded in-memory queue; a background thread holds one persistent connection, publishes queued events in batches and reconnects with exponential backoff when the connection fails. If the queue is full the oldest events are dropped.
+
+    A publisher is callable with a fingerprint ID, so it can be passed directly as a match callback. Topics are `<topic_prefix>/<fingerprint_id>`, or `<topic_prefix>/<source_id>/<fingerprint_id>` when a source is given, and payloads are JSON objects with the fingerprint ID, source ID and time of the match. IDs are always one topic level: the characters MQTT does not allow in a topic level of a published message (`/`, the wildcards `+` and `#`, and NUL) are percent-encoded in topics, as is `%` itself, while payloads hold the IDs unchanged.
+
+    Connection failures are retried with backoff. Any other error publishing a batch is logged and the batch is published one event at a time, so that only the events at fault are dropped.
+    '''
+
+    def __init__(
+            self,
+            host: str = 'localhost',
+            port: int = 1883,
+            topic_prefix: str = 'beep_detect',
+            qos: int = 1,
+            retain: bool = False,
+            max_queue: int = 1024,
+            batch_size: int = 32,
+            client_id: str | None = None,
+            username: str | None = None,
+            password: str | None = None,
+            keepalive_s: int = 60,
+            publish_timeout_s: float = 10,
+            min_backoff_s: float = 0.5,
+            max_backoff_s: float = 60,
+            client_factory: Callable[[], MqttConnection] | None = None,
+            metrics: Metrics | None = None
+        ) -> None:
+        '''
+        Initialise an `MqttPublisher`. Call `start` to connect.
+
+        ## Args:
+
+        - host (str, default 'localhost'), port (int, default 1883): Broker address
+        - topic_prefix (str, default 'beep_detect'): Prefix of the topic of every message
+        - qos (int, default 1): MQTT quality of service level, 0, 1 or 2
+        - retain (bool, default False): Ask the broker to retain the last message on each topic
+        - max_queue (int, default 1024): Number of events held while the broker is slow or unreachable, after which the oldest are dropped
+        - batch_size (int, default 32): Maximum number of events published before waiting for acknowledgements
+        - client_id, username, password (str, default None): Passed to the MQTT client
+        - keepalive_s (int, default 60): MQTT keepalive interval
+        - publish_timeout_s (float, default 10): Time allowed for a batch to be acknowledged before the connection is considered failed
+        - min_backoff_s (float, default 0.5), max_backoff_s (float, default 60): Bounds of the delay between reconnection attempts, which doubles after each failure
+        - client_factory (Callable, default None): Opens a connection. Any error it raises is logged and the connection retried with backoff. Defaults to a paho-mqtt client for the given host. Pass `InProcessBroker.connect` to publish to a stand-in broker.
+        - metrics (Metrics, default None): Where to record publish latency, queue depth and dropped events
+        '''
+        if qos not in (0, 1, 2):
+            raise ValueError(f'Invalid QoS {qos}')
+
+        self.topic_prefix = topic_prefix
+        self.qos = qos
+        self.retain = retain
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.publish_timeout_s = publish_timeout_s
+        self.min_backoff_s = min_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.metrics = metrics
+        if client_factory is None:
+            client_factory = lambda: _PahoConnection(host, port, client_id, username, password, keepalive_s)
+        self.client_factory = client_factory
+
+        # Queued events are (topic, payload, enqueue time)
+        self.queue: deque[tuple[str, bytes, float]] = deque()
+        self._queue_lock = threading.Lock()
+        self._data_available = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._connection: MqttConnection | None = None
+
+        self.max_queue_depth = 0
+        self.published = 0
+        self.dropped = 0
+        self.connects = 0
+        self.failed_batches = 0
+        self.last_latency_ms = 0.
+        self.max_latency_ms = 0.
+        self.total_latency_ms = 0.
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._worker = threading.Thread(target=self._run_worker, name='mqtt-publisher', daemon=True)
+        self._worker.start()
+
+    def stop(self, flush_timeout_s: float = 5) -> None:
+        '''
+        Stop publishing, first trying for up to `flush_timeout_s` to publish events still in the queue
+        '''
+        if self._worker is None:
+            return
+        self._flush_deadline = time.monotonic() + flush_timeout_s
+        self._stopping.set()
+        self._data_available.set()
+        self._worker.join()
+        self._worker = None
+
+    def publish_match(self, fingerprint_id: str, source_id: str | None = None) -> None:
+        '''
+        Queue a match event for publishing. Never blocks on the network; safe to call from any thread.
+        '''
+        now = time.time()
+        levels = [fingerprint_id] if source_id is None else [source_id, fingerprint_id]
+        topic = '/'.join([self.topic_prefix, *map(_escape_topic_level, levels)])
+        payload = json.dumps({ 'fingerprint_id': fingerprint_id, 'source_id': source_id, 't': now }).encode('utf8')
+
+        with self._queue_lock:
+            self.queue.append((topic, payload, time.monotonic()))
+            if len(self.queue) > self.max_queue:
+                self.queue.popleft()
+                self._record_dropped(1)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            self._update_queue_depth()
+        self._data_available.set()
+
+    def __call__(self, fingerprint_id: str) -> None:
+        self.publish_match(fingerprint_id)
+
+    @property
+    def stats(self) -> PublisherStats:
+        return {
+            'connected': self._connection is not None,
+            'queue_depth': len(self.queue),
+            'max_queue_depth': self.max_queue_depth,
+            'published': self.published,
+            'dropped': self.dropped,
+            'connects': self.connects,
+            'failed_batches': self.failed_batches,
+            'last_latency_ms': self.last_latency_ms,
+            'max_latency_ms': self.max_latency_ms,
+            'mean_latency_ms': self.total_latency_ms / self.published if self.published > 0 else 0.
+        }
+
+    def _run_worker(self) -> None:
+        backoff_s = self.min_backoff_s
+        while not self._finished():
+            if self._connection is None:
+                try:
+                    self._connection = self.client_factory()
+                    self.connects += 1
+                    log.info('Connected to MQTT broker')
+                except Exception as e:
+                    log.warning(f'Could not connect to MQTT broker, retrying in {backoff_s:.1f}s: {e!r}')
+                    self._wait(backoff_s)
+                    backoff_s = min(2 * backoff_s, self.max_backoff_s)
+                    continue
+
+            with self._queue_lock:
+                batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+                self._update_queue_depth()
+            if len(batch) == 0:
+                self._data_available.wait()
+                self._data_available.clear()
+                continue
+
+            try:
+                published = self._publish(batch)
+            except OSError as e:
+                log.warning(f'Publishing {len(batch)} events to MQTT broker failed, reconnecting in {backoff_s:.1f}s: {e}')
+                self.failed_batches += 1
+                self._disconnect()
+                self._wait(backoff_s)
+                backoff_s = min(2 * backoff_s, self.max_backoff_s)
+                continue
+
+            backoff_s = self.min_backoff_s
+            published_time = time.monotonic()
+            for _, _, enqueue_time in published:
+                self._record_latency(published_time - enqueue_time)
+
+        self._disconnect()
+        if len(self.queue) > 0:
+            log.warning(f'Stopped with {len(self.queue)} MQTT events unpublished')
+
+    def _publish(self, batch: list[tuple[str, bytes, float]]) -> list[tuple[str, bytes, float]]:
+        # Publish a batch, falling back to one event at a time if it fails other than by losing the connection.
+        # Raises `OSError` on losing the connection, with the events not yet published put back in the queue.
+        connection: MqttConnection = self._connection # type: ignore
+        try:
+            connection.publish_batch([(topic, payload) for topic, payload, _ in batch], self.qos, self.retain, self.publish_timeout_s)
+            return batch
+        except OSError:
+            self._requeue(batch)
+            raise
+        except Exception:
+            log.exception(f'Publishing {len(batch)} events to MQTT broker failed, publishing them one at a time')
+
+        published = []
+        for i, (topic, payload, enqueue_time) in enumerate(batch):
+            try:
+                connection.publish_batch([(topic, payload)], self.qos, self.retain, self.publish_timeout_s)
+                published.append((topic, payload, enqueue_time))
+            except OSError:
+                self._requeue(batch[i:])
+                raise
+            except Exception:
+                log.exception(f'Dropping MQTT event on topic "{topic}" which could not be published')
+                self._record_dropped(1)
+        return published
+
+    def _finished(self) -> bool:
+        if not self._stopping.is_set():
+            return False
+        return len(self.queue) == 0 or time.monotonic() >= self._flush_deadline
+
+    def _wait(self, duration_s: float) -> None:
+        # Cut a wait short when asked to stop, and once stopping, keep retrying only until the flush deadline
+        if self._stopping.is_set():
+            time.sleep(min(duration_s, max(self._flush_deadline - time.monotonic(), 0)))
+        else:
+            self._stopping.wait(duration_s)
+
+    def _requeue(self, batch: list[tuple[str, bytes, float]]) -> None:
+        # Put a failed batch back at the front of the queue, dropping its oldest events if newer events filled the space
+        with self._queue_lock:
+            space = max(self.max_queue - len(self.queue), 0)
+            requeued = batch[len(batch) - space:] if space < len(batch) else batch
+            self.queue.extendleft(reversed(requeued))
+            self._record_dropped(len(batch) - len(requeued))
+            self._update_queue_depth()
+
+    def _disconnect(self) -> None:
+        if self._connection is None:
+            return
+        try:
+            self._connection.close()
+        except Exception as e:
+            log.debug(f'Error closing MQTT connection: {e!r}')
+        self._connection = None
+
+    def _update_queue_depth(self) -> None:
+        if self.metrics is not None:
+            self.metrics.publish_queue_depth = len(self.queue)
+
+    def _record_dropped(self, n_events: int) -> None:
+        self.dropped += n_events
+        if self.metrics is not None:
+            self.metrics.publish_dropped += n_events
+
+    def _record_latency(self, latency_s: float) -> None:
+        latency_ms = 1e3 * latency_s
+        self.published += 1
+        self.last_latency_ms = latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self.total_latency_ms += latency_ms
+        if self.metrics is not None:
+            self.metrics.observe_stage('publish', latency_s)
+
+def _escape_topic_level(name: str) -> str:
+    for c in '%/+#\0':
+        name = name.replace(c, f'%{ord(c):02X}')
+    return name
+
+class _PahoConnection:
+    def __init__(self, host: str, port: int, client_id: str | None, username: str | None, password: str | None, keepalive_s: int) -> None:
+        # paho-mqtt is optional, see the `mqtt` dependency group
+        import paho.mqtt.client as mqtt
+        self.mqtt = mqtt
+
+        # Reconnection is handled by `MqttPublisher` so that queued events can be retried in order
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id or '', reconnect_on_failure=False)
+        if username is not None:
+            self.client.username_pw_set(username, password)
+        self.client.connect(host, port, keepalive_s)
+        self.client.loop_start()
+
+    def publish_batch(self, messages: list[tuple[str, bytes]], qos: int, retain: bool, timeout_s: float) -> None:
+        deadline = time.monotonic() + timeout_s
+        infos = [self.client.publish(topic, payload, qos, retain) for topic, payload in messages]
+        for info in infos:
+            if info.rc != self.mqtt.MQTT_ERR_SUCCESS:
+                raise ConnectionError(self.mqtt.error_string(info.rc))
+            try:
+                info.wait_for_publish(max(deadline - time.monotonic(), 0))
+            except (RuntimeError, ValueError) as e:
+                raise ConnectionError(str(e)) from e
+            if not info.is_published():
+                raise ConnectionError(f'Broker did not acknowledge within {timeout_s}s')
+
+    def close(self) -> None:
+        self.client.disconnect()
+        self.client.loop_stop()
+
+class InProcessBroker:
+    '''
+    Stand-in for an MQTT broker which records published messages in memory, for trying out an `MqttPublisher` without a real broker. It can be taken offline, which fails open connections and refuses new ones, and given a delay before acknowledging each batch.
+    '''
+
+    def __init__(self, ack_delay_s: float = 0.) -> None:
+        self.ack_delay_s = ack_delay_s
+        self.messages: list[tuple[str, bytes, int, bool]] = []
+        self.connects = 0
+        self.online = True
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def connect(self) -> MqttConnection:
+        with self._lock:
+            if not self.online:
+                raise ConnectionRefusedError('Broker is offline')
+            self.connects += 1
+            return _InProcessConnection(self, self._generation)
+
+    def set_online(self, online: bool) -> None:
+        with self._lock:
+            if not online:
+                self._generation += 1
+            self.online = online
+
+class _InProcessConnection:
+    def __init__(self, broker: InProcessBroker, generation: int) -> None:
+        self.broker = broker
+        self.generation = generation
+
+    def publish_batch(self, messages: list[tuple[str, bytes]], qos: int, retain: bool, timeout_s: float) -> None:
+        if self.broker.ack_delay_s > 0:
+            time.sleep(min(self.broker.ack_delay_s, timeout_s))
+        with self.broker._lock:
+            if self.generation != self.broker._generation:
+                raise ConnectionResetError('Broker went offline')
+            self.broker.messages.extend((topic, payload, qos, retain) for topic, payload in messages)
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,327 @@
+import numpy as np
+import logging as log
+from math import ceil, log2
+from threading import Lock
+from numpy.lib.stride_tricks import sliding_window_view
+from timeit import default_timer as timer
+from typing import TypedDict
+
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.spectral import firwin
+from beep_detect.core.types import FingerprintInMs
+
+# A decimated stream must have at least this many samples per second for every cycle of the highest frequency it
+# carries: 2 for Nyquist, plus headroom for the roll-off of the anti-aliasing filter
+MIN_SAMPLES_PER_CYCLE = 2.5
+
+# Taps of the anti-aliasing filter for each unit of the decimation factor
+TAPS_PER_DECIMATION = 16
+
+class AnalysisGroup(TypedDict):
+    fingerprint_ids: list[str]
+    decimation: int
+    chunk_length: int
+
+def plan_analysis_groups(
+        fingerprints: dict[str, FingerprintInMs],
+        sample_rate: int,
+        chunk_length: int,
+        tolerance_f: float = 0.03,
+        max_decimation: int = 8
+    ) -> list[AnalysisGroup]:
+    '''
+    Group fingerprints by the resolution they need. Each fingerprint is given:
+
+    - the largest power of 2 decimation, up to `max_decimation` and dividing `sample_rate`, which keeps its highest frequency well below the decimated Nyquist frequency
+    - a power of 2 chunk length of the decimated stream. This starts from the duration of `chunk_length` at the full sample rate, is shortened until there are at least two chunks per section of the pattern, and is lengthened again if needed so that its lowest frequency can still be matched within `tolerance_f`.
+
+    Fingerprints given the same decimation and chunk length form one group.
+
+    ## Args:
+
+    - fingerprints (dict): Mapping of fingerprint name to fingerprint definition
+    - sample_rate (int): Sample rate of the input stream
+    - chunk_length (int): Chunk length which would be used without analysis groups
+    - tolerance_f (float, default 0.03): Relative frequency tolerance used for matching
+    - max_decimation (int, default 8): Largest decimation factor to use
+
+    ## Returns:
+
+    - (list[AnalysisGroup]): groups in order of decimation then chunk length
+    '''
+    groups: dict[tuple[int, int], list[str]] = {}
+    for k, fingerprint in fingerprints.items():
+        freqs = [section['frequency'] for section in fingerprint['pattern'] if section['type'] == 'sine']
+        f_max = max(freqs, default=0) * (1 + tolerance_f)
+        decimation = 1
+        while (
+            2 * decimation <= max_decimation
+            and sample_rate % (2 * decimation) == 0
+            and sample_rate / (2 * decimation) >= MIN_SAMPLES_PER_CYCLE * f_max
+        ):
+            decimation *= 2
+        decimated_rate = sample_rate // decimation
+
+        shortest_section_s = 1e-3 * min(section['end_ms'] - section['start_ms'] for section in fingerprint['pattern'])
+        group_chunk_length = max(chunk_length // decimation, 1)
+        while group_chunk_length > 1 and group_chunk_length / decimated_rate > shortest_section_s / 2:
+            group_chunk_length //= 2
+        if len(freqs) > 0:
+            # Peak index i is rFFT bin i+1 but is matched as `frequency_bands[i]`, so a tone is matched as a
+            # frequency up to 1.5 bins below it
+            min_chunk_length = 1.5 * decimated_rate / (tolerance_f * min(freqs))
+            group_chunk_length = max(group_chunk_length, 2 ** ceil(log2(min_chunk_length)))
+
+        groups.setdefault((decimation, group_chunk_length), []).append(k)
+
+    return [
+        { 'fingerprint_ids': ids, 'decimation': decimation, 'chunk_length': group_chunk_length }
+        for (decimation, group_chunk_length), ids in sorted(groups.items())
+    ]
+
+class Decimator:
+    '''
+    Streaming decimator: a linear phase low-pass FIR filter which band-limits the stream to below the decimated Nyquist frequency, evaluated only at the samples that are kept. The filter history and the phase of the next kept sample carry over between calls, so any split of a stream into calls gives the same output.
+
+    Output sample `k` is the filtered input centred on input sample `k * factor`, so that a chunk of the decimated stream covers the same input samples as the chunk at the full sample rate. Computing it needs the `delay` input samples after it, so output lags input by `delay` samples.
+    '''
+
+    def __init__(self, factor: int, n_taps: int | None = None) -> None:
+        '''
+        ## Args:
+
+        - factor (int): Keep one in every `factor` samples
+        - n_taps (int, default None): Length of the filter. Defaults to `TAPS_PER_DECIMATION * factor + 1`.
+        '''
+        self.factor = factor
+        n_taps = n_taps or TAPS_PER_DECIMATION * factor + 1
+        # The filter is symmetric, so it need not be reversed to be applied as a dot product
+        self.taps = firwin(n_taps, 1 / factor).astype(np.float32)
+        self.delay = (n_taps - 1) // 2
+        # The stream is preceded by silence, and the first output is centred on its first sample
+        self._history = np.zeros(n_taps - 1, dtype=np.float32)
+        self._phase = self.delay
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        '''
+        Decimate the next samples of the stream
+
+        ## Returns:
+
+        - (np.ndarray): float32 decimated samples, about `len(samples) / factor` of them
+        '''
+        extended = np.concatenate([self._history, np.asarray(samples, dtype=np.float32)])
+        decimated = sliding_window_view(extended, len(self.taps))[self._phase::self.factor] @ self.taps
+
+        self._phase += len(decimated) * self.factor - len(samples)
+        self._history[:] = extended[len(samples):]
+        return decimated
+
+    def get_state(self) -> dict:
+        '''
+        Snapshot of the filter history and the phase of the next kept sample, which can be restored with `set_state`
+        '''
+        return { 'history': self._history.tolist(), 'phase': self._phase }
+
+    def set_state(self, state: dict) -> None:
+        if len(state['history']) != len(self._history):
+            raise ValueError(f'Snapshot is of a filter with {len(state["history"]) + 1} taps but this one has {len(self.taps)}')
+        self._history[:] = state['history']
+        self._phase = state['phase']
+
+class _Group:
+    def __init__(self, group: AnalysisGroup, chunk_processor: ChunkProcessor) -> None:
+        self.fingerprint_ids = group['fingerprint_ids']
+        self.decimation = group['decimation']
+        self.chunk_processor = chunk_processor
+        self.decimator = Decimator(self.decimation) if self.decimation > 1 else None
+        # Input samples needed after the last sample of a group chunk before it can be analysed
+        self.delay = self.decimator.delay if self.decimator is not None else 0
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.chunks_analysed = 0
+
+    def get_state(self) -> dict:
+        return {
+            'chunk_processor': self.chunk_processor.get_state(),
+            'decimator': self.decimator.get_state() if self.decimator is not None else None,
+            'pending': self.pending.tolist(),
+            'chunks_analysed': self.chunks_analysed
+        }
+
+    def set_state(self, state: dict) -> None:
+        self.chunk_processor.set_state(state['chunk_processor'])
+        if self.decimator is not None:
+            self.decimator.set_state(state['decimator'])
+        self.pending = np.array(state['pending'], dtype=np.float32)
+        self.chunks_analysed = state['chunks_analysed']
+
+class MultiResolutionProcessor:
+    '''
+    Drop-in alternative to `ChunkProcessor` which analyses each group of fingerprints (see `plan_analysis_groups`) on its own decimated, band-limited copy of the stream, with its own `ChunkProcessor` and chunk length. Short beeps get shorter chunks and low tones longer ones, which can detect fingerprints that no single chunk length suits. Each group's chunkmaps are compiled for its own sample rate and chunk length.
+
+    It is not a way to analyse faster. Decimated groups do fewer FFT operations per second of audio, but the decimation filter and the extra processors cost more than that saves: `python -m beep_detect.bench.multi_resolution` analyses the bundled recordings more slowly than a single `ChunkProcessor`, and finds the same matches one input chunk later.
+
+    Input is passed in chunks of `chunk_length` samples at the full sample rate, as for `ChunkProcessor`. Group chunks are aligned with the input chunks: a group chunk of the same duration as an input chunk covers exactly the same input samples. A match is reported for the input chunk in which the last input sample needed by the group chunk that completed it arrived, so it can be reported up to one group chunk later than the input chunks would suggest, plus the delay of the decimation filter. In particular, a decimated group reports each match one input chunk after a `ChunkProcessor` would.
+
+    When any group is decimated the window defaults to `'hann'`, as results only agree with a `ChunkProcessor` with an analysis window. Without one, the leakage of strong components into the rest of the spectrum differs between a chunk at the full sample rate and the same chunk decimated, by several dB away from the tone. Clear tones are found either way, but peaks in noise, and so matches which depend on them, can differ. Pass `window='boxcar'` to analyse without a window anyway. With a window, a group whose chunks last as long as the input chunks finds the same peaks as a `ChunkProcessor`, apart from rare peaks in noise near the decimated Nyquist frequency.
+
+    Groups have different frequency bins, so there is no `spectrum_listener` for the processor as a whole. Set one on the `chunk_processor` of a group in `groups` to see that group's spectra.
+    '''
+
+    def __init__(
+            self,
+            fingerprints: dict[str, FingerprintInMs],
+            sample_rate: int,
+            chunk_length: int,
+            groups: list[AnalysisGroup] | None = None,
+            max_decimation: int = 8,
+            metrics: Metrics | None = None,
+            **chunk_processor_kwargs
+        ) -> None:
+        '''
+        Initialise a `MultiResolutionProcessor`
+
+        ## Args:
+
+        - fingerprints (dict): Mapping of fingerprint name to fingerprint definition
+        - sample_rate (int): Sample rate of the input stream
+        - chunk_length (int): Number of input samples per call to `analyse_chunk_for_match`
+        - groups (list[AnalysisGroup], default None): How to group the fingerprints. Planned with `plan_analysis_groups` if not provided.
+        - max_decimation (int, default 8): Largest decimation factor when planning groups
+        - metrics (Metrics, default None): Each group records its own metrics, labelled with the detector name of this instance and the group's decimation and chunk length
+        - chunk_processor_kwargs: Passed to the `ChunkProcessor` of every group. Groups do not overlap chunks, so `hop_length` is not accepted, and groups have different frequency bins, so neither is `spectrum_listener`. `window` defaults to `'hann'` when any group is decimated.
+        '''
+        if chunk_processor_kwargs.get('hop_length') not in (None, chunk_length):
+            raise ValueError('Analysis groups do not support overlapping chunks')
+        if chunk_processor_kwargs.get('spectrum_listener') is not None:
+            raise ValueError('Analysis groups have different frequency bins, so set a spectrum listener on the chunk processor of each group instead')
+        chunk_processor_kwargs.pop('hop_length', None)
+
+        self.fingerprints = fingerprints
+        self.sample_rate = sample_rate
+        self.chunk_length = chunk_length
+        self.hop_length = chunk_length
+        self.metrics = metrics
+        tolerance_f = chunk_processor_kwargs.get('tolerance_f', 0.03)
+        if groups is None:
+            groups = plan_analysis_groups(fingerprints, sample_rate, chunk_length, tolerance_f, max_decimation)
+
+        grouped_ids = [k for group in groups for k in group['fingerprint_ids']]
+        if sorted(grouped_ids) != sorted(fingerprints.keys()):
+            raise ValueError(f'Every fingerprint must be in exactly one group, but groups contain {sorted(grouped_ids)}')
+        for group in groups:
+            if sample_rate % group['decimation'] != 0:
+                raise ValueError(f'Decimation {group["decimation"]} does not divide the sample rate {sample_rate}Hz')
+
+        if chunk_processor_kwargs.get('window') is None and any(group['decimation'] > 1 for group in groups):
+            chunk_processor_kwargs['window'] = 'hann'
+
+        self.groups: list[_Group] = []
+        for group in groups:
+            group_metrics = None
+            if metrics is not None:
+                group_metrics = Metrics(f'{metrics.detector}/decimation-{group["decimation"]}-chunk-{group["chunk_length"]}')
+            chunk_processor = ChunkProcessor(
+                { k: fingerprints[k] for k in group['fingerprint_ids'] },
+                sample_rate // group['decimation'],
+                group['chunk_length'],
+                metrics=group_metrics,
+                **chunk_processor_kwargs
+            )
+            self.groups.append(_Group(group, chunk_processor))
+            log.info(f'Analysis group for {group["fingerprint_ids"]}: decimation {group["decimation"]} to {sample_rate // group["decimation"]}Hz, {group["chunk_length"]} samples per chunk ({1e3 * group["chunk_length"] * group["decimation"] / sample_rate:.1f}ms)')
+
+        self.analysis_lock = Lock()
+        self.chunks_analysed = 0
+
+    def analyse_chunk_for_match(self, chunk, with_lock=True) -> set[str]:
+        '''
+        Analyse one chunk of input, as `ChunkProcessor.analyse_chunk_for_match`
+        '''
+        return self.analyse_chunks_for_matches(np.asarray(chunk)[np.newaxis], with_lock)[0]
+
+    def analyse_chunks_for_matches(self, chunks: np.ndarray, with_lock=True) -> list[set[str]]:
+        '''
+        Analyse consecutive chunks of input, as `ChunkProcessor.analyse_chunks_for_matches`. Each group analyses all of its chunks completed by the input in one batch.
+        '''
+        if with_lock:
+            with self.analysis_lock:
+                return self._analyse_chunks_for_matches(chunks)
+
+        return self._analyse_chunks_for_matches(chunks)
+
+    def _analyse_chunks_for_matches(self, chunks: np.ndarray) -> list[set[str]]:
+        chunks = np.atleast_2d(chunks)
+        if chunks.shape[1] != self.chunk_length:
+            raise ValueError(f'Expected chunks of {self.chunk_length} samples but received {chunks.shape[1]}')
+        n_chunks = len(chunks)
+        matches: list[set[str]] = [set() for _ in range(n_chunks)]
+
+        for group in self.groups:
+            if group.decimator is not None:
+                start_time = timer()
+                samples = group.decimator.process(chunks.ravel())
+                if group.chunk_processor.metrics is not None:
+                    group.chunk_processor.metrics.observe_stage('decimate', timer() - start_time, n_chunks)
+            else:
+                samples = chunks.ravel()
+
+            # Frame whole group chunks, carrying over the remainder to the next call
+            group_chunk_length = group.chunk_processor.chunk_length
+            samples = np.concatenate([group.pending, samples])
+            n_group_chunks = len(samples) // group_chunk_length
+            group.pending = samples[n_group_chunks * group_chunk_length:]
+            if n_group_chunks == 0:
+                continue
+
+            group_chunks = samples[:n_group_chunks * group_chunk_length].reshape(n_group_chunks, group_chunk_length)
+            if n_group_chunks == 1:
+                results = [group.chunk_processor.analyse_chunk_for_match(group_chunks[0], with_lock=False)]
+            else:
+                results = group.chunk_processor.analyse_chunks_for_matches(group_chunks, with_lock=False)
+
+            # Input chunk in which the last input sample needed by each group chunk arrived
+            last_samples = (group.chunks_analysed + np.arange(1, n_group_chunks + 1)) * group_chunk_length - 1
+            i_chunks = (last_samples * group.decimation + group.delay) // self.chunk_length - self.chunks_analysed
+            for i_chunk, matched_ids in zip(i_chunks, results):
+                matches[i_chunk] |= matched_ids
+            group.chunks_analysed += n_group_chunks
+
+        self.chunks_analysed += n_chunks
+        return matches
+
+    def get_match_state(self) -> dict[str, dict[str, int]]:
+        return { k: state for group in self.groups for k, state in group.chunk_processor.get_match_state().items() }
+
+    def set_match_state(self, match_state: dict[str, dict[str, int]]) -> None:
+        for group in self.groups:
+            group.chunk_processor.set_match_state({ k: match_state[k] for k in group.fingerprint_ids })
+
+    def get_state(self) -> dict:
+        '''
+        Snapshot of everything carried over from one input chunk to the next, as `ChunkProcessor.get_state`: the state of every group's `ChunkProcessor` and decimation filter, and the decimated samples not yet making up a whole group chunk. It only holds plain lists and numbers, so it can be stored as JSON.
+        '''
+        return {
+            'chunks_analysed': self.chunks_analysed,
+            'groups': [group.get_state() for group in self.groups]
+        }
+
+    def set_state(self, state: dict) -> None:
+        '''
+        Restore a snapshot obtained from `get_state` on a processor with the same groups and settings
+        '''
+        if len(state['groups']) != len(self.groups):
+            raise ValueError(f'Snapshot has {len(state["groups"])} analysis groups but this processor has {len(self.groups)}')
+        for group, group_state in zip(self.groups, state['groups']):
+            group.set_state(group_state)
+        self.chunks_analysed = state['chunks_analysed']
+
+    def match_span_chunks(self) -> int:
+        '''
+        Upper bound on the number of input chunks spanned by a complete match of any fingerprint
+        '''
+        return max([
+            ceil(group.chunk_processor.match_span_chunks() * group.chunk_processor.chunk_length * group.decimation / self.chunk_length)
+            for group in self.groups
+        ], default=0)
@@ -0,0 +1,251 @@
+import numpy as np
+import logging as log
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+from typing import Callable
+
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.fingerprint_plan import get_plan
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.types import FingerprintInMs
+from beep_detect.core.wav_source import WavSource
+
+class _Source():
+    def __init__(self, source_id: str, chunk_processor: ChunkProcessor, max_pending_chunks: int, drain_listener: Callable[[], None] | None) -> None:
+        self.source_id = source_id
+        self.chunk_processor = chunk_processor
+        self.max_pending_chunks = max_pending_chunks
+        self.drain_listener = drain_listener
+        self.pending: deque[np.ndarray] = deque()
+        self.scheduled = False
+        self.removed = False
+        self.condition = threading.Condition()
+        self.chunks_processed = 0
+        self.dropped_chunks = 0
+
+class MultiSourceRunner():
+    '''
+    Runs fingerprint detection for many independent audio streams in one process. Each source has its own match state, while sources with the same sample rate and chunk length share one `FingerprintPlan`. Analysis for all sources is scheduled on a bounded thread pool, with at most one task per source in flight so that each source's chunks are analysed in order.
+    '''
+
+    def __init__(
+            self,
+            fingerprints: dict[str, FingerprintInMs],
+            match_callback: Callable[[str, str], None],
+            max_workers: int | None = None,
+            max_pending_chunks: int = 64,
+            metrics: Metrics | None = None,
+            **chunk_processor_kwargs
+        ) -> None:
+        '''
+        Initialise a `MultiSourceRunner`
+
+        ## Args:
+
+        - fingerprints (dict): Mapping of fingerprint name to fingerprint definition, shared by all sources
+        - match_callback (Callable): Called with the source ID and fingerprint ID of each match, from a worker thread
+        - max_workers (int, default None): Size of the analysis thread pool. Defaults to the `ThreadPoolExecutor` default.
+        - max_pending_chunks (int, default 64): Number of chunks which may be queued for each source before the oldest are dropped
+        - metrics (Metrics, default None): If given, each source records its own `Metrics`, labelled with this detector name and the source ID
+        - chunk_processor_kwargs: Passed to each `ChunkProcessor`. Defaults to the compiled matcher.
+        '''
+        self.fingerprints = fingerprints
+        self.match_callback = match_callback
+        self.max_pending_chunks = max_pending_chunks
+        self.metrics = metrics
+        self.chunk_processor_kwargs = { 'matcher': 'compiled', **chunk_processor_kwargs }
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='multi-source')
+        self.sources: dict[str, _Source] = {}
+        self.closed = False
+
+    def add_source(self, source_id: str, sample_rate: int, chunk_length: int, drain_listener: Callable[[], None] | None = None) -> None:
+        '''
+        Register a source. Chunks pushed for this source must contain exactly `chunk_length` samples, or `hop_length` samples if a hop was passed to the runner.
+
+        `drain_listener` is called from a worker thread each time the source's queued chunks are taken for analysis, so that a producer which stopped when `space` ran out can push again. It must not block.
+        '''
+        if self.closed:
+            raise ValueError('Runner is closed')
+        if source_id in self.sources:
+            raise ValueError(f'Source "{source_id}" already exists')
+
+        # Processors with the same sample rate and chunk length share one plan from the plan cache
+        metrics = Metrics(f'{self.metrics.detector}/{source_id}') if self.metrics is not None else None
+        chunk_processor = ChunkProcessor(self.fingerprints, sample_rate, chunk_length, metrics=metrics, **self.chunk_processor_kwargs)
+        self.sources[source_id] = _Source(source_id, chunk_processor, self.max_pending_chunks, drain_listener)
+
+    def remove_source(self, source_id: str) -> None:
+        '''
+        Forget a source and discard its queued chunks. Matches from chunks already being analysed may still be reported.
+        '''
+        source = self.sources.pop(source_id)
+        with source.condition:
+            source.pending.clear()
+            source.removed = True
+            source.condition.notify_all()
+
+    def push(self, source_id: str, chunks: np.ndarray, block: bool = False, timeout_s: float | None = None) -> None:
+        '''
+        Queue one chunk, or a 2-D block of consecutive chunks, for analysis
+
+        ## Args:
+
+        - source_id (str): Source the chunks came from
+        - chunks (np.ndarray): A chunk of samples, or a 2-D array with one chunk per row
+        - block (bool, default False): If the source's queue is full, wait for space rather than dropping the oldest queued chunks, so no chunks are ever dropped. Use this for sources such as files which can be paused. Blocks longer than `max_pending_chunks` are queued a part at a time.
+        - timeout_s (float, default None): With `block`, raise `TimeoutError` if there is still no space after this long. Chunks queued before the timeout stay queued, and the rest are not.
+
+        Raises `ValueError` if the runner is closed, or if the source is removed, or the runner closed, while waiting.
+        '''
+        source = self.sources[source_id]
+        chunks = np.atleast_2d(chunks)
+
+        if not block:
+            with source.condition:
+                # Checked with the lock held, as `close` marks sources removed before shutting down the executor
+                if source.removed:
+                    raise self._removed_error(source_id)
+                source.pending.extend(chunks)
+                while len(source.pending) > source.max_pending_chunks:
+                    source.pending.popleft()
+                    source.dropped_chunks += 1
+                    if source.chunk_processor.metrics is not None:
+                        source.chunk_processor.metrics.dropped_chunks += 1
+                self._schedule(source)
+            return
+
+        deadline = None if timeout_s is None else timer() + timeout_s
+        while len(chunks) > 0:
+            with source.condition:
+                has_space = source.condition.wait_for(
+                    lambda: source.removed or len(source.pending) < source.max_pending_chunks,
+                    None if deadline is None else max(deadline - timer(), 0)
+                )
+                if source.removed:
+                    raise self._removed_error(source_id)
+                if not has_space:
+                    raise TimeoutError(f'No space to queue chunks for source "{source_id}" after {timeout_s}s')
+                n_chunks = source.max_pending_chunks - len(source.pending)
+                source.pending.extend(chunks[:n_chunks])
+                chunks = chunks[n_chunks:]
+                self._schedule(source)
+
+    def space(self, source_id: str) -> int:
+        '''
+        Number of chunks which can be pushed for a source without dropping any
+        '''
+        source = self.sources[source_id]
+        with source.condition:
+            return max(source.max_pending_chunks - len(source.pending), 0)
+
+    def wait_until_idle(self) -> None:
+        '''
+        Wait until every queued chunk of every source has been analysed
+        '''
+        for source in self.sources.values():
+            with source.condition:
+                source.condition.wait_for(lambda: not source.scheduled)
+
+    def run_wav_files(self, file_names: dict[str, str], chunk_length: int = 2048, block_chunks: int = 16) -> None:
+        '''
+        Add one source per .wav file and stream every file through the runner as fast as possible, interleaving blocks from each file
+
+        ## Args:
+
+        - file_names (dict): Mapping of source ID to .wav file
+        - chunk_length (int, default 2048): Number of samples per chunk
+        - block_chunks (int, default 16): Number of chunks read from each file at a time
+        '''
+        wav_sources = { source_id: WavSource(file_name) for source_id, file_name in file_names.items() }
+        for source_id, wav_source in wav_sources.items():
+            self.add_source(source_id, wav_source.sample_rate, chunk_length)
+
+        hop_length = self.chunk_processor_kwargs.get('hop_length') or chunk_length
+        iterators = { source_id: wav_source.iter_blocks(hop_length, block_chunks=block_chunks) for source_id, wav_source in wav_sources.items() }
+        while len(iterators) > 0:
+            for source_id, iterator in list(iterators.items()):
+                block = next(iterator, None)
+                if block is None:
+                    del iterators[source_id]
+                    wav_sources[source_id].close()
+                else:
+                    self.push(source_id, block[1], block=True)
+
+        self.wait_until_idle()
+
+    @property
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            source_id: {
+                'chunks_processed': source.chunks_processed,
+                'dropped_chunks': source.dropped_chunks,
+                'queue_depth': len(source.pending)
+            } for source_id, source in list(self.sources.items())
+        }
+
+    def close(self) -> None:
+        '''
+        Wait for analysis of queued chunks to finish. Any `push` still waiting for space, and any later `push`, raises `ValueError`.
+        '''
+        self.closed = True
+        for source in list(self.sources.values()):
+            with source.condition:
+                source.removed = True
+                source.condition.notify_all()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _removed_error(self, source_id: str) -> ValueError:
+        if self.closed:
+            return ValueError(f'Cannot queue chunks for source "{source_id}": runner is closed')
+        return ValueError(f'Source "{source_id}" was removed while waiting to queue chunks')
+
+    def _schedule(self, source: _Source) -> None:
+        # Called with the source's lock held. At most one task per source is in flight, so chunks are analysed in order.
+        if not source.scheduled:
+            source.scheduled = True
+            self.executor.submit(self._drain, source)
+
+    def _drain(self, source: _Source) -> None:
+        try:
+            while True:
+                with source.condition:
+                    if len(source.pending) == 0:
+                        source.scheduled = False
+                        source.condition.notify_all()
+                        return
+                    chunks = np.stack(source.pending)
+                    source.pending.clear()
+                    source.condition.notify_all()
+                if source.drain_listener is not None:
+                    source.drain_listener()
+
+                # Only this task touches the source's processor, so no lock is needed
+                results = source.chunk_processor.analyse_chunks_for_matches(chunks, with_lock=False)
+                source.chunks_processed += len(chunks)
+
+                for matched_ids in results:
+                    for id in matched_ids:
+                        self._dispatch_match(source, id)
+        except Exception:
+            log.exception(f'Analysis failed for source "{source.source_id}"')
+            with source.condition:
+                source.pending.clear()
+                source.scheduled = False
+                source.condition.notify_all()
+
+    def _dispatch_match(self, source: _Source, id: str) -> None:
+        start_time = timer()
+        try:
+            self.match_callback(source.source_id, id)
+        except Exception:
+            log.exception(f'Match callback failed for {id} from source "{source.source_id}"')
+        if source.chunk_processor.metrics is not None:
+            source.chunk_processor.metrics.observe_stage('callback', timer() - start_time)
@@ -0,0 +1,31 @@
+import numpy as np
+
+class Rechunker:
+    '''
+    Splits a stream of raw PCM byte strings of arbitrary length into whole chunks. Samples and chunks may be split across messages; the remainder is carried over to the next message. Whole chunks are decoded with `np.frombuffer`, so no samples are copied unless a message completes a chunk started by an earlier one.
+    '''
+
+    def __init__(self, chunk_length: int, dtype: np.dtype | str) -> None:
+        self.chunk_length = chunk_length
+        self.dtype = np.dtype(dtype)
+        self.chunk_bytes = chunk_length * self.dtype.itemsize
+        self._remainder = b''
+
+    def feed(self, data: bytes) -> np.ndarray:
+        '''
+        Add raw samples to the stream
+
+        ## Returns:
+
+        - (np.ndarray): 2-D array of shape `(n_chunks, chunk_length)` with the chunks completed by this data, which may be empty. It is a read-only view of `data` where possible.
+        '''
+        if len(self._remainder) > 0:
+            data = self._remainder + data
+        n_chunks = len(data) // self.chunk_bytes
+        self._remainder = bytes(data[n_chunks * self.chunk_bytes:])
+
+        return np.frombuffer(data, dtype=self.dtype, count=n_chunks * self.chunk_length).reshape(n_chunks, self.chunk_length)
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._remainder)
@@ -0,0 +1,416 @@
+'''
+Record the audio analysed by a live `CapturePipeline` to an on-disk ring buffer, and replay any window of it through a `ChunkProcessor` as fast as possible, either with the live settings to reproduce its decisions exactly or with different fingerprints and thresholds.
+
+Usage:
+
+```shell
+python -m beep_detect.web -f beep_detect/core/fingerprints.toml --record recording/
+python -m beep_detect.core.recorder recording/ --start-s 120 --end-s 180
+python -m beep_detect.core.recorder recording/ -f other_fingerprints.json --peak-prominence 6
+```
+'''
+import argparse
+import json
+import logging as log
+import os
+import sys
+import time
+from datetime import datetime
+from math import ceil
+from timeit import default_timer as timer
+from typing import Iterator, TypedDict
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.fingerprint_config import load_fingerprints
+from beep_detect.core.types import FingerprintInMs
+from beep_detect.core.wav_source import SAMPLE_DTYPE
+
+RECORDING_VERSION = 1
+
+# Settings of the live `ChunkProcessor` which are stored with a recording. Replaying with all of them unchanged
+# reproduces the live decisions exactly.
+PROCESSOR_SETTINGS = ('chunk_length', 'peak_prominence', 'peak_distance', 'tolerance_f', 'tolerance_t_ms', 'matcher', 'spectrum_backend', 'window')
+
+class SegmentInfo(TypedDict):
+    index: int
+    first_sequence: int
+    capture_time: float
+    wall_time: float
+    state: dict
+    n_chunks: int
+    matches: list[tuple[int, str]]
+
+class ReplayEvent(TypedDict):
+    fingerprint_id: str
+    t: float
+    wall_time: float
+
+class ReplayResult(TypedDict):
+    events: list[ReplayEvent]
+    live_events: list[ReplayEvent]
+    exact: bool
+    audio_duration_s: float
+    processing_duration_s: float
+    throughput: float
+
+class ChunkRecorder:
+    '''
+    Fixed-size ring buffer of analysed chunks on disk. The ring is split into segments, and the samples, capture times and sequence numbers of each chunk are written to memory-mapped arrays, so recording a batch is one copy into the page cache. Every segment has a small JSON file holding a snapshot of the processor state before its first chunk (see `ChunkProcessor.get_state`) and the matches found in it.
+
+    Disk writes are bounded: the arrays are fixed in size when the recorder is created, pages are flushed only when recording moves on to the next segment, overwriting the oldest one, and the segment's JSON is otherwise only rewritten when a match is found. Matches are written as they are found, before their chunks are marked as analysed, so a reader of a recording still being written sees every live match of the chunks it can replay.
+
+    Chunks must be recorded just before they are analysed, and a batch must not straddle two segments (see `chunks_left_in_segment`), so that each snapshot is the state in which the live processor started on that segment. `CapturePipeline` takes care of this when passed a recorder.
+    '''
+
+    def __init__(self, directory: str, chunk_processor: ChunkProcessor, duration_s: float = 600, segment_s: float = 30) -> None:
+        '''
+        Create a recording in `directory`, overwriting any previous recording there
+
+        ## Args:
+
+        - directory (str): Directory to hold the recording. It is created if it does not exist.
+        - chunk_processor (ChunkProcessor): Processor which will analyse the recorded chunks. Its settings are stored so the recording can be replayed with them.
+        - duration_s (float, default 600): Seconds of audio which are always retained. One extra segment is allocated so that a full `duration_s` remains while the oldest segment is being overwritten.
+        - segment_s (float, default 30): Seconds of audio per segment. Replay can start from any segment boundary, and at most this much audio is waiting to be flushed.
+        '''
+        if duration_s <= 0 or segment_s <= 0:
+            raise ValueError(f'Recording duration {duration_s}s and segment duration {segment_s}s must be positive')
+
+        self.directory = directory
+        self.hop_length = chunk_processor.hop_length
+        self.segment_chunks = max(ceil(segment_s * chunk_processor.sample_rate / self.hop_length), 1)
+        self.n_segments = max(ceil(duration_s / segment_s), 1) + 1
+        capacity = self.n_segments * self.segment_chunks
+
+        os.makedirs(directory, exist_ok=True)
+        for file_name in os.listdir(directory):
+            if file_name.startswith('segment_') and file_name.endswith('.json'):
+                os.remove(os.path.join(directory, file_name))
+
+        _write_json(os.path.join(directory, 'recording.json'), {
+            'version': RECORDING_VERSION,
+            'sample_rate': chunk_processor.sample_rate,
+            'hop_length': self.hop_length,
+            'segment_chunks': self.segment_chunks,
+            'n_segments': self.n_segments,
+            'fingerprints': chunk_processor.fingerprints,
+            'processor': { k: getattr(chunk_processor, k) for k in PROCESSOR_SETTINGS }
+        })
+
+        self.chunks = open_memmap(os.path.join(directory, 'chunks.npy'), mode='w+', dtype=SAMPLE_DTYPE, shape=(capacity, self.hop_length))
+        self.capture_times = open_memmap(os.path.join(directory, 'capture_times.npy'), mode='w+', dtype=np.float64, shape=(capacity,))
+        self.batch_starts = open_memmap(os.path.join(directory, 'batch_starts.npy'), mode='w+', dtype=bool, shape=(capacity,))
+        self.sequences = open_memmap(os.path.join(directory, 'sequences.npy'), mode='w+', dtype=np.int64, shape=(capacity,))
+        self.sequences[:] = -1
+
+        self.segment: SegmentInfo | None = None
+        self.position = 0
+        self.next_sequence = 0
+
+    @property
+    def chunks_left_in_segment(self) -> int:
+        '''
+        Largest batch which can be recorded next. A full segment means a new one is started by the next call to `record`.
+        '''
+        if self.segment is None or self.position == self.segment_chunks:
+            return self.segment_chunks
+        return self.segment_chunks - self.position
+
+    def record(self, chunks: np.ndarray, capture_times: np.ndarray, chunk_processor: ChunkProcessor) -> int:
+        '''
+        Record a batch of chunks which is about to be analysed by `chunk_processor`
+
+        ## Args:
+
+        - chunks (np.ndarray): 2-D array of shape `(n_chunks, hop_length)` with at most `chunks_left_in_segment` rows
+        - capture_times (np.ndarray): `time.monotonic()` at which each chunk was captured
+        - chunk_processor (ChunkProcessor): Processor which will analyse the batch. Its state is snapshotted when a segment starts.
+
+        ## Returns:
+
+        - (int): Sequence number of the first chunk, to pass to `record_matches`
+        '''
+        n_chunks = len(chunks)
+        if n_chunks > self.chunks_left_in_segment:
+            raise ValueError(f'Batch of {n_chunks} chunks does not fit in the {self.chunks_left_in_segment} chunks left in the segment')
+        if self.segment is None or self.position == self.segment_chunks:
+            self._start_segment(float(capture_times[0]), chunk_processor.get_state())
+
+        slot = self.segment['index'] * self.segment_chunks + self.position # type: ignore
+        first_sequence = self.next_sequence
+        self.chunks[slot:slot + n_chunks] = chunks
+        self.capture_times[slot:slot + n_chunks] = capture_times[:n_chunks]
+        self.batch_starts[slot:slot + n_chunks] = False
+        self.batch_starts[slot] = True
+        # Sequence numbers mark chunks as valid, which waits until they are analysed (see `record_matches`)
+        self.sequences[slot:slot + n_chunks] = -1
+
+        self.position += n_chunks
+        self.next_sequence += n_chunks
+        return first_sequence
+
+    def record_matches(self, first_sequence: int, results: list[set[str]]) -> None:
+        '''
+        Record the matches found in the batch last passed to `record`, as returned by the processor, for comparison on replay. The chunks of the batch become part of the recording only now.
+        '''
+        segment: SegmentInfo = self.segment # type: ignore
+        matches = [(first_sequence + i_chunk, id) for i_chunk, matched_ids in enumerate(results) for id in sorted(matched_ids)]
+        if len(matches) > 0:
+            segment['matches'].extend(matches)
+            _write_json(self._segment_file_name(segment['index']), segment)
+
+        slot = segment['index'] * self.segment_chunks + first_sequence - segment['first_sequence']
+        self.sequences[slot:slot + len(results)] = np.arange(first_sequence, first_sequence + len(results))
+
+    def close(self) -> None:
+        if self.segment is not None:
+            self._finish_segment()
+            self.segment = None
+        self.chunks = self.capture_times = self.batch_starts = self.sequences = None # type: ignore
+
+    def _start_segment(self, capture_time: float, state: dict) -> None:
+        index = 0
+        if self.segment is not None:
+            self._finish_segment()
+            index = (self.segment['index'] + 1) % self.n_segments
+
+        self.segment = {
+            'index': index,
+            'first_sequence': self.next_sequence,
+            'capture_time': capture_time,
+            'wall_time': time.time() - (time.monotonic() - capture_time),
+            'state': state,
+            'n_chunks': 0,
+            'matches': []
+        }
+        self.position = 0
+        _write_json(self._segment_file_name(index), self.segment)
+        log.debug(f'Recording segment {index} from chunk {self.next_sequence}')
+
+    def _finish_segment(self) -> None:
+        for array in (self.chunks, self.capture_times, self.batch_starts, self.sequences):
+            array.flush()
+        self.segment['n_chunks'] = self.position # type: ignore
+        _write_json(self._segment_file_name(self.segment['index']), self.segment) # type: ignore
+
+    def _segment_file_name(self, index: int) -> str:
+        return os.path.join(self.directory, f'segment_{index:04d}.json')
+
+class Recording:
+    '''
+    Read-only view of a recording made by `ChunkRecorder`, which may still be being written. It holds the chunks which had been analysed when it was opened, and every live match found in them. Times are in seconds from the first retained chunk.
+    '''
+
+    def __init__(self, directory: str) -> None:
+        with open(os.path.join(directory, 'recording.json'), 'r') as f:
+            info = json.load(f)
+        if info['version'] != RECORDING_VERSION:
+            raise ValueError(f'Recording version {info["version"]} is not supported')
+
+        self.sample_rate: int = info['sample_rate']
+        self.hop_length: int = info['hop_length']
+        self.segment_chunks: int = info['segment_chunks']
+        self.fingerprints: dict[str, FingerprintInMs] = info['fingerprints']
+        self.processor_settings: dict = info['processor']
+
+        self.chunks = np.load(os.path.join(directory, 'chunks.npy'), mmap_mode='r')
+        self.capture_times = np.load(os.path.join(directory, 'capture_times.npy'), mmap_mode='r')
+        self.batch_starts = np.load(os.path.join(directory, 'batch_starts.npy'), mmap_mode='r')
+        # Copied before any segment is read: the recorder writes a segment's matches before marking their chunks as
+        # analysed, so every chunk seen as analysed here has its matches in the segment read below
+        sequences = np.array(np.load(os.path.join(directory, 'sequences.npy'), mmap_mode='r'))
+
+        # A segment's chunks are those carrying the sequence numbers it expects, which leaves out chunks from the
+        # previous lap of the ring that have not been overwritten yet, and chunks not analysed yet
+        self.segments: list[SegmentInfo] = []
+        for index in range(info['n_segments']):
+            file_name = os.path.join(directory, f'segment_{index:04d}.json')
+            if not os.path.exists(file_name):
+                continue
+            with open(file_name, 'r') as f:
+                segment: SegmentInfo = json.load(f)
+
+            slots = slice(index * self.segment_chunks, (index + 1) * self.segment_chunks)
+            valid = sequences[slots] == segment['first_sequence'] + np.arange(self.segment_chunks)
+            segment['n_chunks'] = int(np.argmin(valid)) if not valid.all() else self.segment_chunks
+            segment['matches'] = [(sequence, id) for sequence, id in segment['matches'] if sequence < segment['first_sequence'] + segment['n_chunks']]
+            if segment['n_chunks'] > 0:
+                self.segments.append(segment)
+        self.segments.sort(key=lambda segment: segment['first_sequence'])
+
+        self.start_time = self.segments[0]['capture_time'] if len(self.segments) > 0 else 0.
+
+    @property
+    def n_chunks(self) -> int:
+        return sum(segment['n_chunks'] for segment in self.segments)
+
+    @property
+    def duration_s(self) -> float:
+        return self.n_chunks * self.hop_length / self.sample_rate
+
+    def segment_arrays(self, segment: SegmentInfo) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Views of the chunks, capture times and batch starts of a segment
+        '''
+        slots = slice(segment['index'] * self.segment_chunks, segment['index'] * self.segment_chunks + segment['n_chunks'])
+        return self.chunks[slots], self.capture_times[slots], self.batch_starts[slots]
+
+    def event(self, segment: SegmentInfo, fingerprint_id: str, capture_time: float) -> ReplayEvent:
+        return {
+            'fingerprint_id': fingerprint_id,
+            't': capture_time - self.start_time,
+            'wall_time': segment['wall_time'] + capture_time - segment['capture_time']
+        }
+
+def replay_recording(
+        recording: Recording,
+        start_s: float = 0,
+        end_s: float | None = None,
+        fingerprints: dict[str, FingerprintInMs] | None = None,
+        **processor_settings
+    ) -> ReplayResult:
+    '''
+    Feed a window of a recording back through a new `ChunkProcessor`, as fast as possible
+
+    With the recorded fingerprints and settings, replay starts from the state snapshot of the segment containing `start_s` and feeds chunks in the same batches as they were analysed live, so it finds exactly the live matches. Otherwise the processor starts from a fresh state and is first warmed up on the audio preceding the window, for as long as the longest possible match, and whole segments are analysed in one batch.
+
+    ## Args:
+
+    - recording (Recording): Recording to replay
+    - start_s (float, default 0): Start of the window, in seconds from the first retained chunk
+    - end_s (float, default None): End of the window. Defaults to the end of the recording.
+    - fingerprints (dict, default None): Fingerprints to match. Defaults to the recorded fingerprints.
+    - processor_settings: Any of `PROCESSOR_SETTINGS` to change from the recorded values
+
+    ## Returns:
+
+    - (ReplayResult): Matches found by the replay and by the live processor within the window, whether the replay was exact, and timing
+    '''
+    unknown_settings = set(processor_settings) - set(PROCESSOR_SETTINGS)
+    if len(unknown_settings) > 0:
+        raise ValueError(f'Unrecognised processor settings {sorted(unknown_settings)}')
+    if fingerprints is None:
+        fingerprints = recording.fingerprints
+    settings = { **recording.processor_settings, **processor_settings }
+    exact = fingerprints == recording.fingerprints and settings == recording.processor_settings
+    if end_s is None:
+        end_s = float('inf')
+
+    chunk_length = settings.pop('chunk_length')
+    processor = ChunkProcessor(fingerprints, recording.sample_rate, chunk_length, hop_length=recording.hop_length, **settings)
+
+    # Segments overlapping the window, plus those needed to warm up a fresh state
+    in_window = [
+        i for i, segment in enumerate(recording.segments)
+        if recording.segment_arrays(segment)[1][-1] - recording.start_time >= start_s and segment['capture_time'] - recording.start_time <= end_s
+    ]
+    if len(in_window) == 0:
+        return { 'events': [], 'live_events': [], 'exact': exact, 'audio_duration_s': 0., 'processing_duration_s': 0., 'throughput': 0. }
+    i_first = in_window[0]
+    if not exact:
+        warmup_chunks = processor.match_span_chunks()
+        while i_first > 0 and warmup_chunks > 0:
+            i_first -= 1
+            warmup_chunks -= recording.segments[i_first]['n_chunks']
+
+    events: list[ReplayEvent] = []
+    live_events: list[ReplayEvent] = []
+    n_chunks = 0
+    next_sequence = None
+    start_time = timer()
+    for segment in recording.segments[i_first:in_window[-1] + 1]:
+        # Live state carries over between consecutive segments, so it is only restored where the replay starts or
+        # where segments are missing
+        if exact and segment['first_sequence'] != next_sequence:
+            processor.set_state(segment['state'])
+        next_sequence = segment['first_sequence'] + segment['n_chunks']
+
+        chunks, capture_times, batch_starts = recording.segment_arrays(segment)
+        for batch_start, batch_end, results in _analyse_segment(processor, chunks, batch_starts if exact else None):
+            for i_chunk, matched_ids in zip(range(batch_start, batch_end), results):
+                for id in sorted(matched_ids):
+                    events.append(recording.event(segment, id, float(capture_times[i_chunk])))
+        for sequence, id in segment['matches']:
+            live_events.append(recording.event(segment, id, float(capture_times[sequence - segment['first_sequence']])))
+        n_chunks += len(chunks)
+    processing_duration_s = timer() - start_time
+
+    in_range = lambda event: start_s <= event['t'] <= end_s
+    audio_duration_s = n_chunks * recording.hop_length / recording.sample_rate
+    return {
+        'events': list(filter(in_range, events)),
+        'live_events': list(filter(in_range, live_events)),
+        'exact': exact,
+        'audio_duration_s': audio_duration_s,
+        'processing_duration_s': processing_duration_s,
+        'throughput': audio_duration_s / processing_duration_s if processing_duration_s > 0 else float('inf')
+    }
+
+def _analyse_segment(processor: ChunkProcessor, chunks: np.ndarray, batch_starts: np.ndarray | None) -> Iterator[tuple[int, int, list[set[str]]]]:
+    # Reproduce the live batches if given, single chunks included, since the per-chunk and batched paths may round
+    # differently
+    if batch_starts is None:
+        yield 0, len(chunks), processor.analyse_chunks_for_matches(chunks)
+        return
+
+    boundaries = np.append(np.flatnonzero(batch_starts), len(chunks))
+    for batch_start, batch_end in zip(boundaries[:-1], boundaries[1:]):
+        if batch_end - batch_start == 1:
+            yield batch_start, batch_end, [processor.analyse_chunk_for_match(chunks[batch_start])]
+        else:
+            yield batch_start, batch_end, processor.analyse_chunks_for_matches(chunks[batch_start:batch_end])
+
+def _write_json(file_name: str, value) -> None:
+    # Replace the file in one step so that a reader never sees it half written
+    with open(file_name + '.tmp', 'w') as f:
+        json.dump(value, f)
+    os.replace(file_name + '.tmp', file_name)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Replay a window of a recording made by the live detector')
+    parser.add_argument('directory', help='Recording directory')
+    parser.add_argument('--start-s', type=float, default=0, help='Start of the window, in seconds from the first retained chunk')
+    parser.add_argument('--end-s', type=float, default=None, help='End of the window (default end of the recording)')
+    parser.add_argument('-f', '--fingerprints', default=None, help='JSON or TOML file of fingerprints (default those recorded)')
+    parser.add_argument('-o', '--output', default='-', help='File to write JSONL match events to (default stdout)')
+    parser.add_argument('--matcher', choices=['dict', 'compiled'], default=None)
+    parser.add_argument('--spectrum-backend', choices=['fft', 'targeted'], default=None)
+    parser.add_argument('--peak-prominence', type=float, default=None)
+    parser.add_argument('--peak-distance', type=float, default=None)
+    parser.add_argument('--tolerance-f', type=float, default=None)
+    parser.add_argument('--tolerance-t-ms', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    log.basicConfig(level=log.INFO, stream=sys.stderr)
+
+    recording = Recording(args.directory)
+    fingerprints = load_fingerprints(args.fingerprints) if args.fingerprints is not None else None
+    overrides = { k: getattr(args, k) for k in PROCESSOR_SETTINGS if getattr(args, k, None) is not None }
+    log.info(f'Recording holds {recording.duration_s:.1f}s of audio in {len(recording.segments)} segments')
+
+    result = replay_recording(recording, args.start_s, args.end_s, fingerprints, **overrides)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for event in result['events']:
+            output.write(json.dumps({ **event, 'time': datetime.fromtimestamp(event['wall_time']).isoformat() }) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    log.info(f'{result["audio_duration_s"]:.1f}s of audio replayed in {result["processing_duration_s"]:.3f}s ({result["throughput"]:.1f} audio-seconds per second)')
+    summary = lambda events: [(e['fingerprint_id'], round(e['t'], 3)) for e in events]
+    if result['exact']:
+        agree = summary(result['events']) == summary(result['live_events'])
+        log.info(f'Replayed with the live settings: {"same matches as" if agree else "DIFFERENT matches to"} the live detector')
+        if not agree:
+            log.warning(f'Replay {summary(result["events"])}, live {summary(result["live_events"])}')
+            sys.exit(1)
+    else:
+        log.info(f'Live detector matched {summary(result["live_events"])}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+'''
+Scan recordings for fingerprint matches in parallel, writing one JSON match event per line.
+
+Usage:
+
+```shell
+python -m beep_detect.core.scan -f beep_detect/core/fingerprints.toml data/ -o events.jsonl
+```
+'''
+import argparse
+import json
+import logging as log
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, Future
+from timeit import default_timer as timer
+from typing import TypedDict
+
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.fingerprint_config import load_fingerprints
+from beep_detect.core.time_conversion import chunks_to_s
+from beep_detect.core.types import FingerprintInMs, MatchEvent
+from beep_detect.core.wav_source import WavSource
+
+class SegmentJob(TypedDict):
+    file_name: str
+    i_chunk_start: int
+    i_chunk_end: int
+    initial_match_state: dict | None
+
+class SegmentResult(TypedDict):
+    events: list[MatchEvent]
+    start_match_state: dict
+    end_match_state: dict
+    audio_duration_s: float
+    processing_duration_s: float
+
+def scan_segment(fingerprints: dict[str, FingerprintInMs], job: SegmentJob, chunk_length: int, matcher: str, spectrum_backend: str = 'fft', batch: bool = True) -> SegmentResult:
+  '''
+  Scan one segment of a file in a worker process. Each worker builds its own `ChunkProcessor`.
+
+  If no initial match state is handed over, the processor is first warmed up on the audio preceding the segment, for as long as the longest possible match. Matches completed during warm-up are discarded. Matches are not logged here, as a segment may be rescanned: `scan_files` logs them once they are final.
+  '''
+  start_time = timer()
+  runner = FileInputRunner(fingerprints, job['file_name'], chunk_length, matcher=matcher, spectrum_backend=spectrum_backend)
+  processor = runner.chunk_processor
+
+  if job['initial_match_state'] is not None:
+    processor.set_match_state(job['initial_match_state'])
+  elif job['i_chunk_start'] > 0:
+    i_warmup_start = max(job['i_chunk_start'] - processor.match_span_chunks(), 0)
+    for _ in runner.iter_matches_in_chunks(i_warmup_start, job['i_chunk_start'], batch, log_matches=False):
+      pass
+
+  start_match_state = processor.get_match_state()
+  events = list(runner.iter_matches_in_chunks(job['i_chunk_start'], job['i_chunk_end'], batch, log_matches=False))
+  runner.source.close()
+
+  return {
+    'events': events,
+    'start_match_state': start_match_state,
+    'end_match_state': processor.get_match_state(),
+    'audio_duration_s': chunks_to_s(job['i_chunk_end'] - job['i_chunk_start'], runner.input_sample_rate, chunk_length),
+    'processing_duration_s': timer() - start_time
+  }
+
+def find_wav_files(paths: list[str]) -> list[str]:
+  '''
+  Expand a list of files and directories into the .wav files they contain
+  '''
+  file_names = []
+  for path in paths:
+    if os.path.isdir(path):
+      for root, _, files in os.walk(path):
+        file_names.extend(sorted(os.path.join(root, f) for f in files if f.lower().endswith('.wav')))
+    else:
+      file_names.append(path)
+
+  return file_names
+
+def split_into_segments(file_name: str, chunk_length: int, segment_s: float) -> list[SegmentJob]:
+  with WavSource(file_name) as source:
+    n_chunks = source.n_chunks(chunk_length)
+    chunks_per_segment = max(int(segment_s * source.sample_rate) // chunk_length, 1)
+
+  return [
+    {
+      'file_name': file_name,
+      'i_chunk_start': i_chunk_start,
+      'i_chunk_end': min(i_chunk_start + chunks_per_segment, n_chunks),
+      'initial_match_state': None
+    } for i_chunk_start in range(0, max(n_chunks, 1), chunks_per_segment)
+  ]
+
+def scan_files(
+    fingerprints: dict[str, FingerprintInMs],
+    file_names: list[str],
+    output,
+    workers: int | None = None,
+    chunk_length: int = 2048,
+    segment_s: float = 600,
+    matcher: str = 'compiled',
+    spectrum_backend: str = 'fft',
+    batch: bool = True
+  ) -> dict[str, dict[str, float]]:
+  '''
+  Scan files for matches on a process pool, splitting long files into segments which are scanned in parallel
+
+  Segments are scanned speculatively from a warmed-up state. Once every segment of a file is done, the match state at the start of each segment is checked against the state handed over from the end of the previous segment. Any segment which started from a different state is rescanned from the handed-over state, so results are identical to scanning the file sequentially.
+
+  ## Args:
+
+  - fingerprints (dict): Mapping of fingerprint name to fingerprint definition
+  - file_names (list[str]): .wav files to scan
+  - output (TextIO): Stream to which match events are written as JSON lines, one file at a time, in order of time
+  - workers (int, default None): Number of worker processes. Defaults to the number of CPUs.
+  - chunk_length (int, default 2048): Number of samples per chunk
+  - segment_s (float, default 600): Maximum duration of audio scanned by one job
+  - matcher (str, default 'compiled'): Matcher implementation passed to `ChunkProcessor`
+  - spectrum_backend (str, default 'fft'): Spectrum backend passed to `ChunkProcessor`
+  - batch (bool, default True): Analyse blocks of chunks in vectorised batches rather than one chunk at a time
+
+  ## Returns:
+
+  - (dict): For each file, the audio duration, summed worker time and wall time in seconds
+  '''
+  summary = {}
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    submit = lambda job: pool.submit(scan_segment, fingerprints, job, chunk_length, matcher, spectrum_backend, batch)
+
+    # Submit every segment of every file up front so that all workers stay busy
+    jobs_by_file: dict[str, list[SegmentJob]] = {}
+    futures_by_file: dict[str, list[Future]] = {}
+    start_time = timer()
+    for file_name in file_names:
+      jobs_by_file[file_name] = split_into_segments(file_name, chunk_length, segment_s)
+      futures_by_file[file_name] = [submit(job) for job in jobs_by_file[file_name]]
+
+    for file_name in file_names:
+      results: list[SegmentResult] = []
+      for job, future in zip(jobs_by_file[file_name], futures_by_file[file_name]):
+        result = future.result()
+
+        # Hand state over from the previous segment and rescan if the warm-up did not converge on it
+        if len(results) > 0 and result['start_match_state'] != results[-1]['end_match_state']:
+          log.info(f'{file_name}: rescanning segment from chunk {job["i_chunk_start"]} with handed-over state')
+          rescan_duration_s = result['processing_duration_s']
+          result = submit({ **job, 'initial_match_state': results[-1]['end_match_state'] }).result()
+          result['processing_duration_s'] += rescan_duration_s
+
+        results.append(result)
+
+      for result in results:
+        for event in result['events']:
+          log.info(f'{file_name}: t={event["t"]:2f}s;Match for {event["fingerprint_id"]}!')
+          output.write(json.dumps({ 'file': file_name, **event }) + '\n')
+      output.flush()
+
+      summary[file_name] = {
+        'audio_duration_s': sum(r['audio_duration_s'] for r in results),
+        'processing_duration_s': sum(r['processing_duration_s'] for r in results),
+        'wall_duration_s': timer() - start_time
+      }
+
+  return summary
+
+def main(argv: list[str] | None = None) -> None:
+  parser = argparse.ArgumentParser(description='Scan .wav recordings for fingerprint matches')
+  parser.add_argument('paths', nargs='+', help='.wav files or directories containing them')
+  parser.add_argument('-f', '--fingerprints', required=True, help='JSON or TOML file of fingerprints')
+  parser.add_argument('-o', '--output', default='-', help='File to write JSONL match events to (default stdout)')
+  parser.add_argument('-j', '--workers', type=int, default=None, help='Number of worker processes (default number of CPUs)')
+  parser.add_argument('--chunk-length', type=int, default=2048, help='Number of samples per chunk')
+  parser.add_argument('--segment-s', type=float, default=600, help='Maximum seconds of audio per job')
+  parser.add_argument('--matcher', choices=['dict', 'compiled'], default='compiled')
+  parser.add_argument('--spectrum-backend', choices=['fft', 'targeted'], default='fft')
+  parser.add_argument('--per-chunk', action='store_true', help='Analyse one chunk at a time rather than in batches')
+  args = parser.parse_args(argv)
+
+  log.basicConfig(level=log.INFO, stream=sys.stderr)
+
+  fingerprints = load_fingerprints(args.fingerprints)
+  file_names = find_wav_files(args.paths)
+
+  output = sys.stdout if args.output == '-' else open(args.output, 'w')
+  try:
+    summary = scan_files(fingerprints, file_names, output, args.workers, args.chunk_length, args.segment_s, args.matcher, args.spectrum_backend, not args.per_chunk)
+  finally:
+    if output is not sys.stdout:
+      output.close()
+
+  for file_name, timing in summary.items():
+    throughput = timing['audio_duration_s'] / timing['processing_duration_s'] if timing['processing_duration_s'] > 0 else float('inf')
+    log.info(f'{file_name}: {timing["audio_duration_s"]:.1f}s of audio in {timing["processing_duration_s"]:.3f}s worker time ({throughput:.1f} audio-seconds per second), done after {timing["wall_duration_s"]:.3f}s')
+
+if __name__ == '__main__':
+  main()
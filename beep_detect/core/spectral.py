@@ -0,0 +1,190 @@
+'''
+Spectral functions used by detection, importing SciPy only when one of them is first called. Importing `scipy.signal` alone takes over a second on a small machine, so nothing in `beep_detect.core` imports SciPy at module level.
+
+Every function falls back to an equivalent NumPy implementation when SciPy is not installed, or when the environment variable `BEEP_DETECT_NUMPY_ONLY` is set to anything but `0`, which gives a detection path depending only on NumPy. The fallbacks give the same results as SciPy, apart from rounding in the FFT.
+'''
+import importlib
+import os
+import numpy as np
+from math import ceil
+from types import ModuleType
+
+NUMPY_ONLY = os.environ.get('BEEP_DETECT_NUMPY_ONLY', '0') != '0'
+
+_scipy_modules: dict[str, ModuleType | None] = {}
+
+def scipy_module(name: str) -> ModuleType | None:
+    '''
+    Import a SciPy submodule such as `'fft'` on first use, or `None` if SciPy is not installed or disabled with `BEEP_DETECT_NUMPY_ONLY`
+    '''
+    if name not in _scipy_modules:
+        module = None
+        if not NUMPY_ONLY:
+            try:
+                module = importlib.import_module(f'scipy.{name}')
+            except ImportError:
+                pass
+        _scipy_modules[name] = module
+    return _scipy_modules[name]
+
+def rfft(x: np.ndarray, axis: int = -1, workers: int | None = None) -> np.ndarray:
+    '''
+    Real FFT along `axis`, with `workers` threads when SciPy is available. Single precision input gives a single precision result either way.
+    '''
+    fft = scipy_module('fft')
+    if fft is not None:
+        return fft.rfft(x, axis=axis, workers=workers)
+    return np.fft.rfft(x, axis=axis)
+
+def rfftfreq(n: int, d: float = 1.0) -> np.ndarray:
+    # The same in NumPy and SciPy, so SciPy is never needed
+    return np.fft.rfftfreq(n, d)
+
+# Cosine sum coefficients of the windows available without SciPy
+_COSINE_WINDOWS = {
+    'boxcar': (1.,),
+    'hann': (0.5, 0.5),
+    'hamming': (0.54, 0.46),
+    'blackman': (0.42, 0.5, 0.08)
+}
+
+def get_window(window: str, n: int, fftbins: bool = True) -> np.ndarray:
+    '''
+    Window of length `n` by name, periodic by default as for spectral analysis. Without SciPy only `'boxcar'`, `'hann'`, `'hamming'` and `'blackman'` are available.
+    '''
+    signal = scipy_module('signal')
+    if signal is not None:
+        return signal.get_window(window, n, fftbins=fftbins)
+    if window not in _COSINE_WINDOWS:
+        raise ValueError(f'Window "{window}" needs SciPy. Without SciPy the available windows are {list(_COSINE_WINDOWS)}.')
+
+    if n == 1:
+        # As in SciPy, a window of one sample leaves it unchanged
+        return np.ones(1)
+
+    # A periodic window is a symmetric window one sample longer, with the last sample dropped
+    m = n + 1 if fftbins else n
+    phase = 2 * np.pi * np.arange(n) / max(m - 1, 1)
+    return sum((-1)**i * a * np.cos(i * phase) for i, a in enumerate(_COSINE_WINDOWS[window]))
+
+def firwin(numtaps: int, cutoff: float) -> np.ndarray:
+    '''
+    Low-pass FIR filter by the window method, with a Hamming window and unit gain at DC, as `scipy.signal.firwin(numtaps, cutoff)`. `cutoff` is relative to the Nyquist frequency.
+    '''
+    signal = scipy_module('signal')
+    if signal is not None:
+        return signal.firwin(numtaps, cutoff)
+    m = np.arange(numtaps) - (numtaps - 1) / 2
+    taps = cutoff * np.sinc(cutoff * m) * get_window('hamming', numtaps, fftbins=False)
+    return taps / np.sum(taps)
+
+def find_peaks(x: np.ndarray, prominence: float | None = None, distance: float | None = None, wlen: float | None = None) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    '''
+    Indices of the local maxima of a 1-D array, as `scipy.signal.find_peaks` with only the `prominence`, `distance` and `wlen` arguments. Maxima closer than `distance` to a higher one are dropped first, then maxima less prominent than `prominence`.
+
+    ## Returns:
+
+    - (tuple[np.ndarray, dict]): peak indices, and their `'prominences'` if `prominence` was given
+    '''
+    signal = scipy_module('signal')
+    if signal is not None:
+        return signal.find_peaks(x, prominence=prominence, distance=distance, wlen=wlen)
+
+    x = np.asarray(x)
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(np.float64)
+    peaks = _local_maxima(x)
+    if distance is not None:
+        peaks = peaks[select_by_distance(peaks, x[peaks], distance)]
+    properties = {}
+    if prominence is not None:
+        prominences = _prominences(x, peaks, wlen)
+        keep = prominences >= prominence
+        peaks = peaks[keep]
+        properties['prominences'] = prominences[keep]
+    return peaks, properties
+
+def _local_maxima(x: np.ndarray) -> np.ndarray:
+    # Compare runs of equal values rather than samples, so that a flat peak is found once, at its middle
+    if len(x) < 3:
+        return np.zeros(0, dtype=np.intp)
+    starts = np.flatnonzero(np.concatenate(([True], x[1:] != x[:-1])))
+    ends = np.append(starts[1:] - 1, len(x) - 1)
+    values = x[starts]
+    is_peak = (values[1:-1] > values[:-2]) & (values[1:-1] > values[2:])
+    return ((starts[1:-1] + ends[1:-1]) // 2)[is_peak]
+
+def select_by_distance(peaks: np.ndarray, priority: np.ndarray, distance: float) -> np.ndarray:
+    '''
+    Mask of the peaks kept by the `distance` argument of `find_peaks`, for sorted peak positions which need not index one array
+
+    ## Returns:
+
+    - (np.ndarray): boolean mask, True for each peak which is not within `distance` of a peak of higher `priority`
+    '''
+    # SciPy keeps peaks from the highest down, each dropping its neighbours within `distance`, with ties broken in the
+    # order of `np.argsort`. The same peaks are kept here in rounds: an undecided peak which outranks every undecided
+    # neighbour cannot be dropped by anything left, so it is kept and drops its neighbours.
+    distance = ceil(distance)
+    n = len(peaks)
+    rank = np.empty(n, dtype=np.intp)
+    rank[np.argsort(priority)] = np.arange(n)
+    undecided = np.ones(n, dtype=bool)
+    keep = np.zeros(n, dtype=bool)
+    # Peaks are at least one sample apart, so neighbours are at most `distance - 1` places away
+    offsets = [o for o in range(1, min(distance, n)) if np.any(peaks[o:] - peaks[:-o] < distance)]
+    while np.any(undecided):
+        outranks = undecided.copy()
+        for o in offsets:
+            near = peaks[o:] - peaks[:-o] < distance
+            both = near & undecided[o:] & undecided[:-o]
+            outranks[:-o] &= ~both | (rank[:-o] > rank[o:])
+            outranks[o:] &= ~both | (rank[o:] > rank[:-o])
+        keep |= outranks
+        undecided &= ~outranks
+        for o in offsets:
+            near = peaks[o:] - peaks[:-o] < distance
+            undecided[o:] &= ~(near & outranks[:-o])
+            undecided[:-o] &= ~(near & outranks[o:])
+    return keep
+
+def _sparse_table(x: np.ndarray, reduce: np.ufunc, fill: float) -> np.ndarray:
+    # Row k holds the reduction of x[i:i + 2**k] at column i, or `fill` where that would run off the end
+    table = np.full((max(len(x).bit_length(), 1), len(x)), fill, dtype=x.dtype)
+    table[0] = x
+    for k in range(1, len(table)):
+        half = 2**(k - 1)
+        reduce(table[k - 1, :-half], table[k - 1, half:], out=table[k, :-half])
+        table[k, len(x) - 2 * half + 1:] = fill
+    return table
+
+def _prominences(x: np.ndarray, peaks: np.ndarray, wlen: float | None) -> np.ndarray:
+    # A peak's base on each side is the lowest point before a higher sample, within half of `wlen` of the peak. The
+    # nearest higher sample is found for all peaks at once by jumping away from each peak in decreasing powers of 2,
+    # while the range jumped over is no higher than the peak.
+    if len(peaks) == 0:
+        return np.zeros(0)
+    half_wlen = len(x) if wlen is None else int(ceil(wlen)) // 2
+    heights = x[peaks]
+    maxima = _sparse_table(x, np.maximum, np.inf)
+    minima = _sparse_table(x, np.minimum, np.inf)
+
+    lo = np.maximum(peaks - half_wlen, 0)
+    hi = np.minimum(peaks + half_wlen, len(x) - 1)
+    left = peaks.copy()
+    right = peaks.copy()
+    for k in range(len(maxima) - 1, -1, -1):
+        step = 2**k
+        start = left - step
+        can = (start >= lo) & (maxima[k, np.maximum(start, 0)] <= heights)
+        left[can] = start[can]
+        end = right + step
+        can = (end <= hi) & (maxima[k, np.minimum(right + 1, len(x) - 1)] <= heights)
+        right[can] = end[can]
+
+    # Minimum of x[left:peak + 1] and x[peak:right + 1], from two overlapping power of 2 ranges each
+    k = np.log2(peaks - left + 1).astype(np.intp)
+    left_min = np.minimum(minima[k, left], minima[k, peaks + 1 - 2**k])
+    k = np.log2(right - peaks + 1).astype(np.intp)
+    right_min = np.minimum(minima[k, peaks], minima[k, right + 1 - 2**k])
+    return heights - np.maximum(left_min, right_min)
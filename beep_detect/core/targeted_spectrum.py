@@ -0,0 +1,161 @@
+import numpy as np
+from math import ceil, log2
+from beep_detect.core.spectral import find_peaks, rfft, select_by_distance
+from timeit import default_timer as timer
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.types import ChunkMap
+
+class TargetedSpectrum:
+    '''
+    Spectral analysis restricted to the frequencies that the fingerprints care about. Rather than computing the full rFFT and searching the whole spectrum for peaks, only the bins within `tolerance_f` of an expected frequency are evaluated, plus some neighbouring context bins so that peak prominence can be tested. When there are only a few such bins they are evaluated with a small precomputed DFT matrix, which is the matrix form of running one Goertzel filter per bin. Otherwise the full rFFT is computed and only the evaluated bins are kept, and the saving is in the peak search alone.
+
+    Peak indices follow the same convention as the full-spectrum path in `ChunkProcessor`, so they can be passed to the same matchers. Because prominence is measured within the evaluated window rather than across the whole spectrum, a peak may occasionally be assigned a lower prominence than the full-spectrum path would give it. Likewise `peak_distance` only compares peaks among the evaluated bins, so with a narrow context a peak next to a higher one outside the window may be kept where the full-spectrum path would drop it.
+    '''
+
+    def __init__(
+          self,
+          chunkmaps: dict[str, ChunkMap],
+          chunk_length: int,
+          frequency_bands: np.ndarray,
+          tolerance_f: float,
+          peak_prominence: float,
+          peak_distance: float,
+          context_bins: int | None = None,
+          window: np.ndarray | None = None
+        ) -> None:
+        '''
+        Precompute the bins to evaluate and the DFT matrix for them
+
+        ## Args:
+
+        - chunkmaps (dict): Mapping of fingerprint name to chunkmap. Every expected frequency in every chunkmap becomes a target.
+        - chunk_length (int): Number of samples per chunk
+        - frequency_bands (np.ndarray): Frequency of each peak index, as used by `ChunkProcessor`
+        - tolerance_f (float): Relative frequency tolerance used for matching
+        - peak_prominence (float): Prominence for peak detection, as for `ChunkProcessor`
+        - peak_distance (float): Distance for peak detection, as for `ChunkProcessor`
+        - context_bins (int, default None): Number of extra bins evaluated either side of each target range, for testing prominence. Defaults to `4 * peak_distance`, as the base of a peak's prominence is often tens of bins away from it in a noisy spectrum, and narrower contexts miss matches on the bundled recordings. A context of a few bins is enough for the DFT matrix to be used, at the cost of finding fewer peaks. Must be at least 1, so that a peak at the edge of a target range can be found.
+        - window (np.ndarray, default None): Analysis window applied to each chunk before the transform. `None` is a rectangular window.
+        '''
+        self.chunk_length = chunk_length
+        self.peak_prominence = peak_prominence
+        self.peak_distance = peak_distance
+        self.window = window
+        if context_bins is None:
+            context_bins = int(4 * peak_distance)
+        if context_bins < 1:
+            raise ValueError(f'Context of {context_bins} bins is too small to find peaks at the edges of the target ranges')
+        self.context_bins = context_bins
+
+        # Ranges of peak indices which can match a target frequency
+        n_peak_indices = len(frequency_bands) - 1
+        target_freqs = sorted({ f for chunkmap in chunkmaps.values() for freqs in chunkmap['frequencies_to_match_by_chunk'] for f in freqs })
+        target_ranges = []
+        for f in target_freqs:
+            bins = np.flatnonzero(np.isclose(frequency_bands[:n_peak_indices], f, rtol=tolerance_f))
+            if len(bins) > 0:
+                target_ranges.append((bins[0], bins[-1]))
+
+        # Merge the context windows around each target range into disjoint windows
+        self.windows: list[tuple[int, int]] = []
+        for lo, hi in target_ranges:
+            span = (max(lo - context_bins, 0), min(hi + context_bins, n_peak_indices - 1))
+            if len(self.windows) > 0 and span[0] <= self.windows[-1][1] + 1:
+                self.windows[-1] = (self.windows[-1][0], max(span[1], self.windows[-1][1]))
+            else:
+                self.windows.append(span)
+
+        self.is_target = np.zeros(n_peak_indices, dtype=bool)
+        for lo, hi in target_ranges:
+            self.is_target[lo:hi+1] = True
+
+        # DFT matrix with a cosine and a sine column per evaluated bin. Peak index i is rFFT bin i+1. Each bin of
+        # a DFT costs as much as a Goertzel filter, O(chunk_length), so once there are more bins than a few times
+        # log2(chunk_length) it is cheaper to compute the full rFFT and only keep the evaluated bins.
+        self.n_peak_indices = n_peak_indices
+        self.peak_indices = np.concatenate([np.arange(lo, hi+1) for lo, hi in self.windows]) if len(self.windows) > 0 else np.zeros(0, dtype=np.intp)
+        self.dft_matrix = None
+        if len(self.peak_indices) <= 2 * log2(chunk_length):
+            phase = 2 * np.pi * np.outer(np.arange(chunk_length), self.peak_indices + 1) / chunk_length
+            self.dft_matrix = np.concatenate([np.cos(phase), np.sin(phase)], axis=1, dtype=np.float32)
+            if window is not None:
+                self.dft_matrix *= window[:, np.newaxis]
+
+        # Layout of one row of windows, each followed by a separator column
+        window_ends = np.cumsum([hi - lo + 1 for lo, hi in self.windows])
+        self.separator_columns = window_ends + np.arange(len(self.windows))
+        self.row_length = len(self.peak_indices) + len(self.windows)
+        self.column_peak_indices = np.full(self.row_length, -1, dtype=np.intp)
+        self.column_peak_indices[np.setdiff1d(np.arange(self.row_length), self.separator_columns)] = self.peak_indices
+        self.prominence_wlen = 2 * max([hi - lo + 2 for lo, hi in self.windows], default=1) + 3
+
+    def find_peaks(self, chunks: np.ndarray, metrics: Metrics | None = None) -> list[np.ndarray]:
+        '''
+        Find frequency peaks within the target windows
+
+        ## Args:
+
+        - chunks (np.ndarray): 2-D array of shape `(n_chunks, chunk_length)`
+        - metrics (Metrics, default None): Where to record the latency of each stage
+
+        ## Returns:
+
+        - (list[np.ndarray]): for each chunk, the peak indices which fall within a target range
+        '''
+        n_chunks = len(chunks)
+        n_bins = len(self.peak_indices)
+        if n_bins == 0:
+            return [np.zeros(0, dtype=np.intp) for _ in range(n_chunks)]
+
+        if metrics is not None:
+            start_time = timer()
+        if self.dft_matrix is not None:
+            projections = np.asarray(chunks, dtype=np.float32) @ self.dft_matrix
+            freq_vals = np.hypot(projections[:, :n_bins], projections[:, n_bins:])
+        else:
+            chunks = np.asarray(chunks, dtype=np.float32)
+            if self.window is not None:
+                chunks = chunks * self.window
+            freq_vals = np.absolute(rfft(chunks, axis=-1)[:, self.peak_indices + 1])
+        if metrics is not None:
+            fft_time = timer()
+            metrics.observe_stage('fft', fft_time - start_time, n_chunks)
+
+        # Lay every window of every chunk end to end, separated by +inf, and find peaks in one call. A peak's
+        # prominence base cannot extend past a separator, which is exactly as if each window were searched on its
+        # own, and `wlen` stops the separators themselves from searching the whole array.
+        freq_db = np.full((n_chunks, self.row_length), np.inf)
+        freq_db[:, self.column_peak_indices >= 0] = 10*np.log10(freq_vals)
+        if metrics is not None:
+            db_time = timer()
+            metrics.observe_stage('db', db_time - fft_time, n_chunks)
+        freq_db = freq_db.ravel()
+        if self.context_bins >= self.peak_distance:
+            # Separators only drop peaks within `peak_distance` of a window edge, which the context keeps away
+            # from the target ranges
+            peaks = find_peaks(freq_db, prominence=self.peak_prominence, distance=self.peak_distance, wlen=self.prominence_wlen)[0]
+            rows, columns = np.divmod(peaks, self.row_length)
+            peak_indices = self.column_peak_indices[columns]
+        else:
+            # Otherwise `peak_distance` is applied between the positions of the peaks in the spectrum, before the
+            # prominence test as in `find_peaks`, so that the separators do not drop the peaks near them. Chunks
+            # are spaced far enough apart that their peaks never interact.
+            peaks, properties = find_peaks(freq_db, prominence=-np.inf, wlen=self.prominence_wlen)
+            rows, columns = np.divmod(peaks, self.row_length)
+            peak_indices = self.column_peak_indices[columns]
+            is_peak = peak_indices >= 0
+            peaks, rows, peak_indices, prominences = peaks[is_peak], rows[is_peak], peak_indices[is_peak], properties['prominences'][is_peak]
+            positions = rows * (self.n_peak_indices + ceil(self.peak_distance)) + peak_indices
+            keep = select_by_distance(positions, freq_db[peaks], self.peak_distance) & (prominences >= self.peak_prominence)
+            rows = rows[keep]
+            peak_indices = peak_indices[keep]
+
+        is_target = (peak_indices >= 0) & self.is_target[peak_indices]
+        rows = rows[is_target]
+        peak_indices = peak_indices[is_target]
+
+        peaks_by_chunk = np.split(peak_indices, np.searchsorted(rows, np.arange(1, n_chunks)))
+        if metrics is not None:
+            metrics.observe_stage('peaks', timer() - db_time, n_chunks)
+
+        return peaks_by_chunk
@@ -1,10 +1,12 @@
 from beep_detect.core.types import FingerprintInMs, SectionAnyInMs, SectionSineInMs
 
-def ms_to_chunks(time_in_ms: int | float, sample_rate: int, chunk_length: int) -> int:
-  return round(1e-3 * time_in_ms * sample_rate / chunk_length)
+# Chunks are analysed every `hop_length` samples. Without overlap the hop is the chunk length.
 
-def chunks_to_s(time_in_chunks: int | float, sample_rate: int, chunk_length: int) -> float:
-  return time_in_chunks * chunk_length / sample_rate
+def ms_to_chunks(time_in_ms: int | float, sample_rate: int, chunk_length: int, hop_length: int | None = None) -> int:
+  return round(1e-3 * time_in_ms * sample_rate / (hop_length or chunk_length))
 
-def chunks_to_ms(time_in_chunks: int | float, sample_rate: int, chunk_length: int) -> float:
-  return 1e3 * chunks_to_s(time_in_chunks, sample_rate, chunk_length)
+def chunks_to_s(time_in_chunks: int | float, sample_rate: int, chunk_length: int, hop_length: int | None = None) -> float:
+  return time_in_chunks * (hop_length or chunk_length) / sample_rate
+
+def chunks_to_ms(time_in_chunks: int | float, sample_rate: int, chunk_length: int, hop_length: int | None = None) -> float:
+  return 1e3 * chunks_to_s(time_in_chunks, sample_rate, chunk_length, hop_length)
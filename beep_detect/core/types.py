@@ -21,4 +21,14 @@ SectionInMs = Union[SectionAnyInMs, SectionSineInMs]
 class ChunkMap(TypedDict):
     repetitions: int
     max_period_chunks: int
-    frequencies_to_match_by_chunk: list[list[float]]
\ No newline at end of file
+    frequencies_to_match_by_chunk: list[list[float]]
+
+class MatchEvent(TypedDict):
+    fingerprint_id: str
+    t: float
+
+class RunSummary(TypedDict):
+    events: list[MatchEvent]
+    audio_duration_s: float
+    processing_duration_s: float
+    throughput: float
@@ -0,0 +1,84 @@
+import os
+import struct
+import wave
+import numpy as np
+from typing import Iterator
+
+# Type that 16-bit PCM samples are decoded to: signed little-endian, as stored in .wav files
+SAMPLE_DTYPE = np.dtype('<i2')
+
+class WavSource:
+    '''
+    Source of audio chunks read from a .wav file. The samples are memory-mapped rather than read, so blocks of chunks are views of the file with no copying or decoding, and memory use does not depend on the length of the recording.
+    '''
+
+    def __init__(self, file_name: str) -> None:
+        self.file_name = file_name
+        self.wf = wave.open(file_name, 'rb')
+        self.sample_rate = self.wf.getframerate()
+        self.n_frames = self.wf.getnframes()
+
+        # Validate
+        if self.wf.getsampwidth() != 2:
+            raise ValueError(f'Only 16-bit PCM is supported but "{file_name}" has sample width {self.wf.getsampwidth()} bytes')
+        if self.wf.getnchannels() != 1:
+            raise ValueError(f'Only mono audio is supported but "{file_name}" has {self.wf.getnchannels()} channels')
+
+        # A truncated recording has fewer samples than its header claims
+        offset = _find_data_offset(file_name)
+        self.n_frames = min(self.n_frames, (os.path.getsize(file_name) - offset) // SAMPLE_DTYPE.itemsize)
+        self.samples = np.memmap(file_name, dtype=SAMPLE_DTYPE, mode='r', offset=offset, shape=(self.n_frames,)) if self.n_frames > 0 else np.zeros(0, dtype=SAMPLE_DTYPE)
+
+    def n_chunks(self, chunk_length: int) -> int:
+        '''
+        Number of complete chunks of `chunk_length` samples in the file
+        '''
+        return self.n_frames // chunk_length
+
+    def iter_blocks(self, chunk_length: int, start_chunk: int = 0, end_chunk: int | None = None, block_chunks: int = 64) -> Iterator[tuple[int, np.ndarray]]:
+        '''
+        Read consecutive chunks from the file in blocks
+
+        ## Args:
+
+        - chunk_length (int): Number of samples per chunk
+        - start_chunk (int, default 0): Index of the first chunk to read
+        - end_chunk (int, default None): Index of the chunk to stop before. Defaults to the last complete chunk in the file.
+        - block_chunks (int, default 64): Maximum number of chunks read from the file at once. This bounds memory use.
+
+        ## Yields:
+
+        - (tuple[int, np.ndarray]): index of the first chunk in the block, and a read-only 2-D view of shape `(n_chunks, chunk_length)` of the file with one chunk per row
+        '''
+        if end_chunk is None or end_chunk > self.n_chunks(chunk_length):
+            end_chunk = self.n_chunks(chunk_length)
+
+        chunks = self.samples[:self.n_chunks(chunk_length) * chunk_length].reshape(-1, chunk_length)
+        for i_chunk in range(start_chunk, end_chunk, block_chunks):
+            yield i_chunk, chunks[i_chunk:min(i_chunk + block_chunks, end_chunk)]
+
+    def close(self) -> None:
+        # Blocks already yielded keep the mapping open until they are released
+        self.samples = np.zeros(0, dtype=SAMPLE_DTYPE)
+        self.wf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _find_data_offset(file_name: str) -> int:
+    # Walk the RIFF chunks to the start of the samples, which `wave` does not expose
+    with open(file_name, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f'"{file_name}" is not a RIFF .wav file')
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f'"{file_name}" has no data chunk')
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                return f.tell()
+            f.seek(chunk_size + chunk_size % 2, 1)
@@ -0,0 +1,119 @@
+'''
+Web server for monitoring detection. Serves the dashboard, streams matches, spectra and peaks over `/ws`, and exposes metrics at `/metrics`.
+
+Usage:
+
+```shell
+python -m beep_detect.web -f beep_detect/core/fingerprints.toml
+python -m beep_detect.web -f beep_detect/core/fingerprints.toml --wav "data/Washing machine finish.wav"
+python -m beep_detect.web -f beep_detect/core/fingerprints.toml --mqtt-host localhost
+python -m beep_detect.web -f beep_detect/core/fingerprints.toml --record recording/
+```
+
+Remote devices can stream their own audio to the server instead, see `beep_detect.web.replay` for an example client.
+'''
+import argparse
+import sys
+
+from twisted.python import log
+from twisted.internet import reactor
+from twisted.web.server import Site
+from twisted.web.wsgi import WSGIResource
+from autobahn.twisted.websocket import WebSocketServerFactory
+from autobahn.twisted.resource import WebSocketResource, WSGIRootResource
+
+from beep_detect.core.capture_pipeline import CapturePipeline, WavReplayStream
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.fingerprint_config import load_fingerprints
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.mqtt_publisher import MqttPublisher
+from beep_detect.core.recorder import ChunkRecorder
+from beep_detect.core.wav_source import WavSource
+from .app import app
+from .broadcast import Broadcaster
+from .ingest import Ingestor
+from .ws import AudioServerProtocol
+
+def build_site(broadcaster: Broadcaster, ingestor: Ingestor, port: int) -> Site:
+    wsFactory = WebSocketServerFactory(f'ws://localhost:{port}')
+    wsFactory.protocol = AudioServerProtocol
+    wsFactory.broadcaster = broadcaster
+    wsFactory.ingestor = ingestor
+    wsResource = WebSocketResource(wsFactory)
+
+    wsgiResource = WSGIResource(reactor, reactor.getThreadPool(), app) # type: ignore
+
+    rootResource = WSGIRootResource(wsgiResource, { b'ws': wsResource })
+
+    return Site(rootResource)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Detect beeps and stream results to web dashboards')
+    parser.add_argument('-f', '--fingerprints', required=True, help='JSON or TOML file of fingerprints')
+    parser.add_argument('--wav', help='Replay a .wav file in real time instead of listening to the default input device')
+    parser.add_argument('--ingest-only', action='store_true', help='Only analyse audio streamed in by remote clients')
+    parser.add_argument('--ingest-workers', type=int, default=None, help='Number of threads analysing remote audio')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--chunk-length', type=int, default=2048, help='Number of samples per chunk when replaying a .wav file')
+    parser.add_argument('--mqtt-host', help='Also publish matches to this MQTT broker')
+    parser.add_argument('--mqtt-port', type=int, default=1883)
+    parser.add_argument('--mqtt-topic-prefix', default='beep_detect')
+    parser.add_argument('--mqtt-qos', type=int, choices=(0, 1, 2), default=1)
+    parser.add_argument('--record', metavar='DIR', help='Keep the most recent local audio in this directory for replay with beep_detect.core.recorder')
+    parser.add_argument('--record-s', type=float, default=600, help='Seconds of audio to keep when recording')
+    args = parser.parse_args(argv)
+
+    log.startLogging(sys.stdout)
+
+    fingerprints = load_fingerprints(args.fingerprints)
+    broadcaster = Broadcaster()
+    metrics = Metrics('web')
+
+    on_match = broadcaster.on_match
+    publish_remote_match = None
+    if args.mqtt_host is not None:
+        publisher = MqttPublisher(args.mqtt_host, args.mqtt_port, args.mqtt_topic_prefix, args.mqtt_qos, metrics=Metrics('mqtt'))
+        publisher.start()
+        reactor.addSystemEventTrigger('after', 'shutdown', publisher.stop) # type: ignore
+
+        def on_match(fingerprint_id: str) -> None:
+            broadcaster.on_match(fingerprint_id)
+            publisher.publish_match(fingerprint_id)
+
+        def publish_remote_match(source_id: str, fingerprint_id: str) -> None:
+            publisher.publish_match(fingerprint_id, source_id)
+
+    ingestor = Ingestor(fingerprints, max_workers=args.ingest_workers, match_listener=publish_remote_match, metrics=Metrics('ingest'))
+    reactor.addSystemEventTrigger('after', 'shutdown', ingestor.runner.close) # type: ignore
+    reactor.listenTCP(args.port, build_site(broadcaster, ingestor, args.port)) # type: ignore
+
+    if args.ingest_only:
+        reactor.run() # type: ignore
+        return
+
+    if args.wav is None:
+        # Imported here so that replaying files works without PyAudio
+        from beep_detect.core.device_input_runner import DeviceInputRunner
+        with DeviceInputRunner(fingerprints, on_match, metrics=metrics, recording_dir=args.record, recording_s=args.record_s) as runner:
+            broadcaster.attach(runner.chunk_processor)
+            reactor.run() # type: ignore
+        return
+
+    with WavSource(args.wav) as source:
+        sample_rate = source.sample_rate
+    chunk_processor = ChunkProcessor(fingerprints, sample_rate, args.chunk_length, metrics=metrics)
+    broadcaster.attach(chunk_processor)
+    recorder = ChunkRecorder(args.record, chunk_processor, args.record_s) if args.record is not None else None
+    pipeline = CapturePipeline(chunk_processor, on_match, recorder=recorder)
+    stream = WavReplayStream(args.wav, args.chunk_length, lambda in_data, *_: pipeline.push(in_data))
+
+    pipeline.start()
+    stream.start_stream()
+    try:
+        reactor.run() # type: ignore
+    finally:
+        stream.close()
+        pipeline.stop(drain=False)
+
+if __name__ == '__main__':
+    main()
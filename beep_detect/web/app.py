@@ -1,7 +1,13 @@
-from flask import Flask, render_template
+from flask import Flask, Response, render_template
+
+from beep_detect.core.metrics import render_metrics
 
 app = Flask(__name__)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
\ No newline at end of file
+    return render_template('index.html')
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
\ No newline at end of file
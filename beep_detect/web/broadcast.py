@@ -0,0 +1,139 @@
+import struct
+import threading
+import time
+import numpy as np
+from typing import TYPE_CHECKING
+
+from twisted.internet import reactor
+
+from beep_detect.core.chunk_processor import ChunkProcessor
+
+if TYPE_CHECKING:
+    from beep_detect.web.ws import AudioServerProtocol
+
+# Binary frame types. Every frame starts with the type (uint8) and the wall-clock time of the chunk (float64),
+# little-endian.
+FRAME_MATCH = 1    # then fingerprint ID length (uint16) and the ID in UTF-8
+FRAME_SPECTRUM = 2 # then Hz per bin (float32), number of bins (uint16) and one uint8 per bin: the maximum dB in the bin
+FRAME_PEAKS = 3    # then number of peaks (uint16) and one float32 frequency in Hz per peak
+
+HEADER = struct.Struct('<Bd')
+
+def encode_match(fingerprint_id: str, t: float) -> bytes:
+    id_bytes = fingerprint_id.encode('utf8')
+    return HEADER.pack(FRAME_MATCH, t) + struct.pack('<H', len(id_bytes)) + id_bytes
+
+def encode_spectrum(freq_db: np.ndarray, hz_per_bin: float, n_bins: int, t: float) -> bytes:
+    '''
+    Decimate a spectrum to at most `n_bins` bins, keeping the maximum of each so that peaks survive, and quantise it to whole dB
+    '''
+    factor = -(-len(freq_db) // n_bins)
+    padded = np.full(factor * -(-len(freq_db) // factor), -np.inf)
+    padded[:len(freq_db)] = freq_db
+    decimated = padded.reshape(-1, factor).max(axis=1)
+    values = np.clip(np.nan_to_num(decimated, neginf=0), 0, 255).astype(np.uint8)
+    return HEADER.pack(FRAME_SPECTRUM, t) + struct.pack('<fH', hz_per_bin * factor, len(values)) + values.tobytes()
+
+def encode_peaks(frequencies: np.ndarray, t: float) -> bytes:
+    return HEADER.pack(FRAME_PEAKS, t) + struct.pack('<H', len(frequencies)) + np.asarray(frequencies, dtype='<f4').tobytes()
+
+class Broadcaster:
+    '''
+    Fans match events, spectra and peaks out from a `ChunkProcessor` to WebSocket clients.
+
+    Detection must never wait for clients, so the analysis thread does as little as possible: matches are encoded and handed to the reactor, while spectra and peaks are rate limited, encoded only when someone is subscribed, and left in a single slot which the reactor picks up whenever it gets round to it. Intermediate spectra are overwritten rather than queued. Each client then coalesces and applies its own backpressure, see `AudioServerProtocol`.
+    '''
+
+    def __init__(self, spectrum_bins: int = 256, spectrum_interval_s: float = 0.1) -> None:
+        '''
+        ## Args:
+
+        - spectrum_bins (int, default 256): Maximum number of bins in each spectrum frame
+        - spectrum_interval_s (float, default 0.1): Minimum time between spectrum and peak frames
+        '''
+        self.spectrum_bins = spectrum_bins
+        self.spectrum_interval_s = spectrum_interval_s
+        self.clients: set['AudioServerProtocol'] = set()
+        self.chunk_processor: ChunkProcessor | None = None
+
+        # Subscriber counts are only written on the reactor thread, and read on the analysis thread
+        self.subscribers = { 'spectrum': 0, 'peaks': 0 }
+
+        # Latest frames waiting for the reactor
+        self._latest: dict[str, bytes] = {}
+        self._latest_lock = threading.Lock()
+        self._flush_scheduled = False
+        self._last_spectrum_time = 0.
+
+    def attach(self, chunk_processor: ChunkProcessor) -> None:
+        '''
+        Receive spectra and peaks from a processor. Matches should be passed to `on_match`, usually as the match callback of a runner or `CapturePipeline`.
+        '''
+        self.chunk_processor = chunk_processor
+        chunk_processor.spectrum_listener = self.on_spectrum
+
+    def add_client(self, client: 'AudioServerProtocol') -> None:
+        self.clients.add(client)
+        self._count_subscriptions(client, 1)
+
+    def remove_client(self, client: 'AudioServerProtocol') -> None:
+        if client in self.clients:
+            self.clients.remove(client)
+            self._count_subscriptions(client, -1)
+
+    def update_subscriptions(self, client: 'AudioServerProtocol', subscriptions: set[str]) -> None:
+        self._count_subscriptions(client, -1)
+        client.subscriptions = subscriptions
+        self._count_subscriptions(client, 1)
+
+    def on_match(self, fingerprint_id: str) -> None:
+        '''
+        Broadcast a match. Safe to call from any thread.
+        '''
+        reactor.callFromThread(self._send_match, encode_match(fingerprint_id, time.time())) # type: ignore
+
+    def on_spectrum(self, freq_db: np.ndarray | None, freq_peaks_i: np.ndarray) -> None:
+        '''
+        Spectrum listener for a `ChunkProcessor`, called on the analysis thread
+        '''
+        if self.subscribers['spectrum'] == 0 and self.subscribers['peaks'] == 0:
+            return
+        now = time.time()
+        if now - self._last_spectrum_time < self.spectrum_interval_s or self.chunk_processor is None:
+            return
+        self._last_spectrum_time = now
+
+        frequency_bands = self.chunk_processor.frequency_bands
+        frames = {}
+        if freq_db is not None and self.subscribers['spectrum'] > 0:
+            frames['spectrum'] = encode_spectrum(freq_db, float(frequency_bands[1]), self.spectrum_bins, now)
+        if self.subscribers['peaks'] > 0:
+            frames['peaks'] = encode_peaks(frequency_bands[freq_peaks_i], now)
+
+        with self._latest_lock:
+            self._latest.update(frames)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        reactor.callFromThread(self._send_latest) # type: ignore
+
+    def _send_match(self, frame: bytes) -> None:
+        for client in self.clients:
+            if 'matches' in client.subscriptions:
+                client.queue_match(frame)
+
+    def _send_latest(self) -> None:
+        with self._latest_lock:
+            latest = self._latest
+            self._latest = {}
+            self._flush_scheduled = False
+
+        for client in self.clients:
+            for kind, frame in latest.items():
+                if kind in client.subscriptions:
+                    client.replace_latest(kind, frame)
+
+    def _count_subscriptions(self, client: 'AudioServerProtocol', delta: int) -> None:
+        for kind in self.subscribers:
+            if kind in client.subscriptions:
+                self.subscribers[kind] += delta
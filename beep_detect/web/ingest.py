@@ -0,0 +1,138 @@
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Callable, TypedDict
+
+import numpy as np
+from twisted.internet import reactor
+
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.multi_source_runner import MultiSourceRunner
+from beep_detect.core.rechunker import Rechunker
+from beep_detect.core.types import FingerprintInMs
+from beep_detect.web.broadcast import encode_match
+
+if TYPE_CHECKING:
+    from beep_detect.web.ws import AudioServerProtocol
+
+# Sample formats accepted in the handshake, and the types they are decoded to
+SAMPLE_FORMATS = {
+    's16le': '<i2',
+    'u16le': '<u2',
+    'f32le': '<f4'
+}
+
+class IngestHandshake(TypedDict, total=False):
+    sample_rate: int
+    format: str
+    chunk_length: int
+    source_id: str
+
+class Ingestor:
+    '''
+    Runs detection on raw PCM streamed in by remote clients over WebSocket. Each connection is a source of a `MultiSourceRunner`, so it has its own match state while sharing compiled fingerprints with other connections at the same sample rate, and its chunks are analysed on the runner's worker pool rather than on the reactor thread. Matches are sent back to the connection they were detected on.
+
+    A client starts by sending a text message such as `{"ingest": {"sample_rate": 16000, "format": "s16le"}}`, waits for `{"ready": {...}}` in reply, then sends mono samples as binary messages of any length.
+
+    No audio is dropped. When a connection's queue in the runner is full, further chunks are held back on the reactor thread and reading from the connection is paused, so that TCP flow control slows the client down. Reading resumes once the workers have caught up.
+    '''
+
+    def __init__(
+            self,
+            fingerprints: dict[str, FingerprintInMs],
+            max_workers: int | None = None,
+            max_pending_chunks: int = 64,
+            match_listener: Callable[[str, str], None] | None = None,
+            metrics: Metrics | None = None,
+            **chunk_processor_kwargs
+        ) -> None:
+        '''
+        ## Args:
+
+        - fingerprints (dict): Mapping of fingerprint name to fingerprint definition, shared by all connections
+        - max_workers (int, default None): Size of the analysis thread pool
+        - max_pending_chunks (int, default 64): Number of chunks which may be queued for analysis for each connection before reading from it is paused
+        - match_listener (Callable, default None): Also called with the source ID and fingerprint ID of each match, from a worker thread. Must not block, for example a function which queues the match on an `MqttPublisher`.
+        - metrics (Metrics, default None): If given, each connection records its own `Metrics`, labelled with this detector name and the source ID
+        - chunk_processor_kwargs: Passed to each connection's `ChunkProcessor`
+        '''
+        self.runner = MultiSourceRunner(fingerprints, self._on_match, max_workers, max_pending_chunks, metrics=metrics, **chunk_processor_kwargs)
+        self.connections: dict[str, 'AudioServerProtocol'] = {}
+        self.rechunkers: dict[str, Rechunker] = {}
+        # Chunks received while the runner's queue for the connection was full, and connections paused because of them
+        self.backlogs: dict[str, deque[np.ndarray]] = {}
+        self.paused: set[str] = set()
+        self.match_listener = match_listener
+
+    def open(self, connection: 'AudioServerProtocol', handshake: IngestHandshake) -> tuple[str, int]:
+        '''
+        Register a connection from its handshake. Raises `ValueError` if the handshake is invalid.
+
+        ## Returns:
+
+        - (tuple[str, int]): source ID and chunk length for the connection
+        '''
+        sample_rate = handshake.get('sample_rate')
+        if not isinstance(sample_rate, int) or sample_rate <= 0:
+            raise ValueError(f'Invalid sample rate {sample_rate!r}')
+        format = handshake.get('format', 's16le')
+        if format not in SAMPLE_FORMATS:
+            raise ValueError(f'Unsupported sample format "{format}". Use one of {", ".join(SAMPLE_FORMATS)}.')
+        chunk_length = handshake.get('chunk_length', 2048)
+        if not isinstance(chunk_length, int) or chunk_length <= 0:
+            raise ValueError(f'Invalid chunk length {chunk_length!r}')
+        source_id = str(handshake.get('source_id', connection.peer))
+        if source_id in self.connections:
+            raise ValueError(f'Source "{source_id}" is already connected')
+
+        self.runner.add_source(source_id, sample_rate, chunk_length, drain_listener=lambda: reactor.callFromThread(self._forward, source_id)) # type: ignore
+        hop_length = self.runner.sources[source_id].chunk_processor.hop_length
+        self.connections[source_id] = connection
+        self.rechunkers[source_id] = Rechunker(hop_length, SAMPLE_FORMATS[format])
+        self.backlogs[source_id] = deque()
+        return source_id, hop_length
+
+    def feed(self, source_id: str, payload: bytes) -> None:
+        '''
+        Queue raw samples from a connection for analysis. Called on the reactor thread and never blocks.
+        '''
+        chunks = self.rechunkers[source_id].feed(payload)
+        if len(chunks) > 0:
+            self.backlogs[source_id].extend(chunks)
+            self._forward(source_id)
+
+    def close(self, source_id: str) -> None:
+        self.connections.pop(source_id, None)
+        self.rechunkers.pop(source_id, None)
+        self.backlogs.pop(source_id, None)
+        self.paused.discard(source_id)
+        if source_id in self.runner.sources:
+            self.runner.remove_source(source_id)
+
+    def _forward(self, source_id: str) -> None:
+        # Called on the reactor thread, when audio arrives and whenever the runner takes queued chunks. Only as many
+        # chunks as fit are pushed, so the runner never drops any, and the connection is paused while any are left.
+        backlog = self.backlogs.get(source_id)
+        if backlog is None:
+            return
+
+        n_chunks = min(len(backlog), self.runner.space(source_id))
+        if n_chunks > 0:
+            self.runner.push(source_id, np.stack([backlog.popleft() for _ in range(n_chunks)]))
+
+        if len(backlog) > 0 and source_id not in self.paused:
+            self.paused.add(source_id)
+            self.connections[source_id].pause_reading()
+        elif len(backlog) == 0 and source_id in self.paused:
+            self.paused.discard(source_id)
+            self.connections[source_id].resume_reading()
+
+    def _on_match(self, source_id: str, fingerprint_id: str) -> None:
+        if self.match_listener is not None:
+            self.match_listener(source_id, fingerprint_id)
+        frame = encode_match(fingerprint_id, time.time())
+        reactor.callFromThread(self._send_match, source_id, frame) # type: ignore
+
+    def _send_match(self, source_id: str, frame: bytes) -> None:
+        connection = self.connections.get(source_id)
+        if connection is not None:
+            connection.queue_match(frame)
@@ -0,0 +1,98 @@
+'''
+Example remote audio source. Streams .wav files to a detector's WebSocket server as if they were being captured live, one connection per file, and prints the matches sent back.
+
+Usage:
+
+```shell
+python -m beep_detect.web -f beep_detect/core/fingerprints.toml --ingest-only
+python -m beep_detect.web.replay data/*.wav --speed 4
+```
+'''
+import argparse
+import json
+import os
+import struct
+import sys
+import numpy as np
+
+from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol, connectWS
+from twisted.internet import reactor, task
+
+from beep_detect.core.wav_source import SAMPLE_DTYPE, WavSource
+from beep_detect.web.broadcast import FRAME_MATCH, HEADER
+from beep_detect.web.ingest import SAMPLE_FORMATS
+
+class ReplayClientProtocol(WebSocketClientProtocol):
+    def onOpen(self):
+        self.source = WavSource(self.factory.file_name)
+        self.samples_sent = 0
+        self.sender = None
+        format = next(k for k, v in SAMPLE_FORMATS.items() if np.dtype(v) == np.dtype(SAMPLE_DTYPE))
+        handshake = { 'sample_rate': self.source.sample_rate, 'format': format }
+        self.sendMessage(json.dumps({ 'ingest': handshake }).encode('utf8'))
+
+    def onMessage(self, payload, isBinary):
+        if not isBinary:
+            ready = json.loads(payload.decode('utf8'))['ready']
+            print(f'{ready["source_id"]}: streaming with {ready["chunk_length"]} samples per chunk', flush=True)
+            self._start_sending()
+        elif payload[0] == FRAME_MATCH:
+            length, = struct.unpack_from('<H', payload, HEADER.size)
+            fingerprint_id = payload[HEADER.size + 2:HEADER.size + 2 + length].decode('utf8')
+            print(f'{os.path.basename(self.factory.file_name)}: match for {fingerprint_id} after {self.samples_sent / self.source.sample_rate:.2f}s of audio sent', flush=True)
+
+    def onClose(self, wasClean, code, reason):
+        if self.sender is not None and self.sender.running:
+            self.sender.stop()
+        if reason:
+            print(f'{os.path.basename(self.factory.file_name)}: closed ({reason})', flush=True)
+        self.factory.done()
+
+    def _start_sending(self) -> None:
+        # Messages deliberately don't line up with chunks, to exercise re-chunking on the server
+        frames_per_message = self.factory.frames_per_message
+        messages = (chunk.tobytes() for _, block in self.source.iter_blocks(frames_per_message, block_chunks=16) for chunk in block)
+        interval_s = frames_per_message / self.source.sample_rate / self.factory.speed
+
+        def send_next():
+            message = next(messages, None)
+            if message is None:
+                self.sender.stop()
+                self.source.close()
+                reactor.callLater(self.factory.linger_s, self.sendClose) # type: ignore
+                return
+            self.sendMessage(message, isBinary=True)
+            self.samples_sent += frames_per_message
+
+        self.sender = task.LoopingCall(send_next)
+        self.sender.start(interval_s)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Stream .wav files to a beep detection server')
+    parser.add_argument('files', nargs='+', help='.wav files to stream, each over its own connection')
+    parser.add_argument('--url', default='ws://localhost:8080/ws')
+    parser.add_argument('--speed', type=float, default=1, help='Replay speed relative to real time')
+    parser.add_argument('--frames-per-message', type=int, default=1000, help='Number of samples in each message')
+    parser.add_argument('--linger-s', type=float, default=2, help='Seconds to wait for matches after the end of each file')
+    args = parser.parse_args(argv)
+
+    remaining = [len(args.files)]
+    def done():
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            reactor.stop() # type: ignore
+
+    for file_name in args.files:
+        factory = WebSocketClientFactory(args.url)
+        factory.protocol = ReplayClientProtocol
+        factory.file_name = file_name
+        factory.speed = args.speed
+        factory.frames_per_message = args.frames_per_message
+        factory.linger_s = args.linger_s
+        factory.done = done
+        connectWS(factory)
+
+    reactor.run() # type: ignore
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,22 +1,71 @@
-let val = 0;
+const FRAME_MATCH = 1;
+const FRAME_SPECTRUM = 2;
+const FRAME_PEAKS = 3;
+const HEADER_LENGTH = 9;
 
 const ws_path = "/ws";
 const wsUrl = new URL(ws_path, window.location.href);
 wsUrl.protocol = wsUrl.protocol.replace("http", "ws");
 
+const matchList = document.getElementById("matches");
+const peaksText = document.getElementById("peaks");
+const canvas = document.getElementById("spectrum");
+const context = canvas.getContext("2d");
+
+let subscribed = false;
+
 const ws = new WebSocket(wsUrl);
-ws.addEventListener("message", (ev) => console.log("message is ", ev.data));
+ws.binaryType = "arraybuffer";
+ws.addEventListener("open", () => subscribe(false));
+ws.addEventListener("message", (ev) => {
+  if (!(ev.data instanceof ArrayBuffer)) {
+    return;
+  }
 
-// setInterval(() => {
-//   ws.send(++val);
-// }, 1000);
+  // Every frame starts with its type (uint8) and time in seconds since the epoch (float64), little-endian
+  const view = new DataView(ev.data);
+  const type = view.getUint8(0);
+  const time = new Date(view.getFloat64(1, true) * 1e3);
+
+  if (type === FRAME_MATCH) {
+    const length = view.getUint16(HEADER_LENGTH, true);
+    const id = new TextDecoder().decode(new Uint8Array(ev.data, HEADER_LENGTH + 2, length));
+    const item = document.createElement("li");
+    item.innerText = `${time.toLocaleTimeString()}: ${id}`;
+    matchList.prepend(item);
+  } else if (type === FRAME_SPECTRUM) {
+    const hzPerBin = view.getFloat32(HEADER_LENGTH, true);
+    const nBins = view.getUint16(HEADER_LENGTH + 4, true);
+    drawSpectrum(new Uint8Array(ev.data, HEADER_LENGTH + 6, nBins), hzPerBin);
+  } else if (type === FRAME_PEAKS) {
+    const nPeaks = view.getUint16(HEADER_LENGTH, true);
+    const peaks = [];
+    for (let i = 0; i < nPeaks; i++) {
+      peaks.push(Math.round(view.getFloat32(HEADER_LENGTH + 2 + 4 * i, true)));
+    }
+    peaksText.innerText = `Peaks: ${peaks.join(", ")} Hz`;
+  }
+});
+
+function subscribe(withSpectrum) {
+  const topics = withSpectrum ? ["matches", "spectrum", "peaks"] : ["matches"];
+  ws.send(JSON.stringify({ subscribe: topics }));
+}
+
+function drawSpectrum(values, hzPerBin) {
+  const barWidth = canvas.width / values.length;
+  context.clearRect(0, 0, canvas.width, canvas.height);
+  values.forEach((db, i) => {
+    const height = (db / 160) * canvas.height;
+    context.fillRect(i * barWidth, canvas.height - height, barWidth, height);
+  });
+  canvas.title = `${Math.round(hzPerBin)} Hz per bar`;
+}
 
 const playButton = document.getElementById("playpause");
 
 playButton.addEventListener("click", () => {
-  if (playButton.innerText === "Play") {
-    playButton.innerText = "Pause";
-  } else {
-    playButton.innerText = "Play";
-  }
+  subscribed = !subscribed;
+  subscribe(subscribed);
+  playButton.innerText = subscribed ? "Pause" : "Play";
 });
@@ -1,33 +1,118 @@
+import json
+from collections import deque
+
 from autobahn.twisted.websocket import WebSocketServerProtocol
+from twisted.internet.interfaces import IPushProducer
+from twisted.logger import Logger
+from zope.interface import implementer
 
+# Topics a client can subscribe to
+TOPICS = ('matches', 'spectrum', 'peaks')
 
+@implementer(IPushProducer)
 class AudioServerProtocol(WebSocketServerProtocol):
-    connected_instances: list['AudioServerProtocol'] = []
+    '''
+    WebSocket connection to one dashboard or remote audio source. Clients receive match events by default, and can change their subscriptions by sending a text message such as `{"subscribe": ["matches", "spectrum"]}`. Frames are binary, see `beep_detect.web.broadcast`.
+
+    A client which sends an `ingest` handshake instead streams its own audio in binary messages, and receives only the matches detected in that audio. See `Ingestor`.
+
+    Each connection registers itself as a producer with its transport, so Twisted pauses it once its write buffer is full. While paused, spectra and peaks are coalesced to the latest frame of each kind and up to `max_pending_matches` matches are kept, so a slow client falls behind on its own without holding up the reactor or other clients.
+    '''
+    log = Logger()
+    max_pending_matches = 64
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.subscriptions: set[str] = { 'matches' }
+        self.pending_matches: deque[bytes] = deque(maxlen=self.max_pending_matches)
+        self.latest: dict[str, bytes] = {}
+        self.paused = False
+        self.source_id: str | None = None
 
     def onConnect(self, request):
-        self.connected_instances.append(self)
-        print("Client connecting: {}".format(request.peer))
-        print("There are ", len(self.connected_instances), " connected instances")
+        self.log.info('Client connecting: {peer}', peer=request.peer)
 
     def onOpen(self):
-        print("WebSocket connection open.")
+        # When served through a `WebSocketResource`, the HTTP channel which handled the upgrade is still registered
+        if getattr(self.transport, 'producer', None) is not None:
+            self.transport.unregisterProducer()
+        self.transport.registerProducer(self, True)
+        self.factory.broadcaster.add_client(self)
+        self.log.info('{n} clients connected', n=len(self.factory.broadcaster.clients))
 
     def onMessage(self, payload, isBinary):
         if isBinary:
-            print("Binary message received: {} bytes".format(len(payload)))
-        else:
-            print("Text message received: {}".format(payload.decode('utf8')))
+            if self.source_id is None:
+                self.sendClose(4000, 'Send an ingest handshake before audio')
+                return
+            self.factory.ingestor.feed(self.source_id, payload)
+            return
 
-        # echo back message verbatim
-        self.sendMessage(payload, isBinary)
+        try:
+            message = json.loads(payload.decode('utf8'))
+            if 'ingest' in message:
+                self._start_ingest(message['ingest'])
+            else:
+                subscriptions = set(message['subscribe'])
+                self.factory.broadcaster.update_subscriptions(self, subscriptions & set(TOPICS))
+        except (ValueError, KeyError, TypeError):
+            self.log.warn('Ignoring malformed message from client')
 
     def onClose(self, wasClean, code, reason):
-        self.connected_instances.remove(self)
-        print("WebSocket connection closed: {}".format(reason))
-
-    @classmethod
-    def sendMessageOnAllInstances(cls, payload):
-        print("There are ", len(cls.connected_instances), " connected instances")
-        for c in set(cls.connected_instances):
-            print('sending payload ', payload, ' to connection ', c.__hash__)
-            c.sendMessage(bytes(payload, encoding='utf8'))
\ No newline at end of file
+        self.factory.broadcaster.remove_client(self)
+        if self.source_id is not None:
+            self.factory.ingestor.close(self.source_id)
+        self.log.info('Client disconnected: {reason}', reason=reason)
+
+    def _start_ingest(self, handshake: dict) -> None:
+        if self.source_id is not None:
+            raise ValueError('Handshake already received')
+        try:
+            self.source_id, chunk_length = self.factory.ingestor.open(self, handshake)
+        except ValueError as e:
+            self.sendClose(4000, str(e))
+            return
+
+        # Audio sources receive only their own matches
+        self.factory.broadcaster.update_subscriptions(self, set())
+        self.sendMessage(json.dumps({ 'ready': { 'source_id': self.source_id, 'chunk_length': chunk_length } }).encode('utf8'))
+        self.log.info('Ingesting audio from "{source_id}" at {sample_rate}Hz', source_id=self.source_id, sample_rate=handshake['sample_rate'])
+
+    def pause_reading(self) -> None:
+        '''
+        Stop reading from the client, so that TCP flow control holds up the audio it sends until `resume_reading`
+        '''
+        self.transport.pauseProducing()
+
+    def resume_reading(self) -> None:
+        self.transport.resumeProducing()
+
+    def queue_match(self, frame: bytes) -> None:
+        self.pending_matches.append(frame)
+        self.flush()
+
+    def replace_latest(self, kind: str, frame: bytes) -> None:
+        self.latest[kind] = frame
+        self.flush()
+
+    def flush(self) -> None:
+        '''
+        Send queued frames until the transport asks this connection to pause
+        '''
+        while not self.paused and len(self.pending_matches) > 0:
+            self.sendMessage(self.pending_matches.popleft(), isBinary=True)
+        while not self.paused and len(self.latest) > 0:
+            _, frame = self.latest.popitem()
+            self.sendMessage(frame, isBinary=True)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.flush()
+
+    def stopProducing(self):
+        self.paused = True
+        self.pending_matches.clear()
+        self.latest.clear()
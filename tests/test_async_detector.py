@@ -0,0 +1,108 @@
+import asyncio
+import glob
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.async_detector import AsyncDetector, AsyncStreamSource, AsyncWavSource
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.wav_source import WavSource
+
+RECORDINGS = sorted(glob.glob(os.path.join(DATA_DIR, '*.wav')))
+CHUNK_LENGTH = 2048
+
+def file_matches(file_name: str) -> list:
+    runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, CHUNK_LENGTH)
+    try:
+        return list(runner.iter_matches())
+    finally:
+        runner.source.close()
+
+async def collect(detector: AsyncDetector, source) -> list:
+    return [match async for match in detector.matches(source)]
+
+class ClosingSource:
+    '''
+    Chunks of silence delivered one at a time until closed, recording whether the iterator was closed
+    '''
+
+    def __init__(self) -> None:
+        self.sample_rate = 16000
+        self.chunks_read = 0
+        self.closed = False
+
+    async def chunks(self, chunk_length: int, max_chunks: int):
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                self.chunks_read += 1
+                yield np.zeros((1, chunk_length), dtype=np.int16)
+        finally:
+            self.closed = True
+
+@pytest.mark.parametrize('file_name', RECORDINGS, ids=os.path.basename)
+@pytest.mark.parametrize('max_batch_chunks', [1, 16])
+def test_same_matches_as_file_input_runner(file_name, max_batch_chunks):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = file_matches(file_name)
+        detector = AsyncDetector(EXAMPLE_FINGERPRINTS, CHUNK_LENGTH, max_batch_chunks=max_batch_chunks)
+        matches = asyncio.run(collect(detector, AsyncWavSource(file_name)))
+    assert matches == expected
+
+def test_stream_source_has_same_matches_as_file_input_runner():
+    file_name = RECORDINGS[-1]
+    with WavSource(file_name) as source:
+        sample_rate = source.sample_rate
+        data = source.samples.tobytes()
+
+    async def stream() -> list:
+        # Pieces which split chunks and samples
+        reader = asyncio.StreamReader()
+        for start in range(0, len(data), 3001):
+            reader.feed_data(data[start:start + 3001])
+        reader.feed_eof()
+        return await collect(AsyncDetector(EXAMPLE_FINGERPRINTS, CHUNK_LENGTH), AsyncStreamSource(reader, sample_rate))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = file_matches(file_name)
+        matches = asyncio.run(stream())
+    assert len(expected) > 0
+    assert matches == expected
+
+def test_cancelling_closes_the_source():
+    source = ClosingSource()
+
+    async def cancel() -> None:
+        task = asyncio.create_task(collect(AsyncDetector(EXAMPLE_FINGERPRINTS, CHUNK_LENGTH), source))
+        while source.chunks_read < 5:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Closed as the cancellation propagated, not later when the iterator is garbage collected
+        assert source.closed
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        asyncio.run(cancel())
+
+def test_cancelling_closes_the_wav_file():
+    source = AsyncWavSource(RECORDINGS[0], speed=1)
+
+    async def cancel() -> None:
+        task = asyncio.create_task(collect(AsyncDetector(EXAMPLE_FINGERPRINTS, CHUNK_LENGTH), source))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert len(source.source.samples) == 0
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        asyncio.run(cancel())
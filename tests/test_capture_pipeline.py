@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+import warnings
+
+import numpy as np
+import pytest
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.capture_pipeline import CapturePipeline, WavReplayStream
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.wav_source import WavSource
+
+RECORDING = os.path.join(DATA_DIR, 'Microwave finish (fan background).wav')
+CHUNK_LENGTH = 2048
+
+class RecordingProcessor:
+    '''
+    Stand-in for a `ChunkProcessor` which keeps every chunk it is given, and can hold up analysis until released
+    '''
+
+    def __init__(self, hold: bool = False) -> None:
+        self.hop_length = CHUNK_LENGTH
+        self.metrics = None
+        self.chunks: list[np.ndarray] = []
+        self.batch_lengths: list[int] = []
+        self.analysing = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def analyse_chunk_for_match(self, chunk: np.ndarray) -> set[str]:
+        return self.analyse_chunks_for_matches(chunk[np.newaxis])[0]
+
+    def analyse_chunks_for_matches(self, chunks: np.ndarray) -> list[set[str]]:
+        self.batch_lengths.append(len(chunks))
+        self.analysing.set()
+        self.release.wait()
+        self.chunks.extend(chunks.copy())
+        return [set()] * len(chunks)
+
+def replay(pipeline: CapturePipeline) -> int:
+    '''
+    Replay the recording into a pipeline as fast as possible, returning the number of chunks delivered
+    '''
+    stream = WavReplayStream(RECORDING, CHUNK_LENGTH, lambda in_data, *_: pipeline.push(in_data), speed=float('inf'))
+    stream.start_stream()
+    stream._thread.join()
+    stream.close()
+    return stream.source.n_chunks(CHUNK_LENGTH)
+
+def recording_chunks() -> np.ndarray:
+    with WavSource(RECORDING) as source:
+        return np.concatenate([block for _, block in source.iter_blocks(CHUNK_LENGTH)])
+
+def wait_until(condition, timeout_s: float = 5) -> None:
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('Condition not reached')
+        time.sleep(0.005)
+
+def test_chunks_are_analysed_in_order():
+    processor = RecordingProcessor()
+    pipeline = CapturePipeline(processor, lambda id: None, capacity=4096) # type: ignore
+    pipeline.start()
+    n_chunks = replay(pipeline)
+    pipeline.stop()
+
+    assert pipeline.stats['chunks_processed'] == n_chunks
+    assert pipeline.stats['dropped_chunks'] == 0
+    assert np.array_equal(np.array(processor.chunks), recording_chunks())
+
+def test_matches_are_the_same_as_from_file():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        runner = FileInputRunner(EXAMPLE_FINGERPRINTS, RECORDING, CHUNK_LENGTH)
+        expected = [event['fingerprint_id'] for event in runner.iter_matches()]
+        runner.source.close()
+
+        matches = []
+        processor = ChunkProcessor(EXAMPLE_FINGERPRINTS, runner.input_sample_rate, CHUNK_LENGTH)
+        pipeline = CapturePipeline(processor, matches.append, capacity=4096)
+        pipeline.start()
+        replay(pipeline)
+        pipeline.stop()
+
+    assert len(expected) > 0
+    assert matches == expected
+
+def test_overflowing_chunks_are_counted():
+    processor = RecordingProcessor(hold=True)
+    pipeline = CapturePipeline(processor, lambda id: None, capacity=8, max_batch_chunks=2) # type: ignore
+    pipeline.start()
+    n_chunks = replay(pipeline)
+
+    # Slots are only freed once analysed, so only the first `capacity` chunks fit while analysis is held up
+    stats = pipeline.stats
+    assert stats['chunks_captured'] == n_chunks
+    assert stats['overruns'] == n_chunks - 8
+    assert stats['dropped_chunks'] == n_chunks - 8
+    assert stats['queue_depth'] == 8
+
+    processor.release.set()
+    pipeline.stop()
+    assert pipeline.stats['chunks_processed'] == 8
+    assert np.array_equal(np.array(processor.chunks), recording_chunks()[:8])
+
+@pytest.mark.parametrize('drain', [True, False])
+def test_stop(drain):
+    processor = RecordingProcessor(hold=True)
+    pipeline = CapturePipeline(processor, lambda id: None, capacity=8, max_batch_chunks=2) # type: ignore
+    pipeline.start()
+    replay(pipeline)
+    assert processor.analysing.wait(5)
+
+    # Stop while the worker is analysing its first batch
+    stopper = threading.Thread(target=pipeline.stop, kwargs={ 'drain': drain })
+    stopper.start()
+    wait_until(pipeline._stopping.is_set)
+    processor.release.set()
+    stopper.join()
+
+    # Without draining, only the batch being analysed is finished. The rest is discarded by the worker, so the
+    # buffer's read index is only ever advanced by its consumer.
+    assert processor.batch_lengths[0] < 8
+    n_processed = 8 if drain else processor.batch_lengths[0]
+    assert pipeline.stats['chunks_processed'] == n_processed
+    assert pipeline.stats['queue_depth'] == 0
+    assert np.array_equal(np.array(processor.chunks), recording_chunks()[:n_processed])
+
+class MatchingProcessor(RecordingProcessor):
+    '''
+    Stand-in for a `ChunkProcessor` which matches every chunk
+    '''
+
+    def analyse_chunks_for_matches(self, chunks: np.ndarray) -> list[set[str]]:
+        super().analyse_chunks_for_matches(chunks)
+        return [{ 'beep' }] * len(chunks)
+
+def test_pipeline_can_be_restarted():
+    processor = MatchingProcessor()
+    matches = []
+    pipeline = CapturePipeline(processor, matches.append, capacity=4096) # type: ignore
+    n_chunks = 0
+    for _ in range(2):
+        pipeline.start()
+        n_chunks += replay(pipeline)
+        pipeline.stop()
+
+    assert pipeline.stats['chunks_processed'] == n_chunks
+    assert matches == ['beep'] * n_chunks
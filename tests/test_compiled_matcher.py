@@ -0,0 +1,183 @@
+import glob
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.types import FingerprintInMs
+
+RECORDINGS = sorted(glob.glob(os.path.join(DATA_DIR, '*.wav')))
+
+SAMPLE_RATE = 8000
+CHUNK_LENGTH = 256 # 32ms chunks and 31.25Hz bins
+
+# Short fingerprints which share frequencies and overlap in time, so that random peaks complete and reset them often
+OVERLAPPING_FINGERPRINTS: dict[str, FingerprintInMs] = {
+    'short': {
+        'repetitions': 3,
+        'max_period_ms': 320,
+        'pattern': [
+            { 'type': 'sine', 'frequency': 1000, 'start_ms': 0, 'end_ms': 96 },
+            { 'type': 'any', 'start_ms': 97, 'end_ms': 160 }
+        ]
+    },
+    'long': {
+        'repetitions': 2,
+        'max_period_ms': 256,
+        'pattern': [
+            { 'type': 'sine', 'frequency': 1000, 'start_ms': 0, 'end_ms': 160 }
+        ]
+    },
+    'chord': {
+        'repetitions': 2,
+        'max_period_ms': 400,
+        'pattern': [
+            { 'type': 'sine', 'frequency': 1500, 'start_ms': 0, 'end_ms': 96 },
+            { 'type': 'sine', 'frequency': 2000, 'start_ms': 0, 'end_ms': 96 },
+            { 'type': 'any', 'start_ms': 97, 'end_ms': 128 }
+        ]
+    },
+    'rising': {
+        'repetitions': 2,
+        'max_period_ms': 300,
+        'pattern': [
+            { 'type': 'sine', 'frequency': 2000, 'start_ms': 0, 'end_ms': 64 },
+            { 'type': 'sine', 'frequency': 1000, 'start_ms': 65, 'end_ms': 128 }
+        ]
+    }
+}
+
+class ReferenceMatcher:
+    '''
+    The original matcher, kept independent of both matchers under test: every peak's frequency is compared with every
+    expected frequency of the current chunk using `np.isclose`
+    '''
+
+    def __init__(self, processor: ChunkProcessor) -> None:
+        self.frequency_bands = processor.frequency_bands
+        self.chunkmaps = processor.chunkmaps
+        self.repetitions = { k: fingerprint['repetitions'] for k, fingerprint in processor.fingerprints.items() }
+        self.tolerance_f = processor.tolerance_f
+        self.tolerance_t = processor.tolerance_t
+        self.match_state = {
+            k: { 'chunk': 0, 'repetition': 0, 'chunks_since_last_repetition': 0, 'accumulated_errors': 0 }
+            for k in self.chunkmaps
+        }
+
+    def matches_chunk(self, expected_freqs: list[float], freq_peaks: list[float]) -> bool:
+        if len(expected_freqs) == 0:
+            return True
+        matched_freqs = 0
+        for actual_freq in freq_peaks:
+            for expected_freq in expected_freqs:
+                if np.isclose(actual_freq, expected_freq, rtol=self.tolerance_f):
+                    matched_freqs += 1
+                    if matched_freqs == len(expected_freqs):
+                        return True
+        return False
+
+    def match_peaks(self, freq_peaks_i: np.ndarray) -> set[str]:
+        freq_peaks = [self.frequency_bands[peak] for peak in freq_peaks_i]
+        matches = set()
+        for k, state in self.match_state.items():
+            freqs_by_chunk = self.chunkmaps[k]['frequencies_to_match_by_chunk']
+            matched = self.matches_chunk(freqs_by_chunk[state['chunk']], freq_peaks)
+            missed_within_tolerance = not matched and state['chunk'] > 0 and state['accumulated_errors'] < self.tolerance_t
+            if missed_within_tolerance:
+                state['accumulated_errors'] += 1
+            if matched:
+                state['accumulated_errors'] = 0
+
+            if matched or missed_within_tolerance:
+                if state['chunk'] >= len(freqs_by_chunk) - 1:
+                    state.update(chunk=0, repetition=state['repetition'] + 1, chunks_since_last_repetition=0, accumulated_errors=0)
+                else:
+                    state['chunk'] += 1
+                    state['chunks_since_last_repetition'] += 1
+            elif state['repetition'] > 0 and state['chunks_since_last_repetition'] <= self.chunkmaps[k]['max_period_chunks']:
+                state.update(chunk=0, chunks_since_last_repetition=state['chunks_since_last_repetition'] + 1, accumulated_errors=0)
+            else:
+                state.update(chunk=0, repetition=0, chunks_since_last_repetition=0, accumulated_errors=0)
+
+            if state['repetition'] == self.repetitions[k]:
+                matches.add(k)
+                state.update(chunk=0, repetition=0, chunks_since_last_repetition=0, accumulated_errors=0)
+        return matches
+
+def random_peak_sequence(processor: ChunkProcessor, rng: np.random.Generator, n_segments: int) -> list[np.ndarray]:
+    '''
+    Peaks for a sequence of chunks: repetitions of the fingerprints with chunks dropped, frequencies a bin off, and
+    random peaks added, separated by gaps long enough for `max_period` to expire or not
+    '''
+    bands = processor.frequency_bands
+    def bins(freqs):
+        return [int(np.argmin(np.abs(bands - f))) + int(rng.integers(-1, 2)) for f in freqs]
+
+    keys = list(processor.chunkmaps.keys())
+    sequence = []
+    for _ in range(n_segments):
+        kind = rng.random()
+        if kind < 0.6:
+            chunkmap = processor.chunkmaps[keys[rng.integers(len(keys))]]
+            for freqs in chunkmap['frequencies_to_match_by_chunk']:
+                if rng.random() < 0.1:
+                    sequence.append([])
+                else:
+                    sequence.append(bins(freqs) + list(rng.integers(0, len(bands) - 1, rng.integers(0, 3))))
+        elif kind < 0.8:
+            sequence.extend([] for _ in range(rng.integers(1, 16)))
+        else:
+            sequence.extend(list(rng.integers(0, len(bands) - 1, rng.integers(0, 6))) for _ in range(rng.integers(1, 4)))
+    return [np.unique(np.asarray(peaks, dtype=np.intp)) for peaks in sequence]
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('tolerance_t_ms', [0, 32, 64])
+def test_same_matches_for_random_peaks(seed, tolerance_t_ms):
+    processors = {
+        matcher: ChunkProcessor(OVERLAPPING_FINGERPRINTS, SAMPLE_RATE, CHUNK_LENGTH, tolerance_t_ms=tolerance_t_ms, matcher=matcher)
+        for matcher in ('dict', 'compiled')
+    }
+    reference = ReferenceMatcher(processors['dict'])
+    sequence = random_peak_sequence(processors['dict'], np.random.default_rng(seed), 400)
+
+    n_matches = 0
+    for i_chunk, peaks in enumerate(sequence):
+        expected = reference.match_peaks(peaks)
+        for matcher, processor in processors.items():
+            assert processor._match_peaks(peaks) == expected, f'{matcher} matcher, chunk {i_chunk}'
+            assert processor.get_match_state() == reference.match_state, f'{matcher} matcher, chunk {i_chunk}'
+        n_matches += len(expected)
+
+    # Otherwise the sequence exercised nothing
+    assert n_matches > 0
+
+@pytest.mark.parametrize('file_name', RECORDINGS, ids=os.path.basename)
+@pytest.mark.parametrize('settings', [{}, { 'spectrum_backend': 'targeted' }, { 'hop_length': 1024, 'window': 'hann' }], ids=str)
+def test_same_matches_for_recordings(file_name, settings):
+    matches = {}
+    peaks_by_chunk = []
+    for matcher in ('dict', 'compiled'):
+        # Keep the peaks found in every chunk to replay them through the reference
+        def spectrum_listener(freq_db, freq_peaks_i):
+            if matcher == 'dict':
+                peaks_by_chunk.append(np.array(freq_peaks_i))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, matcher=matcher, spectrum_listener=spectrum_listener, **settings)
+            try:
+                matches[matcher] = list(runner.iter_matches())
+            finally:
+                runner.source.close()
+        if matcher == 'dict':
+            reference = ReferenceMatcher(runner.chunk_processor)
+
+    expected = [id for peaks in peaks_by_chunk for id in sorted(reference.match_peaks(peaks))]
+    assert len(expected) > 0
+    for matcher in ('dict', 'compiled'):
+        assert [event['fingerprint_id'] for event in matches[matcher]] == expected, matcher
+    assert matches['compiled'] == matches['dict']
@@ -0,0 +1,35 @@
+import pytest
+
+from beep_detect.core.fingerprint_config import parse_fingerprints, validate_fingerprints
+
+def fingerprint_with_sections(*sections) -> dict:
+    return {
+        'beep': {
+            'repetitions': 2,
+            'max_period_ms': 1000,
+            'pattern': [
+                { 'type': 'sine', 'frequency': 1000, 'start_ms': 0, 'end_ms': 100 },
+                *sections
+            ]
+        }
+    }
+
+@pytest.mark.parametrize('field', ['start_ms', 'end_ms'])
+def test_section_missing_times_is_reported(field):
+    section = { 'type': 'any', 'start_ms': 101, 'end_ms': 200 }
+    del section[field]
+    with pytest.raises(ValueError, match=f'Fingerprint "beep" section 1 is missing "{field}"'):
+        validate_fingerprints(fingerprint_with_sections(section)) # type: ignore
+
+@pytest.mark.parametrize('section, message', [
+    ({ 'type': 'square', 'start_ms': 101, 'end_ms': 200 }, 'section 1 has unrecognised type "square"'),
+    ({ 'type': 'sine', 'start_ms': 101, 'end_ms': 200 }, 'section 1 is a sine section without "frequency"'),
+    ({ 'type': 'any', 'start_ms': 200, 'end_ms': 101 }, 'section 1 ends before it starts')
+], ids=['type', 'frequency', 'order'])
+def test_invalid_sections_are_reported(section, message):
+    with pytest.raises(ValueError, match=message):
+        validate_fingerprints(fingerprint_with_sections(section)) # type: ignore
+
+def test_valid_fingerprints_are_parsed():
+    data = b'{"beep": {"repetitions": 2, "max_period_ms": 1000, "pattern": [{"type": "sine", "frequency": 1000, "start_ms": 0, "end_ms": 100}]}}'
+    assert parse_fingerprints(data, 'fingerprints.json') == fingerprint_with_sections()
@@ -0,0 +1,178 @@
+import os
+import queue
+import struct
+import warnings
+
+import numpy as np
+import pytest
+
+import beep_detect.web.ingest
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.rechunker import Rechunker
+from beep_detect.core.wav_source import WavSource
+from beep_detect.web.broadcast import FRAME_MATCH, HEADER
+from beep_detect.web.ingest import SAMPLE_FORMATS, Ingestor
+
+RECORDING = os.path.join(DATA_DIR, 'Microwave finish (fan background).wav')
+CHUNK_LENGTH = 2048
+
+class FakeReactor:
+    '''
+    Stand-in for the Twisted reactor. Calls from worker threads are queued, and run on the test thread by `run_pending`.
+    '''
+
+    def __init__(self) -> None:
+        self.calls: queue.Queue = queue.Queue()
+
+    def callFromThread(self, f, *args) -> None:
+        self.calls.put((f, args))
+
+    def run_pending(self, timeout_s: float | None = None) -> None:
+        '''
+        Run queued calls, waiting up to `timeout_s` for the first one if given
+        '''
+        try:
+            f, args = self.calls.get(timeout=timeout_s) if timeout_s is not None else self.calls.get_nowait()
+        except queue.Empty:
+            return
+        f(*args)
+        while not self.calls.empty():
+            f, args = self.calls.get_nowait()
+            f(*args)
+
+class FakeConnection:
+    def __init__(self, peer: str = 'tcp:127.0.0.1:1234') -> None:
+        self.peer = peer
+        self.reading = True
+        self.pauses = 0
+        self.frames: list[bytes] = []
+
+    def pause_reading(self) -> None:
+        assert self.reading
+        self.reading = False
+        self.pauses += 1
+
+    def resume_reading(self) -> None:
+        assert not self.reading
+        self.reading = True
+
+    def queue_match(self, frame: bytes) -> None:
+        self.frames.append(frame)
+
+def decode_match(frame: bytes) -> str:
+    kind, _ = HEADER.unpack_from(frame)
+    assert kind == FRAME_MATCH
+    (length,) = struct.unpack_from('<H', frame, HEADER.size)
+    return frame[HEADER.size + 2:HEADER.size + 2 + length].decode('utf-8')
+
+def split_randomly(data: bytes, rng: np.random.Generator, max_length: int) -> list[bytes]:
+    boundaries = np.cumsum(rng.integers(1, max_length, len(data) // max(max_length // 2, 1) + 1))
+    boundaries = boundaries[boundaries < len(data)]
+    return [data[start:end] for start, end in zip([0, *boundaries], [*boundaries, len(data)])]
+
+@pytest.fixture
+def reactor(monkeypatch):
+    fake = FakeReactor()
+    monkeypatch.setattr(beep_detect.web.ingest, 'reactor', fake)
+    return fake
+
+@pytest.mark.parametrize('format', list(SAMPLE_FORMATS))
+def test_rechunker_reassembles_chunks_split_across_messages(format):
+    rng = np.random.default_rng(0)
+    dtype = np.dtype(SAMPLE_FORMATS[format])
+    if dtype.kind == 'f':
+        samples = rng.uniform(-1, 1, 10 * 256 + 100).astype(dtype)
+    else:
+        info = np.iinfo(dtype)
+        samples = rng.integers(info.min, info.max, 10 * 256 + 100, endpoint=True).astype(dtype)
+
+    # Messages split mid-sample, and many are shorter than a chunk
+    rechunker = Rechunker(256, dtype)
+    chunks = [rechunker.feed(message) for message in split_randomly(samples.tobytes(), rng, 700)]
+    assert all(chunk.shape[1:] == (256,) for chunk in chunks)
+    assert np.array_equal(np.concatenate(chunks), samples[:10 * 256].reshape(10, 256))
+    assert rechunker.pending_bytes == 100 * dtype.itemsize
+
+@pytest.mark.parametrize('handshake', [
+    {},
+    { 'sample_rate': 0 },
+    { 'sample_rate': 16000.5 },
+    { 'sample_rate': 16000, 'format': 's24le' },
+    { 'sample_rate': 16000, 'chunk_length': 0 },
+    { 'sample_rate': 16000, 'chunk_length': '2048' }
+], ids=str)
+def test_invalid_handshakes_are_rejected(reactor, handshake):
+    ingestor = Ingestor(EXAMPLE_FINGERPRINTS)
+    try:
+        with pytest.raises(ValueError):
+            ingestor.open(FakeConnection(), handshake) # type: ignore
+        assert len(ingestor.runner.sources) == 0
+    finally:
+        ingestor.runner.close()
+
+def test_duplicate_source_is_rejected(reactor):
+    ingestor = Ingestor(EXAMPLE_FINGERPRINTS)
+    try:
+        ingestor.open(FakeConnection(), { 'sample_rate': 16000, 'source_id': 'kitchen' }) # type: ignore
+        with pytest.raises(ValueError):
+            ingestor.open(FakeConnection(), { 'sample_rate': 16000, 'source_id': 'kitchen' }) # type: ignore
+    finally:
+        ingestor.runner.close()
+
+def test_no_audio_is_dropped_when_pipeline_is_full(reactor):
+    with WavSource(RECORDING) as source:
+        sample_rate = source.sample_rate
+        samples = np.concatenate([block.ravel() for _, block in source.iter_blocks(CHUNK_LENGTH)])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        runner = FileInputRunner(EXAMPLE_FINGERPRINTS, RECORDING, CHUNK_LENGTH)
+        expected = [event['fingerprint_id'] for event in runner.iter_matches()]
+        runner.source.close()
+    assert len(expected) > 0
+
+    listened = []
+    ingestor = Ingestor(EXAMPLE_FINGERPRINTS, max_workers=2, max_pending_chunks=4, match_listener=lambda source_id, id: listened.append(id))
+    connection = FakeConnection()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            source_id, chunk_length = ingestor.open(connection, { 'sample_rate': sample_rate, 'format': 's16le', 'chunk_length': CHUNK_LENGTH }) # type: ignore
+            assert chunk_length == CHUNK_LENGTH
+
+            # Messages arrive far faster than they are analysed. Like a transport, stop delivering while reading is
+            # paused, and run calls from the workers as the reactor would.
+            for message in split_randomly(samples.astype('<i2').tobytes(), np.random.default_rng(0), 3 * CHUNK_LENGTH * 2):
+                while not connection.reading:
+                    reactor.run_pending(timeout_s=5)
+                ingestor.feed(source_id, message)
+                reactor.run_pending()
+            while not connection.reading:
+                reactor.run_pending(timeout_s=5)
+            ingestor.runner.wait_until_idle()
+            reactor.run_pending()
+        assert ingestor.runner.stats[source_id]['dropped_chunks'] == 0
+    finally:
+        ingestor.close(source_id)
+        ingestor.runner.close()
+
+    assert connection.pauses > 0
+    assert listened == expected
+    assert [decode_match(frame) for frame in connection.frames] == expected
+
+def test_closed_connection_is_not_resumed(reactor):
+    ingestor = Ingestor(EXAMPLE_FINGERPRINTS, max_pending_chunks=1)
+    connection = FakeConnection()
+    try:
+        source_id, chunk_length = ingestor.open(connection, { 'sample_rate': 16000 }) # type: ignore
+        with ingestor.runner.sources[source_id].condition:
+            # Hold up the worker so that the second chunk has to wait in the backlog
+            ingestor.feed(source_id, np.zeros(3 * chunk_length, dtype='<i2').tobytes())
+            assert not connection.reading
+        ingestor.close(source_id)
+        ingestor.runner.wait_until_idle()
+        reactor.run_pending()
+    finally:
+        ingestor.runner.close()
+    assert not connection.reading
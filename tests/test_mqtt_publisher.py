@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+
+import pytest
+
+from beep_detect.core.mqtt_publisher import InProcessBroker, MqttPublisher
+
+def wait_until(condition, timeout_s: float = 5) -> None:
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('Condition not reached')
+        time.sleep(0.005)
+
+def received_ids(broker: InProcessBroker) -> list[str]:
+    return [json.loads(payload)['fingerprint_id'] for _, payload, _, _ in broker.messages]
+
+def create_publisher(broker: InProcessBroker, **kwargs) -> MqttPublisher:
+    return MqttPublisher(client_factory=broker.connect, min_backoff_s=0.01, max_backoff_s=0.05, **kwargs)
+
+def test_queued_events_are_published_in_order_after_reconnect():
+    broker = InProcessBroker()
+    publisher = create_publisher(broker, batch_size=4)
+    publisher.start()
+    for i in range(5):
+        publisher.publish_match(f'event_{i}')
+    wait_until(lambda: len(broker.messages) == 5)
+
+    broker.set_online(False)
+    for i in range(5, 20):
+        publisher.publish_match(f'event_{i}')
+    wait_until(lambda: publisher.failed_batches > 0)
+    assert len(broker.messages) == 5
+
+    broker.set_online(True)
+    publisher.stop(flush_timeout_s=5)
+    assert received_ids(broker) == [f'event_{i}' for i in range(20)]
+    assert broker.connects == 2
+    assert publisher.stats['dropped'] == 0
+
+def test_oldest_events_are_dropped_when_queue_overflows():
+    broker = InProcessBroker()
+    broker.set_online(False)
+    publisher = create_publisher(broker, max_queue=5)
+    publisher.start()
+    for i in range(8):
+        publisher.publish_match(f'event_{i}')
+    assert publisher.stats['queue_depth'] == 5
+    assert publisher.stats['dropped'] == 3
+
+    broker.set_online(True)
+    publisher.stop(flush_timeout_s=5)
+    assert received_ids(broker) == [f'event_{i}' for i in range(3, 8)]
+
+@pytest.mark.parametrize('qos', [0, 1, 2])
+@pytest.mark.parametrize('retain', [False, True])
+def test_qos_and_retain_are_applied(qos, retain):
+    broker = InProcessBroker()
+    publisher = create_publisher(broker, qos=qos, retain=retain, topic_prefix='home')
+    publisher.start()
+    publisher.publish_match('washing', source_id='laundry')
+    publisher.publish_match('microwave')
+    publisher.stop(flush_timeout_s=5)
+    assert [(topic, message_qos, message_retain) for topic, _, message_qos, message_retain in broker.messages] == [
+        ('home/laundry/washing', qos, retain),
+        ('home/microwave', qos, retain)
+    ]
+
+def test_invalid_qos_is_rejected():
+    with pytest.raises(ValueError):
+        MqttPublisher(qos=3, client_factory=InProcessBroker().connect)
+
+class StalledConnection:
+    '''
+    Connection whose first publish hangs until released, as on a broker which stops responding
+    '''
+
+    def __init__(self) -> None:
+        self.stalled = threading.Event()
+        self.release = threading.Event()
+
+    def publish_batch(self, messages, qos, retain, timeout_s) -> None:
+        self.stalled.set()
+        self.release.wait()
+        raise ConnectionResetError('Broker stopped responding')
+
+    def close(self) -> None:
+        pass
+
+def test_publish_match_never_blocks_the_caller():
+    connection = StalledConnection()
+    broker = InProcessBroker()
+    connections = iter([connection])
+    publisher = MqttPublisher(client_factory=lambda: next(connections, None) or broker.connect(), max_queue=100, min_backoff_s=0.01)
+    publisher.start()
+    publisher.publish_match('event_0')
+    assert connection.stalled.wait(5)
+
+    # The worker is stuck in the network call, but a detector thread queueing matches must never wait for it
+    worst_s = 0.
+    for i in range(1, 1000):
+        start_time = time.perf_counter()
+        publisher.publish_match(f'event_{i}')
+        worst_s = max(worst_s, time.perf_counter() - start_time)
+    assert worst_s < 0.05
+    # event_0 is held by the stalled batch, and the oldest of the rest are dropped
+    assert publisher.stats['dropped'] == 899
+
+    # When the stalled batch fails, the queue is already full of newer events
+    connection.release.set()
+    publisher.stop(flush_timeout_s=5)
+    assert publisher.stats['dropped'] == 900
+    assert received_ids(broker) == [f'event_{i}' for i in range(900, 1000)]
+
+def test_ids_are_escaped_in_topics():
+    broker = InProcessBroker()
+    publisher = create_publisher(broker, topic_prefix='home')
+    publisher.start()
+    publisher.publish_match('beep+boop#1', source_id='kitchen/left')
+    publisher.publish_match('100%')
+    publisher.stop(flush_timeout_s=5)
+    assert [topic for topic, _, _, _ in broker.messages] == ['home/kitchen%2Fleft/beep%2Bboop%231', 'home/100%25']
+    assert received_ids(broker) == ['beep+boop#1', '100%']
+
+class RejectingConnection:
+    '''
+    Connection which fails with an error other than a lost connection on messages whose topic contains "bad"
+    '''
+
+    def __init__(self, broker: InProcessBroker) -> None:
+        self.connection = broker.connect()
+
+    def publish_batch(self, messages, qos, retain, timeout_s) -> None:
+        if any('bad' in topic for topic, _ in messages):
+            raise ValueError('Invalid topic')
+        self.connection.publish_batch(messages, qos, retain, timeout_s)
+
+    def close(self) -> None:
+        pass
+
+def test_unexpected_errors_drop_only_the_events_at_fault(caplog):
+    broker = InProcessBroker()
+    publisher = MqttPublisher(client_factory=lambda: RejectingConnection(broker), batch_size=8, min_backoff_s=0.01)
+    publisher.start()
+    for fingerprint_id in ['event_0', 'bad_1', 'event_2', 'bad_3']:
+        publisher.publish_match(fingerprint_id)
+    wait_until(lambda: publisher.stats['dropped'] == 2)
+
+    # The worker carries on publishing on the same connection
+    publisher.publish_match('event_4')
+    publisher.stop(flush_timeout_s=5)
+    assert received_ids(broker) == ['event_0', 'event_2', 'event_4']
+    assert publisher.stats['connects'] == 1
+    assert sum('Dropping MQTT event' in record.getMessage() for record in caplog.records) == 2
+
+def test_unexpected_connect_errors_are_retried():
+    broker = InProcessBroker()
+    failures = iter([RuntimeError('No network yet'), RuntimeError('No network yet')])
+    def connect():
+        failure = next(failures, None)
+        if failure is not None:
+            raise failure
+        return broker.connect()
+
+    publisher = MqttPublisher(client_factory=connect, min_backoff_s=0.01)
+    publisher.start()
+    publisher.publish_match('event_0')
+    publisher.stop(flush_timeout_s=5)
+    assert received_ids(broker) == ['event_0']
@@ -0,0 +1,89 @@
+import glob
+import json
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.multi_resolution import Decimator, MultiResolutionProcessor
+from beep_detect.core.wav_source import WavSource
+
+RECORDINGS = sorted(glob.glob(os.path.join(DATA_DIR, '*.wav')))
+CHUNK_LENGTH = 2048
+
+def recording_chunks(file_name: str) -> tuple[np.ndarray, int]:
+    with WavSource(file_name) as source:
+        return np.concatenate([block for _, block in source.iter_blocks(CHUNK_LENGTH)]), source.sample_rate
+
+def find_matches(file_name: str, multi_resolution: bool, batch: bool, **settings) -> list:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, CHUNK_LENGTH, multi_resolution=multi_resolution, **settings)
+        try:
+            return list(runner.iter_matches(batch=batch))
+        finally:
+            runner.source.close()
+
+@pytest.mark.parametrize('file_name', RECORDINGS, ids=os.path.basename)
+@pytest.mark.parametrize('settings', [{}, { 'matcher': 'compiled' }, { 'spectrum_backend': 'targeted' }], ids=str)
+@pytest.mark.parametrize('batch', [True, False], ids=['batch', 'per_chunk'])
+def test_same_matches_as_chunk_processor(file_name, settings, batch):
+    # The bundled fingerprints are each analysed from a decimated stream, with chunks as long as the input chunks. A
+    # window is needed for their spectra to agree, see `MultiResolutionProcessor`.
+    expected = find_matches(file_name, False, batch, window='hann', **settings)
+    matches = find_matches(file_name, True, batch, window='hann', **settings)
+    assert len(expected) > 0
+    assert [event['fingerprint_id'] for event in matches] == [event['fingerprint_id'] for event in expected]
+
+    # Each is reported in the next input chunk, once the decimation filter has the samples after the chunk
+    with WavSource(file_name) as source:
+        chunk_s = CHUNK_LENGTH / source.sample_rate
+    for event, expected_event in zip(matches, expected):
+        assert event['t'] == pytest.approx(expected_event['t'] + chunk_s)
+
+def test_decimated_chunks_are_aligned_with_input_chunks():
+    # A decimated tone well below the decimated Nyquist frequency is the tone sampled at every 4th input sample, up to
+    # the passband ripple of the filter. Being one input sample out would be 50 out.
+    t = np.arange(48000) / 48000
+    tone = 1000 * np.sin(2 * np.pi * 440 * t)
+    decimator = Decimator(4)
+    decimated = np.concatenate([decimator.process(block) for block in np.split(tone, 10)])
+    assert len(decimated) == len(tone) // 4 - decimator.delay // 4
+    np.testing.assert_allclose(decimated[100:], tone[::4][100:len(decimated)], atol=5)
+
+def test_state_can_be_restored():
+    chunks, sample_rate = recording_chunks(RECORDINGS[-1])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        processor = MultiResolutionProcessor(EXAMPLE_FINGERPRINTS, sample_rate, CHUNK_LENGTH, window='hann')
+        expected = processor.analyse_chunks_for_matches(chunks)
+        assert any(expected)
+
+        # Split where matches are in progress and the groups have decimated samples left over
+        split = 301
+        first = MultiResolutionProcessor(EXAMPLE_FINGERPRINTS, sample_rate, CHUNK_LENGTH, window='hann')
+        matches = first.analyse_chunks_for_matches(chunks[:split])
+        state = json.loads(json.dumps(first.get_state()))
+        second = MultiResolutionProcessor(EXAMPLE_FINGERPRINTS, sample_rate, CHUNK_LENGTH, window='hann')
+        second.set_state(state)
+        matches += second.analyse_chunks_for_matches(chunks[split:])
+    assert matches == expected
+
+def test_spectrum_listener_is_rejected():
+    with pytest.raises(ValueError):
+        MultiResolutionProcessor(EXAMPLE_FINGERPRINTS, 48000, CHUNK_LENGTH, spectrum_listener=lambda spectrum, peaks: None)
+
+def test_window_defaults_to_hann_when_decimated():
+    processor = MultiResolutionProcessor(EXAMPLE_FINGERPRINTS, 48000, CHUNK_LENGTH)
+    assert any(group.decimation > 1 for group in processor.groups)
+    assert all(group.chunk_processor.window == 'hann' for group in processor.groups)
+
+    # Unless asked for no window, or nothing is decimated
+    processor = MultiResolutionProcessor(EXAMPLE_FINGERPRINTS, 48000, CHUNK_LENGTH, window='boxcar')
+    assert all(group.chunk_processor.window == 'boxcar' for group in processor.groups)
+    processor = MultiResolutionProcessor(EXAMPLE_FINGERPRINTS, 48000, CHUNK_LENGTH, max_decimation=1)
+    assert all(group.chunk_processor.window is None for group in processor.groups)
@@ -0,0 +1,169 @@
+import glob
+import os
+import threading
+import time
+import warnings
+
+import numpy as np
+import pytest
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.metrics import Metrics
+from beep_detect.core.multi_source_runner import MultiSourceRunner
+
+RECORDINGS = sorted(glob.glob(os.path.join(DATA_DIR, '*.wav')))
+CHUNK_LENGTH = 2048
+
+class RecordingProcessor:
+    '''
+    Stand-in for a `ChunkProcessor` which keeps the first sample of every chunk it is given, and can hold up analysis until released
+    '''
+
+    def __init__(self, hold: bool = False) -> None:
+        self.metrics = None
+        self.first_samples: list[int] = []
+        self.analysing = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def analyse_chunks_for_matches(self, chunks: np.ndarray, with_lock: bool = True) -> list[set[str]]:
+        self.analysing.set()
+        self.release.wait()
+        # Give other sources' tasks a chance to interleave
+        time.sleep(0.001)
+        self.first_samples.extend(int(sample) for sample in chunks[:, 0])
+        return [set()] * len(chunks)
+
+def add_recording_source(runner: MultiSourceRunner, source_id: str, hold: bool = False) -> RecordingProcessor:
+    runner.add_source(source_id, 16000, 16)
+    processor = RecordingProcessor(hold)
+    runner.sources[source_id].chunk_processor = processor # type: ignore
+    return processor
+
+def numbered_chunks(n_chunks: int) -> np.ndarray:
+    return np.repeat(np.arange(n_chunks)[:, np.newaxis], 16, axis=1)
+
+def test_sources_are_isolated():
+    # Every recording at once, with each file's matches reported as if it were analysed on its own
+    expected = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for file_name in RECORDINGS:
+            runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, CHUNK_LENGTH)
+            expected[os.path.basename(file_name)] = [event['fingerprint_id'] for event in runner.iter_matches()]
+            runner.source.close()
+    assert any(expected.values())
+
+    matches = { source_id: [] for source_id in expected }
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        with MultiSourceRunner(EXAMPLE_FINGERPRINTS, lambda source_id, id: matches[source_id].append(id), max_workers=4, max_pending_chunks=8) as runner:
+            runner.run_wav_files({ os.path.basename(file_name): file_name for file_name in RECORDINGS }, CHUNK_LENGTH, block_chunks=5)
+            stats = runner.stats
+
+    assert matches == expected
+    assert all(source_stats['dropped_chunks'] == 0 for source_stats in stats.values())
+
+def test_chunks_are_analysed_in_order_for_each_source():
+    with MultiSourceRunner(EXAMPLE_FINGERPRINTS, lambda source_id, id: None, max_workers=4, max_pending_chunks=5) as runner:
+        processors = { f'source_{i}': add_recording_source(runner, f'source_{i}') for i in range(6) }
+
+        # One producer per source, with blocks of varied sizes including some larger than the queue
+        def produce(source_id: str, seed: int) -> None:
+            rng = np.random.default_rng(seed)
+            chunks = numbered_chunks(300)
+            while len(chunks) > 0:
+                n_chunks = int(rng.integers(1, 9))
+                runner.push(source_id, chunks[:n_chunks], block=True)
+                chunks = chunks[n_chunks:]
+
+        producers = [threading.Thread(target=produce, args=(source_id, seed)) for seed, source_id in enumerate(processors)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        runner.wait_until_idle()
+        stats = runner.stats
+
+    for source_id, processor in processors.items():
+        assert processor.first_samples == list(range(300)), source_id
+        assert stats[source_id]['dropped_chunks'] == 0
+
+def test_oldest_chunks_are_dropped_without_block():
+    with MultiSourceRunner(EXAMPLE_FINGERPRINTS, lambda source_id, id: None, max_pending_chunks=4) as runner:
+        processor = add_recording_source(runner, 'source', hold=True)
+        runner.push('source', numbered_chunks(1))
+        assert processor.analysing.wait(5)
+        runner.push('source', numbered_chunks(10))
+        assert runner.stats['source']['dropped_chunks'] == 6
+        processor.release.set()
+        runner.wait_until_idle()
+    assert processor.first_samples == [0, 6, 7, 8, 9]
+
+def test_blocking_push_times_out():
+    with MultiSourceRunner(EXAMPLE_FINGERPRINTS, lambda source_id, id: None, max_pending_chunks=4) as runner:
+        processor = add_recording_source(runner, 'source', hold=True)
+        runner.push('source', numbered_chunks(1))
+        assert processor.analysing.wait(5)
+
+        # Only the chunks which fitted are queued
+        with pytest.raises(TimeoutError):
+            runner.push('source', numbered_chunks(10), block=True, timeout_s=0.05)
+        assert runner.stats['source']['dropped_chunks'] == 0
+        processor.release.set()
+        runner.wait_until_idle()
+    assert processor.first_samples == [0, 0, 1, 2, 3]
+
+def test_blocking_push_raises_when_source_is_removed():
+    with MultiSourceRunner(EXAMPLE_FINGERPRINTS, lambda source_id, id: None, max_pending_chunks=4) as runner:
+        processor = add_recording_source(runner, 'source', hold=True)
+        runner.push('source', numbered_chunks(1))
+        assert processor.analysing.wait(5)
+
+        errors = []
+        def push() -> None:
+            try:
+                runner.push('source', numbered_chunks(10), block=True)
+            except ValueError as e:
+                errors.append(e)
+        pusher = threading.Thread(target=push)
+        pusher.start()
+        time.sleep(0.05)
+        runner.remove_source('source')
+        pusher.join(5)
+        processor.release.set()
+    assert len(errors) == 1
+
+@pytest.mark.parametrize('block', [False, True])
+def test_push_after_close_raises(block):
+    runner = MultiSourceRunner(EXAMPLE_FINGERPRINTS, lambda source_id, id: None)
+    processor = add_recording_source(runner, 'source')
+    runner.push('source', numbered_chunks(2))
+    runner.close()
+    assert processor.first_samples == [0, 1]
+
+    with pytest.raises(ValueError, match='runner is closed'):
+        runner.push('source', numbered_chunks(1), block=block)
+    with pytest.raises(ValueError, match='Runner is closed'):
+        runner.add_source('other', 16000, 16)
+    assert processor.first_samples == [0, 1]
+
+def test_metrics_are_recorded_for_each_source():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        with MultiSourceRunner(EXAMPLE_FINGERPRINTS, lambda source_id, id: None, metrics=Metrics('multi')) as runner:
+            runner.run_wav_files({ 'first': RECORDINGS[0], 'second': RECORDINGS[-1] }, CHUNK_LENGTH)
+            metrics = { source_id: source.chunk_processor.metrics for source_id, source in runner.sources.items() }
+            stats = runner.stats
+
+    for source_id, source_metrics in metrics.items():
+        assert source_metrics is not None
+        assert source_metrics.detector == f'multi/{source_id}'
+        assert source_metrics.chunks_processed == stats[source_id]['chunks_processed']
+
+    with MultiSourceRunner(EXAMPLE_FINGERPRINTS, lambda source_id, id: None) as runner:
+        runner.add_source('source', 16000, CHUNK_LENGTH)
+        assert runner.sources['source'].chunk_processor.metrics is None
@@ -0,0 +1,125 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.recorder import ChunkRecorder, Recording, main, replay_recording
+from beep_detect.core.wav_source import WavSource
+
+RECORDING = os.path.join(DATA_DIR, 'Washing machine finish.wav')
+CHUNK_LENGTH = 2048
+
+def summary(events) -> list[tuple[str, float]]:
+    return [(event['fingerprint_id'], round(event['t'], 6)) for event in events]
+
+class LiveDetector:
+    '''
+    Records and analyses the chunks of a file like `CapturePipeline` does, in batches of varied sizes
+    '''
+
+    def __init__(self, directory: str, duration_s: float = 600, segment_s: float = 2, **settings) -> None:
+        with WavSource(RECORDING) as source:
+            self.sample_rate = source.sample_rate
+            self.chunks = np.concatenate([block for _, block in source.iter_blocks(CHUNK_LENGTH)])
+        self.processor = ChunkProcessor(EXAMPLE_FINGERPRINTS, self.sample_rate, CHUNK_LENGTH, **settings)
+        self.recorder = ChunkRecorder(directory, self.processor, duration_s, segment_s)
+        self.rng = np.random.default_rng(0)
+        self.position = 0
+        self.matches: list[tuple[str, int]] = []
+
+    def run(self, n_chunks: int | None = None) -> None:
+        end = len(self.chunks) if n_chunks is None else min(self.position + n_chunks, len(self.chunks))
+        while self.position < end:
+            n_batch = min(int(self.rng.integers(1, 6)), end - self.position, self.recorder.chunks_left_in_segment)
+            chunks = self.chunks[self.position:self.position + n_batch]
+            capture_times = 100 + (self.position + np.arange(1, n_batch + 1)) * CHUNK_LENGTH / self.sample_rate
+            first_sequence = self.recorder.record(chunks, capture_times, self.processor)
+            if n_batch == 1:
+                results = [self.processor.analyse_chunk_for_match(chunks[0])]
+            else:
+                results = self.processor.analyse_chunks_for_matches(chunks)
+            self.recorder.record_matches(first_sequence, results)
+            self.matches += [(id, self.position + i) for i, matched_ids in enumerate(results) for id in sorted(matched_ids)]
+            self.position += n_batch
+
+@pytest.fixture(autouse=True)
+def ignore_log10_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        yield
+
+def test_full_replay_reproduces_live_matches(tmp_path):
+    detector = LiveDetector(str(tmp_path))
+    detector.run()
+    detector.recorder.close()
+
+    runner = FileInputRunner(EXAMPLE_FINGERPRINTS, RECORDING, CHUNK_LENGTH)
+    expected = [event['fingerprint_id'] for event in runner.iter_matches()]
+    runner.source.close()
+
+    recording = Recording(str(tmp_path))
+    assert recording.n_chunks == len(detector.chunks)
+    result = replay_recording(recording)
+    assert result['exact']
+    assert [event['fingerprint_id'] for event in result['live_events']] == expected
+    assert summary(result['events']) == summary(result['live_events'])
+
+def test_windowed_replay(tmp_path):
+    detector = LiveDetector(str(tmp_path))
+    detector.run()
+    detector.recorder.close()
+    recording = Recording(str(tmp_path))
+
+    # Starts part way into a segment, and leaves out the first match
+    result = replay_recording(recording, start_s=11.3, end_s=17)
+    assert result['exact']
+    assert [event['fingerprint_id'] for event in result['live_events']] == ['microwave', 'washing']
+    assert summary(result['events']) == summary(result['live_events'])
+
+    # With different settings the window is analysed from a fresh state, warmed up on the audio before it
+    result = replay_recording(recording, start_s=11.3, end_s=17, matcher='compiled')
+    assert not result['exact']
+    assert summary(result['events']) == summary(result['live_events'])
+
+def test_replay_while_recording(tmp_path):
+    detector = LiveDetector(str(tmp_path))
+    detector.run(n_chunks=350)
+
+    # The open segment's matches are on disk as soon as they are recorded
+    recording = Recording(str(tmp_path))
+    assert recording.n_chunks == 350
+    result = replay_recording(recording)
+    assert [event['fingerprint_id'] for event in result['live_events']] == ['microwave', 'microwave']
+    assert summary(result['events']) == summary(result['live_events'])
+    main([str(tmp_path), '-o', str(tmp_path / 'events.jsonl')])
+
+    # A batch which has been recorded but not analysed yet is left out
+    first_sequence = detector.recorder.record(detector.chunks[350:352], 100 + np.arange(351, 353) * CHUNK_LENGTH / detector.sample_rate, detector.processor)
+    assert Recording(str(tmp_path)).n_chunks == 350
+    detector.recorder.record_matches(first_sequence, detector.processor.analyse_chunks_for_matches(detector.chunks[350:352]))
+    detector.position = 352
+    assert Recording(str(tmp_path)).n_chunks == 352
+
+    detector.run()
+    detector.recorder.close()
+    result = replay_recording(Recording(str(tmp_path)))
+    assert [event['fingerprint_id'] for event in result['live_events']] == ['microwave', 'microwave', 'washing']
+    assert summary(result['events']) == summary(result['live_events'])
+
+def test_replay_after_ring_wraps(tmp_path):
+    # Only the last few seconds are retained, starting from a segment's snapshot of the live state
+    detector = LiveDetector(str(tmp_path), duration_s=8, segment_s=2)
+    detector.run()
+    detector.recorder.close()
+
+    recording = Recording(str(tmp_path))
+    assert recording.duration_s < 11
+    result = replay_recording(recording)
+    assert result['exact']
+    assert [event['fingerprint_id'] for event in result['live_events']] == ['microwave', 'washing']
+    assert summary(result['events']) == summary(result['live_events'])
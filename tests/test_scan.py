@@ -0,0 +1,82 @@
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import warnings
+
+import pytest
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.scan import main, scan_files, scan_segment, split_into_segments
+
+RECORDINGS = sorted(glob.glob(os.path.join(DATA_DIR, '*.wav')))
+CHUNK_LENGTH = 2048
+
+def sequential_events(matcher: str, batch: bool) -> list[dict]:
+    events = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for file_name in RECORDINGS:
+            runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, CHUNK_LENGTH, matcher=matcher)
+            events.extend({ 'file': file_name, **event } for event in runner.iter_matches(batch=batch))
+            runner.source.close()
+    return events
+
+def read_events(file_name: str) -> list[dict]:
+    with open(file_name) as f:
+        return [json.loads(line) for line in f]
+
+@pytest.fixture(autouse=True)
+def ignore_log10_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        yield
+
+@pytest.mark.parametrize('matcher', ['dict', 'compiled'])
+@pytest.mark.parametrize('batch', [True, False], ids=['batch', 'per_chunk'])
+def test_parallel_segments_match_sequential_scan(tmp_path, matcher, batch):
+    fingerprints_file = tmp_path / 'fingerprints.json'
+    fingerprints_file.write_text(json.dumps(EXAMPLE_FINGERPRINTS))
+    output = tmp_path / 'events.jsonl'
+
+    # Segments of 1.5s split matches in progress, both microwave beeps and washing machine beeps
+    argv = [*RECORDINGS, '-f', str(fingerprints_file), '-o', str(output), '-j', '2', '--segment-s', '1.5', '--matcher', matcher]
+    main(argv if batch else [*argv, '--per-chunk'])
+
+    expected = sequential_events(matcher, batch)
+    assert len(expected) > 0
+    assert read_events(str(output)) == expected
+
+def test_handed_over_state_continues_the_scan():
+    # Each segment starts from the end state of the previous one, with no warm-up, as when rescanned
+    file_name = RECORDINGS[-1]
+    events = []
+    match_state = None
+    for job in split_into_segments(file_name, CHUNK_LENGTH, 1.5):
+        result = scan_segment(EXAMPLE_FINGERPRINTS, { **job, 'initial_match_state': match_state }, CHUNK_LENGTH, 'compiled')
+        if match_state is not None:
+            assert result['start_match_state'] == match_state
+        events.extend({ 'file': file_name, **event } for event in result['events'])
+        match_state = result['end_match_state']
+
+    assert events == [event for event in sequential_events('compiled', True) if event['file'] == file_name]
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='workers must inherit the patched warm-up')
+def test_segments_are_rescanned_when_warm_up_does_not_converge(monkeypatch, caplog, tmp_path):
+    # A warm-up of one chunk leaves segments which start part way through a match in the wrong state
+    monkeypatch.setattr(ChunkProcessor, 'match_span_chunks', lambda self: 1)
+    output = tmp_path / 'events.jsonl'
+    with caplog.at_level(logging.INFO), open(output, 'w') as f:
+        scan_files(EXAMPLE_FINGERPRINTS, RECORDINGS, f, workers=2, segment_s=1.5)
+
+    assert any('rescanning segment' in record.getMessage() for record in caplog.records)
+    expected = sequential_events('compiled', True)
+    assert read_events(str(output)) == expected
+
+    # Matches found by segments which were then rescanned are not logged
+    match_logs = [record.getMessage() for record in caplog.records if 'Match for' in record.getMessage()]
+    assert len(match_logs) == len(expected)
@@ -0,0 +1,81 @@
+import importlib
+import warnings
+
+import numpy as np
+import pytest
+
+from beep_detect.core import spectral
+
+scipy_signal = pytest.importorskip('scipy.signal')
+scipy_fft = pytest.importorskip('scipy.fft')
+
+@pytest.fixture
+def numpy_only(monkeypatch):
+    # As if SciPy were not installed: the lazy import fails, and nothing imported before the test is reused
+    def import_module(name, *args, **kwargs):
+        if name.startswith('scipy'):
+            raise ImportError(f'No module named {name!r}')
+        return importlib.import_module(name, *args, **kwargs)
+    monkeypatch.setattr(spectral.importlib, 'import_module', import_module)
+    monkeypatch.setattr(spectral, '_scipy_modules', {})
+
+def random_spectrum(rng: np.random.Generator, n: int) -> np.ndarray:
+    kind = rng.integers(3)
+    if kind == 0:
+        # Spectrum in dB of noise with a few tones
+        x = 10 * np.log10(np.abs(np.fft.rfft(rng.normal(size=2 * n)))[1:n + 1] + 1e-3)
+        x[rng.integers(n, size=3)] += 20
+        return x
+    if kind == 1:
+        # Few distinct values, so plenty of plateaus, including at the edges
+        return rng.integers(0, 4, n).astype(np.float64)
+    # Runs of random lengths, so plateaus of every width
+    return np.repeat(rng.normal(size=n), rng.integers(1, 5, n))[:n]
+
+def test_fallback_is_used(numpy_only):
+    assert spectral.scipy_module('signal') is None
+    assert spectral.scipy_module('fft') is None
+
+@pytest.mark.parametrize('seed', range(50))
+def test_find_peaks_matches_scipy(numpy_only, seed):
+    rng = np.random.default_rng(seed)
+    x = random_spectrum(rng, int(rng.integers(1, 300)))
+    for kwargs in [
+        {},
+        { 'distance': 1 },
+        { 'distance': float(rng.uniform(1, 20)) },
+        { 'prominence': float(rng.uniform(0, 3)) },
+        { 'prominence': float(rng.uniform(0, 3)), 'wlen': int(rng.integers(3, 40)) },
+        { 'prominence': float(rng.uniform(0, 3)), 'distance': int(rng.integers(1, 20)), 'wlen': float(rng.uniform(3, 40)) }
+    ]:
+        peaks, properties = spectral.find_peaks(x, **kwargs)
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', 'some peaks have a prominence of 0')
+            expected, expected_properties = scipy_signal.find_peaks(x, **kwargs)
+        np.testing.assert_array_equal(peaks, expected, err_msg=str(kwargs))
+        if 'prominence' in kwargs:
+            np.testing.assert_allclose(properties['prominences'], expected_properties['prominences'], err_msg=str(kwargs))
+
+def test_find_peaks_edges_and_plateaus(numpy_only):
+    # Edges are never peaks, and a plateau peak is reported at its middle, rounding down
+    for x in ([3., 1., 2.], [1., 2., 2., 1.], [1., 2., 2., 2., 1.], [2., 2., 1., 3., 3.], [1., 2.], [1.], []):
+        peaks = spectral.find_peaks(np.array(x))[0]
+        np.testing.assert_array_equal(peaks, scipy_signal.find_peaks(np.array(x))[0], err_msg=str(x))
+
+@pytest.mark.parametrize('numtaps, cutoff', [(33, 0.5), (65, 0.25), (129, 0.125), (8, 0.3), (1, 0.5)])
+def test_firwin_matches_scipy(numpy_only, numtaps, cutoff):
+    np.testing.assert_allclose(spectral.firwin(numtaps, cutoff), scipy_signal.firwin(numtaps, cutoff), atol=1e-12)
+
+@pytest.mark.parametrize('window', ['boxcar', 'hann', 'hamming', 'blackman'])
+@pytest.mark.parametrize('fftbins', [True, False])
+def test_get_window_matches_scipy(numpy_only, window, fftbins):
+    for n in (1, 2, 7, 256):
+        np.testing.assert_allclose(spectral.get_window(window, n, fftbins), scipy_signal.get_window(window, n, fftbins), atol=1e-12)
+
+def test_get_window_without_scipy_rejects_other_windows(numpy_only):
+    with pytest.raises(ValueError, match='needs SciPy'):
+        spectral.get_window('flattop', 16)
+
+def test_rfft_matches_scipy(numpy_only):
+    x = np.random.default_rng(0).normal(size=(4, 512)).astype(np.float32)
+    np.testing.assert_allclose(spectral.rfft(x), scipy_fft.rfft(x), rtol=1e-4, atol=1e-3)
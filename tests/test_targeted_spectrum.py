@@ -0,0 +1,80 @@
+import glob
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from beep_detect.bench.fingerprints import EXAMPLE_FINGERPRINTS
+from beep_detect.bench.recordings import DATA_DIR
+from beep_detect.core.chunk_processor import ChunkProcessor
+from beep_detect.core.file_input_runner import FileInputRunner
+from beep_detect.core.targeted_spectrum import TargetedSpectrum
+from beep_detect.core.wav_source import WavSource
+
+RECORDINGS = sorted(glob.glob(os.path.join(DATA_DIR, '*.wav')))
+CHUNK_LENGTH = 2048
+
+def targeted_spectrum(processor: ChunkProcessor, context_bins: int | None = None) -> TargetedSpectrum:
+    plan = processor.plan
+    return TargetedSpectrum(plan.chunkmaps, CHUNK_LENGTH, plan.frequency_bands, plan.tolerance_f, plan.peak_prominence, plan.peak_distance, context_bins, plan.window_values)
+
+def recording_chunks(file_name: str) -> tuple[np.ndarray, int]:
+    with WavSource(file_name) as source:
+        return np.concatenate([block for _, block in source.iter_blocks(CHUNK_LENGTH)]), source.sample_rate
+
+@pytest.mark.parametrize('file_name', RECORDINGS, ids=os.path.basename)
+@pytest.mark.parametrize('window, context_bins', [(None, 1), ('hann', 2)])
+def test_dft_path_for_example_fingerprints(file_name, window, context_bins):
+    chunks, sample_rate = recording_chunks(file_name)
+    processor = ChunkProcessor(EXAMPLE_FINGERPRINTS, sample_rate, CHUNK_LENGTH, window=window)
+
+    # A context as wide as a tone's main lobe leaves few enough bins for the DFT matrix
+    spectrum = targeted_spectrum(processor, context_bins)
+    assert spectrum.dft_matrix is not None
+    rfft_spectrum = targeted_spectrum(processor, context_bins)
+    rfft_spectrum.dft_matrix = None
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        peaks = spectrum.find_peaks(chunks)
+        expected = rfft_spectrum.find_peaks(chunks)
+    assert sum(len(p) for p in expected) > 0
+    assert [p.tolist() for p in peaks] == [p.tolist() for p in expected]
+
+def test_narrow_context_finds_peaks_at_target_edges():
+    sample_rate = 48000
+    processor = ChunkProcessor(EXAMPLE_FINGERPRINTS, sample_rate, CHUNK_LENGTH)
+    spectrum = targeted_spectrum(processor, 1)
+
+    # A tone on each bin of every target range, closer to the window edges than `peak_distance`. Peak index i is
+    # rFFT bin i+1.
+    rng = np.random.default_rng(0)
+    t = np.arange(CHUNK_LENGTH) / sample_rate
+    target_peaks = np.flatnonzero(spectrum.is_target)
+    chunks = np.array([
+        10000 * np.sin(2 * np.pi * processor.frequency_bands[peak + 1] * t) + rng.normal(0, 1, CHUNK_LENGTH)
+        for peak in target_peaks
+    ])
+    peaks = spectrum.find_peaks(chunks)
+    for peak, chunk_peaks in zip(target_peaks, peaks):
+        assert peak in chunk_peaks
+
+@pytest.mark.parametrize('file_name', RECORDINGS, ids=os.path.basename)
+def test_default_context_has_same_matches_as_fft(file_name):
+    matches = {}
+    for spectrum_backend in ('fft', 'targeted'):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            runner = FileInputRunner(EXAMPLE_FINGERPRINTS, file_name, CHUNK_LENGTH, spectrum_backend=spectrum_backend)
+            try:
+                matches[spectrum_backend] = list(runner.iter_matches())
+            finally:
+                runner.source.close()
+    assert len(matches['fft']) > 0
+    assert matches['targeted'] == matches['fft']
+
+def test_context_must_reach_past_target_edges():
+    processor = ChunkProcessor(EXAMPLE_FINGERPRINTS, 48000, CHUNK_LENGTH)
+    with pytest.raises(ValueError, match='too small'):
+        targeted_spectrum(processor, 0)